@@ -0,0 +1,206 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Temporal aggregation of AOM and ROM for fast approximate annual costs. Two methods:
+# - Resampling: every `factor` consecutive time intervals are averaged into one (6 turns 5-minute steps into 30-minute steps,
+#   12 into hourly steps). Δt follows from the number of time intervals (read.readSetting), so the models and the annual
+#   costs are unchanged, only smaller.
+# - Representative days: the days of the year are clustered on the client's load, PV and price profiles into k clusters. The
+#   day closest to the centre of each cluster is solved with the usual constraints, and its costs are weighted by the number
+#   of days in its cluster to give the annual costs. Every day is periodic: its SOC at midnight is free within the SOC limits
+#   but the same at both ends, so the energy carried over night is neither free at the start nor sold off before the end.
+# `compare_with_full_resolution` reports the cost error and the model size against the full-resolution run.
+
+# Imports ---------------------------------------------------------------------
+from collections import OrderedDict
+from copy import copy
+from time import time
+import numpy as np
+import pandas as pd
+from scipy.cluster.vq import kmeans2
+from model import *
+from read import *
+from rolling import window_costs
+
+## Resampling ---------------------------------------------------------------------
+def resample_data(data, factor):
+    '''Average every `factor` consecutive time intervals of the data into one time interval
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            factor (Int): Number of time intervals merged, the number of time intervals must be a multiple of it
+
+        Returns:
+            coarse (OrderedDict): Data with len(data["T"]) / factor time intervals of factor * Δt hours
+    '''
+    lenT = len(data["T"])
+    if lenT % factor:
+        raise ValueError(f"The {lenT} time intervals cannot be resampled by a factor of {factor}")
+    coarse = OrderedDict(data)
+    for key in TIME_SERIES:
+        if key not in data:
+            continue
+        if key == "Time":
+            coarse[key] = data[key].iloc[::factor].reset_index(drop=True)
+        elif isinstance(data[key], dict):
+            coarse[key] = {k: average(v, factor) for k, v in data[key].items()}
+        else:
+            coarse[key] = average(data[key], factor)
+    coarse["T"]  = range(lenT // factor)
+    coarse["Δt"] = data["Δt"] * factor
+    print(f"------------------------------Resampled {lenT} to {lenT // factor} time intervals of {coarse['Δt']:.2f} h------------------------------")
+    return coarse
+
+def average(series, factor):
+    '''Mean of every `factor` consecutive rows of a DataFrame, Series, array or LazyColumns
+    '''
+    if isinstance(series, LazyColumns):
+        return series.resample(factor)
+    values = np.asarray(series, dtype=float)
+    mean   = values.reshape(len(values) // factor, factor, *values.shape[1:]).mean(axis=1)
+    if isinstance(series, pd.DataFrame):
+        return pd.DataFrame(mean, columns=series.columns)
+    if isinstance(series, pd.Series):
+        return pd.Series(mean, name=series.name)
+    return mean
+
+## Representative days ---------------------------------------------------------------------
+def Representative_Days_Model(data, outputs, cnum, tnum=None, Model="AOM", days=12, saveDetail=False, FCAS=True, solver="cplex",
+                              solver_threads=None, solver_options=None, compact=False):
+    '''Approximate the annual costs of client cnum (under tariff tnum) from `days` representative days
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM
+            Model (String, optional): "AOM" or "ROM"
+            days (Int, optional): Number of representative days
+            saveDetail (bool, optional): Must be False, representative days give no annual time series
+            FCAS (bool, optional): Whether to participate in FCAS markets (AOM only)
+            solver (String, optional): Name of the solver, e.g. "cplex" or "glpk"
+            solver_threads (Int, optional): Number of threads the solver may use, None for the solver's default
+            solver_options (dict, optional): Solver options (model.get_solver)
+            compact (bool, optional): Whether to build the compact formulation of each day (model.build_aggregator_model)
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    if saveDetail:
+        raise ValueError("Representative days give no annual variable values, set inputs['saveDetail'] to False")
+    FCAS    = FCAS and Model == "AOM"
+    per_day = intervals_per_day(data)
+    opt     = get_solver(solver, solver_threads, solver_options)
+    costs   = {"total_net_cost": 0, "energy_net_cost": 0, "FCAS_net_cost": 0, "cost_c": 0}
+    outputs["time"][cnum] = 0
+
+    for day, weight in representative_days(data, cnum, tnum, days, FCAS).items():
+        ddata = slice_data(data, day * per_day, (day + 1) * per_day)
+        if Model == "AOM":
+            m = build_aggregator_model(ddata, cnum, FCAS, compact=compact)
+        else:
+            m = build_retail_model(ddata, cnum, tnum, compact=compact)
+        periodic_SOC(m, ddata, cnum, Model)
+        clock    = time()
+        solution = solve_model(m, opt, ddata, cnum, tnum if Model == "ROM" else None)
+        solve_time, n_vars, n_constraints = solver_statistics(m, solution, time() - clock)
+        print(f"------------------------------Day {day} (weight {weight:.1f}) done: {solution.solver.termination_condition}------------------------------")
+
+        # Solver output, the model size is the one of a single day
+        outputs["time"][cnum]       += solve_time
+        outputs["bin_vars"][cnum]    = count_binaries(m)
+        outputs["real_vars"][cnum]   = n_vars - count_binaries(m)
+        outputs["constraints"][cnum] = n_constraints
+        day_costs = dict.fromkeys(costs, 0)
+        window_costs(m, ddata, cnum, tnum, per_day, Model, FCAS, day_costs)
+        for key in costs:
+            costs[key] += weight * day_costs[key]
+
+    for key, cost in costs.items():
+        if key in outputs:
+            outputs[key][cnum] = cost
+    print(f'Representative days cost: {outputs["total_net_cost"][cnum]}')
+    print("-----------------------------Outputs done--------------------------------")
+    return outputs
+
+def periodic_SOC(m, data, cnum, Model="AOM"):
+    '''Free the SOC at the start of the day within the SOC limits and make the day end with the same SOC
+    '''
+    m.socc.deactivate()
+    m.SOC[0].setlb(data["Min_SOC"])
+    m.SOC[0].setub(data["Max_SOC"] if Model == "AOM" else data["Max_SOC"][cnum])
+    m.periodic = Constraint(expr=m.SOC[len(m.T)] == m.SOC[0])
+
+def representative_days(data, cnum, tnum=None, days=12, FCAS=False, seed=0):
+    '''Cluster the days of the year on the standardised load, PV and price profiles of client cnum with k-means
+
+        Returns:
+            weights (OrderedDict): day number -> number of days it represents, for the day closest to each cluster centre.
+                The weights add up to the number of days of the year.
+    '''
+    per_day  = intervals_per_day(data)
+    n_days   = len(data["T"]) // per_day
+    prices   = [data["energy_price"]] if tnum is None else [data["tariff_buy"][str(tnum)]]
+    if FCAS:
+        prices += [data["R_FCAS_price"][:, w] for w in data["W"]] + [data["L_FCAS_price"][:, w] for w in data["W"]]
+    profiles = [data["load"].iloc[:, cnum], data["PV"].iloc[:, cnum]] + prices
+    features = np.hstack([standardise(np.asarray(profile, dtype=float)[:n_days * per_day]).reshape(n_days, per_day) for profile in profiles])
+
+    centres, labels = kmeans2(features, min(days, n_days), minit="++", seed=seed)
+    weights = OrderedDict()
+    for cluster in np.unique(labels):
+        members = np.flatnonzero(labels == cluster)
+        closest = members[np.argmin(((features[members] - centres[cluster]) ** 2).sum(axis=1))]
+        # The time intervals after the last whole day are spread over the clusters
+        weights[int(closest)] = len(members) * len(data["T"]) / (n_days * per_day)
+    return OrderedDict(sorted(weights.items()))
+
+def intervals_per_day(data):
+    '''Number of time intervals in a day
+    '''
+    per_day = 24 / data["Δt"]
+    if abs(per_day - round(per_day)) > 1e-6:
+        raise ValueError(f"A day is not a whole number of time intervals of {data['Δt']} h")
+    return int(round(per_day))
+
+def standardise(profile):
+    '''Profile with mean 0 and standard deviation 1 (0 if it is constant)
+    '''
+    std = profile.std()
+    return (profile - profile.mean()) / std if std > 0 else profile - profile.mean()
+
+## Comparison with the full resolution ---------------------------------------------------------------------
+def compare_with_full_resolution(inputs, data, outputs, tnum=None):
+    '''Solve the clients of inputs at full resolution and print the cost error, model size and solver time of the
+        aggregated outputs against it
+
+        Args:
+            data (OrderedDict): Full-resolution data (before resample_data)
+
+        Returns:
+            report (OrderedDict): client ID -> full cost, aggregated cost, absolute and relative error, model size reduction, solver times
+    '''
+    from runner import run_clients
+    full_inputs = copy(inputs)
+    full_inputs["representative_days"] = None
+    full_inputs["resample"]            = None
+    full_inputs["checkpoint"]          = False
+    full_inputs["metrics"]             = False
+    full_inputs["progress"]            = False
+    full_outputs = run_clients(full_inputs, data, initialisation(full_inputs, data), tnum)
+
+    report = OrderedDict()
+    print("------------------------------Temporal aggregation report------------------------------")
+    for cnum in range(inputs["start_client"], inputs["end_client"] + 1):
+        full  = full_outputs["total_net_cost"][cnum]
+        aggr  = outputs["total_net_cost"][cnum]
+        error = aggr - full
+        size  = (full_outputs["real_vars"][cnum] + full_outputs["bin_vars"][cnum]) / max(outputs["real_vars"][cnum] + outputs["bin_vars"][cnum], 1)
+        report[cnum] = {"full_cost": full, "aggregated_cost": aggr, "error": error, "relative_error": error / abs(full) if full else 0.0,
+                        "size_reduction": size, "full_time": full_outputs["time"][cnum], "aggregated_time": outputs["time"][cnum]}
+        print(f'client {cnum}: full {full:.4f}, aggregated {aggr:.4f}, error {error:.4f} ({100 * report[cnum]["relative_error"]:.3f}%), '
+              f'model {size:.0f}x smaller, solver time {report[cnum]["full_time"]:.2f}s -> {report[cnum]["aggregated_time"]:.2f}s')
+    return report
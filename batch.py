@@ -0,0 +1,390 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Multi-node batch runner on a shared filesystem (e.g. an NFS mount), without a scheduler. The configuration of main.py is
+# split into work units, one per (client, tariff) for ROM and per (client, FCAS) for AOM, stored as files in a queue directory:
+#   <queue>/config.json    configuration of the run (inputs of main.py when it was enqueued)
+#   <queue>/pending/       units waiting for a node
+#   <queue>/claimed/       units being solved; a node claims a unit by renaming it from pending/ (atomic, so only one node
+#                          gets it) and touches it every `heartbeat` seconds while solving it
+#   <queue>/done/          results of the completed units (the client slices of runner.outputs_slice)
+#   <queue>/failed/        units whose solve raised an error, with the error
+# A claimed unit that has not been touched for `stale` seconds belongs to a dead node and is put back into pending/. When all
+# units are done, one node (the first to create <queue>/merge.lock) or `python batch.py merge` writes the usual COST.csv and
+# variable files from the results.
+#
+# Usage: python batch.py enqueue <queue> [--both-FCAS]       split the run configured in main.py into units
+#        python batch.py work <queue> [--workers 4] [--merge]  run a node, --nodes 3 runs three nodes on this machine
+#        python batch.py merge <queue>                        write the outputs of a completed queue
+#        python batch.py status <queue>
+
+# Imports ---------------------------------------------------------------------
+import argparse
+import ctypes
+import ctypes.util
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import socket
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from copy import copy
+from read import *
+from write import *
+from runner import *
+from checkpoint import output_directory, write_part, read_part
+from time import sleep
+
+QUEUE_STATES = ["pending", "claimed", "done", "failed"]
+# prctl option that sends a signal to a process when its parent dies (linux/prctl.h)
+PR_SET_PDEATHSIG = 1
+
+## Queue ---------------------------------------------------------------------
+def enqueue(queue, inputs, both_FCAS=False, reset=False):
+    '''Split the run configured in inputs into work units in the queue directory
+
+        Args:
+            queue (String): Queue directory on the shared filesystem
+            inputs (OrderedDict): MILP model configuration (main.py)
+            both_FCAS (bool, optional): Whether to queue the AOM with and without FCAS instead of inputs["FCAS"] only
+            reset (bool, optional): Whether to delete an existing queue first
+
+        Returns:
+            units (list): The queued units
+    '''
+    if reset and os.path.exists(queue):
+        shutil.rmtree(queue)
+    config = json.loads(json.dumps(inputs, default=list))
+    config.update(checkpoint=False, sweep=None, both_FCAS=both_FCAS)
+    if os.path.exists(f'{queue}/config.json'):
+        if load_config(queue) != config:
+            raise ValueError(f"{queue} holds a run with another configuration, use another queue directory or --reset")
+    for state in QUEUE_STATES:
+        os.makedirs(f'{queue}/{state}', exist_ok=True)
+    write_json(f'{queue}/config.json', config)
+
+    units = work_units(config)
+    for unit in units:
+        if not any(os.path.exists(unit_path(queue, state, unit)) for state in QUEUE_STATES):
+            write_json(unit_path(queue, "pending", unit), unit)
+    print(f"------------------------------{len(units)} units queued in {queue}------------------------------")
+    return units
+
+def work_units(config):
+    '''Units of the run: {"client", "tariff", "FCAS"} for every client and every tariff (ROM) or FCAS setting (AOM)
+    '''
+    clients = range(config["start_client"], config["end_client"] + 1)
+    if config["Model"] == "ROM":
+        return [{"client": cnum, "tariff": tnum, "FCAS": False} for tnum in config["tariffs"] for cnum in clients]
+    FCAS = [True, False] if config["both_FCAS"] else [config["FCAS"]]
+    return [{"client": cnum, "tariff": None, "FCAS": with_FCAS} for with_FCAS in FCAS for cnum in clients]
+
+def unit_name(unit):
+    if unit["tariff"] is not None:
+        return f'ROM_tariff_{unit["tariff"]}_client_{unit["client"]}'
+    return f'AOM_{"with" if unit["FCAS"] else "without"}_FCAS_client_{unit["client"]}'
+
+def unit_path(queue, state, unit):
+    return f'{queue}/{state}/{unit_name(unit)}.{"npz" if state == "done" else "json"}'
+
+def claim_unit(queue, node):
+    '''Claim a pending unit for node, None if there is none
+    '''
+    for name in unit_files(queue, "pending"):
+        path = f'{queue}/claimed/{name}'
+        try:
+            # Touched before the rename, which keeps the mtime, so that requeue_stale never takes a unit enqueued long ago
+            # back from claimed/ before this node could touch it there
+            os.utime(f'{queue}/pending/{name}')
+            os.rename(f'{queue}/pending/{name}', path)
+            unit = read_json(path)
+        except FileNotFoundError:
+            # Claimed by another node first
+            continue
+        if os.path.exists(unit_path(queue, "done", unit)):
+            os.remove(path)
+            continue
+        unit.update(node=node, attempts=unit.get("attempts", 0) + 1)
+        write_json(path, unit)
+        return unit
+    return None
+
+def requeue_stale(queue, stale=300):
+    '''Put the claimed units that have not been touched for `stale` seconds back into pending/
+
+        Returns:
+            requeued (list): Names of the requeued units
+    '''
+    requeued = []
+    now      = filesystem_time(queue)
+    for name in unit_files(queue, "claimed"):
+        try:
+            if now - os.path.getmtime(f'{queue}/claimed/{name}') > stale:
+                os.rename(f'{queue}/claimed/{name}', f'{queue}/pending/{name}')
+                requeued.append(name)
+        except FileNotFoundError:
+            continue
+    if requeued:
+        print(f"------------------------------Requeued the units of dead nodes: {', '.join(requeued)}------------------------------")
+    return requeued
+
+def filesystem_time(queue):
+    '''Current time of the shared filesystem, so that heartbeats are compared without the clock skew between nodes
+    '''
+    path = f'{queue}/claimed/.clock_{socket.gethostname()}_{os.getpid()}'
+    with open(path, "w"):
+        pass
+    now = os.path.getmtime(path)
+    os.remove(path)
+    return now
+
+def complete_unit(queue, unit, client_slice):
+    '''Store the results of a unit in done/ and release its claim
+    '''
+    write_part(unit_path(queue, "done", unit), client_slice)
+    remove(unit_path(queue, "claimed", unit))
+
+def fail_unit(queue, unit, error):
+    '''Move a unit whose solve raised an error to failed/, with the error
+    '''
+    unit["error"] = repr(error)
+    write_json(unit_path(queue, "failed", unit), unit)
+    remove(unit_path(queue, "claimed", unit))
+    print(f"------------------------------{unit_name(unit)} failed: {error!r}------------------------------")
+
+def queue_status(queue):
+    '''Number of units in each state
+    '''
+    return OrderedDict((state, len(unit_files(queue, state))) for state in QUEUE_STATES)
+
+def unit_files(queue, state):
+    '''Names of the unit files in a state directory, without the temporary files being written
+    '''
+    extension = ".npz" if state == "done" else ".json"
+    return sorted(name for name in os.listdir(f'{queue}/{state}') if name.endswith(extension) and not name.endswith(".tmp" + extension))
+
+## Nodes ---------------------------------------------------------------------
+def run_node(queue, workers=1, heartbeat=30, stale=300, merge=False, node=None):
+    '''Claim and solve units until the queue is empty, on a process pool of `workers` processes
+
+        Args:
+            queue (String): Queue directory on the shared filesystem
+            workers (Int, optional): Number of units solved at once on this node
+            heartbeat (float, optional): Seconds between the touches of the claimed units
+            stale (float, optional): Seconds without a touch after which a claimed unit is requeued
+            merge (bool, optional): Whether to merge the results if this node is the first to find all units done
+            node (String, optional): Name of the node in the claimed units, hostname-pid by default
+
+        Returns:
+            solved (Int): Number of units solved by this node
+    '''
+    config  = load_config(queue)
+    inputs  = unit_inputs(config)
+    data    = read_data(inputs)
+    node    = node or f'{socket.gethostname()}-{os.getpid()}'
+    running = {}
+    solved  = 0
+    print(f"------------------------------Node {node}: {workers} workers on {queue}------------------------------")
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_node_worker, initargs=(inputs, data, os.getpid())) as pool:
+        while True:
+            requeue_stale(queue, stale)
+            while len(running) < workers:
+                unit = claim_unit(queue, node)
+                if unit is None:
+                    break
+                running[pool.submit(solve_unit, unit)] = unit
+            if not running:
+                # Other nodes may still die and leave units to requeue
+                if not queue_status(queue)["claimed"]:
+                    break
+                sleep(heartbeat)
+                continue
+
+            completed, _ = wait(running, timeout=heartbeat, return_when=FIRST_COMPLETED)
+            for future in completed:
+                unit = running.pop(future)
+                try:
+                    client_slice, metrics = future.result()
+                except Exception as error:
+                    fail_unit(queue, unit, error)
+                    continue
+                complete_unit(queue, unit, client_slice)
+                log_metrics(inputs, OrderedDict(node=node, unit=unit_name(unit), **metrics))
+                solved += 1
+            for unit in running.values():
+                touch(unit_path(queue, "claimed", unit))
+
+    print(f"------------------------------Node {node}: {solved} units solved------------------------------")
+    if merge and not any(queue_status(queue)[state] for state in ["pending", "claimed"]):
+        try:
+            os.mkdir(f'{queue}/merge.lock')
+        except FileExistsError:
+            return solved
+        merge_queue(queue)
+    return solved
+
+def run_local_nodes(queue, nodes=2, **kwargs):
+    '''Run `nodes` nodes as separate processes on this machine, standing in for the cluster nodes
+    '''
+    processes = [multiprocessing.Process(target=run_node, args=(queue,), kwargs=dict(kwargs, node=f'{socket.gethostname()}-node{i}'))
+                 for i in range(nodes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+def init_node_worker(inputs, data, node_pid):
+    '''runner.init_worker in a worker process that exits when its node dies, so that a killed node leaves no orphaned
+        workers solving units that are requeued to other nodes
+    '''
+    exit_with_parent(node_pid)
+    init_worker(inputs, data)
+
+def exit_with_parent(parent_pid, interval=1):
+    '''Terminate this process when the process parent_pid dies: by PR_SET_PDEATHSIG on Linux, otherwise by a watchdog thread
+        that checks the parent process every `interval` seconds
+    '''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        pdeathsig = libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM, 0, 0, 0) == 0
+    except (OSError, AttributeError):
+        pdeathsig = False
+    # The parent may have died before the signal was set
+    if os.getppid() != parent_pid:
+        os._exit(1)
+    if not pdeathsig:
+        def watchdog():
+            while os.getppid() == parent_pid:
+                sleep(interval)
+            os._exit(1)
+        threading.Thread(target=watchdog, daemon=True).start()
+
+def solve_unit(unit):
+    '''Solve a unit in a worker process of init_node_worker
+
+        Returns:
+            client_slice (dict): Results of the client (runner.outputs_slice)
+            metrics (OrderedDict): Metrics of the client (instrumentation.end_client)
+    '''
+    inputs = copy(worker_state["inputs"])
+    inputs.update(FCAS=unit["FCAS"], start_client=unit["client"], end_client=unit["client"])
+    data    = worker_state["data"]
+    outputs = initialisation(inputs, data)
+    begin_client(unit["client"], unit["tariff"])
+    outputs = solve_client(inputs, data, outputs, unit["client"], unit["tariff"])
+    return outputs_slice(outputs, unit["client"]), end_client(outputs, unit["client"])
+
+## Merge ---------------------------------------------------------------------
+def merge_queue(queue):
+    '''Write COST.csv and the variable files of every tariff or FCAS setting from the results of a completed queue
+
+        Returns:
+            merged (bool): False if some units are not done
+    '''
+    config  = load_config(queue)
+    units   = work_units(config)
+    missing = [unit_name(unit) for unit in units if not os.path.exists(unit_path(queue, "done", unit))]
+    if missing:
+        print(f"------------------------------{len(missing)} units not done: {', '.join(missing[:10])}------------------------------")
+        return False
+
+    inputs = unit_inputs(config)
+    data   = read_data(inputs)
+    for tnum, FCAS in OrderedDict.fromkeys((unit["tariff"], unit["FCAS"]) for unit in units):
+        group_inputs = copy(inputs)
+        group_inputs["FCAS"] = FCAS
+        outputs = initialisation(group_inputs, data)
+        for unit in units:
+            if (unit["tariff"], unit["FCAS"]) == (tnum, FCAS):
+                merge_slice(outputs, unit["client"], read_part(unit_path(queue, "done", unit)))
+        outputdir = output_directory(group_inputs, tnum)
+        os.makedirs(f'{os.getcwd()}/output/{outputdir}', exist_ok=True)
+        write_cost_outputs(outputs, group_inputs, data, outputdir)
+        if group_inputs["saveDetail"]:
+            if group_inputs["Model"] == "AOM":
+                write_var_output(outputs, group_inputs, data, outputdir)
+            else:
+                write_var_output_v2(outputs, group_inputs, data, outputdir)
+        print(f"------------------------------Merged {outputdir}------------------------------")
+    return True
+
+## Configuration ---------------------------------------------------------------------
+def load_config(queue):
+    return read_json(f'{queue}/config.json')
+
+def unit_inputs(config):
+    '''Configuration of the units as an inputs dictionary of main.py
+    '''
+    inputs = OrderedDict(config)
+    inputs["tariffs"] = list(config["tariffs"])
+    return inputs
+
+def read_data(inputs):
+    '''Read the data of the model of inputs, as main.py does
+    '''
+    if inputs["Model"] == "AOM":
+        return read_aggregator_business_model("aggregator_model_data/DER.xlsx", "aggregator_model_data/Prices.csv", "aggregator_model_data/Load time_series.csv", "aggregator_model_data/PV time_series.csv", cache=inputs["cache"])
+    return read_retail_business_model("retail_model_data/DER.xlsx", "retail_model_data/retail_sell.csv", "retail_model_data/retail_buy.csv", "retail_model_data/Wholesale prices.csv", "retail_model_data/Inflexible load.csv", "retail_model_data/PV.csv", cache=inputs["cache"])
+
+def read_json(path):
+    with open(path) as file:
+        return json.load(file)
+
+def write_json(path, content):
+    '''Write a JSON file through a temporary file, so that other nodes never read a partial file
+    '''
+    temporary = f'{path}.{socket.gethostname()}_{os.getpid()}.tmp'
+    with open(temporary, "w") as file:
+        json.dump(content, file, indent=1)
+    os.replace(temporary, path)
+
+def touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-node batch runner on a shared-filesystem work queue")
+    commands = parser.add_subparsers(dest="command", required=True)
+    enqueue_parser = commands.add_parser("enqueue", help="split the run configured in main.py into units")
+    enqueue_parser.add_argument("queue", help="queue directory on the shared filesystem")
+    enqueue_parser.add_argument("--both-FCAS", action="store_true", help="queue the AOM with and without FCAS")
+    enqueue_parser.add_argument("--reset", action="store_true", help="delete an existing queue first")
+    work_parser = commands.add_parser("work", help="claim and solve units until the queue is empty")
+    work_parser.add_argument("queue", help="queue directory on the shared filesystem")
+    work_parser.add_argument("--workers", type=int, default=1, help="units solved at once on this node")
+    work_parser.add_argument("--nodes", type=int, default=1, help="nodes run as separate processes on this machine")
+    work_parser.add_argument("--heartbeat", type=float, default=30, help="seconds between the touches of the claimed units")
+    work_parser.add_argument("--stale", type=float, default=300, help="seconds without a touch after which a unit is requeued")
+    work_parser.add_argument("--merge", action="store_true", help="merge the results when the queue is done")
+    for command in ["merge", "status"]:
+        commands.add_parser(command).add_argument("queue", help="queue directory on the shared filesystem")
+    args = parser.parse_args()
+
+    queue = os.path.abspath(args.queue)
+    if args.command == "enqueue":
+        from main import inputs
+        enqueue(queue, inputs, args.both_FCAS, args.reset)
+    elif args.command == "work":
+        settings = dict(workers=args.workers, heartbeat=args.heartbeat, stale=args.stale, merge=args.merge)
+        if args.nodes > 1:
+            run_local_nodes(queue, args.nodes, **settings)
+        else:
+            run_node(queue, **settings)
+    elif args.command == "merge":
+        raise SystemExit(0 if merge_queue(queue) else 1)
+    else:
+        print(", ".join(f'{state}: {count}' for state, count in queue_status(queue).items()))
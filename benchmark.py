@@ -0,0 +1,149 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Benchmark of AOM (with and without FCAS) and ROM on synthetic data (synthetic.py). For each case it times the phases of the
+# models (parameters, variables, objective, constraints, solve, extraction) and the writing of the outputs, records the peak
+# memory of the process, and compares the times, the memory and the costs with a stored baseline to flag regressions. Each
+# case runs in a fresh process so that its peak memory is its own. Any solver supported by Pyomo works, e.g. GLPK or HiGHS.
+#
+# Usage: python benchmark.py --clients 2 --intervals 8760 --solver glpk [--save-baseline]
+
+# Imports ---------------------------------------------------------------------
+import argparse
+import json
+import os
+import resource
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from read import *
+from model import *
+from write import *
+from time import time
+from checkpoint import output_directory
+from synthetic import generate_synthetic_data
+
+# (name, Model, FCAS)
+CASES = [("AOM_with_FCAS", "AOM", True), ("AOM_without_FCAS", "AOM", False), ("ROM", "ROM", False)]
+PHASES = ["parameters", "variables", "objective", "constraints", "solve", "extract", "write"]
+# Time differences (s) below this are noise and never flagged
+NOISE_FLOOR = 0.05
+
+def run_benchmark(workdir, n_clients=2, n_intervals=8760, solver="glpk", seed=0):
+    '''Generate the synthetic data (if needed) and benchmark every case, each in a fresh process
+
+        Returns:
+            results (OrderedDict): case name -> phase times (s), peak memory (MB) and costs of the clients
+    '''
+    settings = {"clients": n_clients, "intervals": n_intervals, "seed": seed}
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    generated = None
+    if os.path.exists("synthetic.json"):
+        with open("synthetic.json") as file:
+            generated = json.load(file)
+    if generated != settings:
+        generate_synthetic_data("data", n_clients, n_intervals, seed)
+        with open("synthetic.json", "w") as file:
+            json.dump(settings, file)
+
+    results = OrderedDict()
+    for name, Model, FCAS in CASES:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[name] = pool.submit(benchmark_case, Model, FCAS, n_clients, solver).result()
+        print(f'{name}: ' + ", ".join(f'{phase} {seconds:.3f}s' for phase, seconds in results[name]["phases"].items())
+              + f', peak memory {results[name]["peak_memory_MB"]:.0f} MB')
+    return results
+
+def benchmark_case(Model, FCAS, n_clients, solver):
+    '''Solve all clients of one case, timing each phase
+    '''
+    inputs = OrderedDict(start_client=0, end_client=n_clients - 1, Model=Model, FCAS=FCAS, saveDetail=True, output_dtype="float64",
+                         output_format="csv")
+    if Model == "AOM":
+        data = read_aggregator_business_model("aggregator_model_data/DER.xlsx", "aggregator_model_data/Prices.csv", "aggregator_model_data/Load time_series.csv", "aggregator_model_data/PV time_series.csv")
+    else:
+        data = read_retail_business_model("retail_model_data/DER.xlsx", "retail_model_data/retail_sell.csv", "retail_model_data/retail_buy.csv", "retail_model_data/Wholesale prices.csv", "retail_model_data/Inflexible load.csv", "retail_model_data/PV.csv")
+    tnum    = 0 if Model == "ROM" else None
+    outputs = initialisation(inputs, data)
+    timings = OrderedDict((phase, 0.0) for phase in PHASES)
+    opt     = get_solver(solver)
+
+    for cnum in range(n_clients):
+        if Model == "AOM":
+            m = build_aggregator_model(data, cnum, FCAS, timings=timings)
+        else:
+            m = build_retail_model(data, cnum, tnum, timings=timings)
+        start    = time()
+        solution = solve_model(m, opt, data, cnum, tnum)
+        clock    = record_phase(timings, "solve", start)
+        if Model == "AOM":
+            aggregator_outputs(m, solution, clock - start, data, outputs, cnum, True, FCAS)
+        else:
+            retail_outputs(m, solution, clock - start, data, outputs, cnum, tnum, True)
+        record_phase(timings, "extract", clock)
+
+    outputdir = f'benchmark/{output_directory(inputs, tnum)}'
+    os.makedirs(f'{os.getcwd()}/output/{outputdir}', exist_ok=True)
+    clock = time()
+    write_cost_outputs(outputs, inputs, data, outputdir)
+    write_var_output(outputs, inputs, data, outputdir)
+    record_phase(timings, "write", clock)
+
+    # Peak resident memory of this process and of the solver processes it started (ru_maxrss is in kB on Linux)
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+    return {"phases": timings, "peak_memory_MB": peak, "costs": [float(outputs["total_net_cost"][cnum]) for cnum in range(n_clients)]}
+
+def compare_with_baseline(results, baseline, tolerance=0.25, cost_tolerance=1e-4):
+    '''Regressions of the results against the baseline: a phase or the peak memory more than `tolerance` (relative) above
+        the baseline, or a cost that differs by more than `cost_tolerance` (relative)
+
+        Returns:
+            regressions (list): Description of each regression
+    '''
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+        for phase, seconds in result["phases"].items():
+            before = base["phases"].get(phase, 0)
+            if seconds > before * (1 + tolerance) and seconds - before > NOISE_FLOOR:
+                regressions.append(f'{name} {phase}: {before:.3f}s -> {seconds:.3f}s')
+        if result["peak_memory_MB"] > base["peak_memory_MB"] * (1 + tolerance):
+            regressions.append(f'{name} peak memory: {base["peak_memory_MB"]:.0f} MB -> {result["peak_memory_MB"]:.0f} MB')
+        for cnum, (before, cost) in enumerate(zip(base["costs"], result["costs"])):
+            if abs(cost - before) > cost_tolerance * max(abs(before), 1):
+                regressions.append(f'{name} client {cnum} cost: {before:.6f} -> {cost:.6f}')
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark AOM and ROM on synthetic data")
+    parser.add_argument("--clients", type=int, default=2, help="number of clients")
+    parser.add_argument("--intervals", type=int, default=8760, help="number of time intervals of the year")
+    parser.add_argument("--solver", default="glpk", help="Pyomo solver name, e.g. glpk, cbc, appsi_highs or cplex")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic data")
+    parser.add_argument("--workdir", default=f'{tempfile.gettempdir()}/aggregator_benchmark', help="directory of the synthetic data and outputs")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="baseline file")
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="relative slowdown flagged as a regression")
+    args = parser.parse_args()
+
+    baseline_file = os.path.abspath(args.baseline)
+    results = run_benchmark(args.workdir, args.clients, args.intervals, args.solver, args.seed)
+    with open(f'{args.workdir}/output/benchmark/results.json', "w") as file:
+        json.dump(results, file, indent=1)
+
+    if args.save_baseline:
+        with open(baseline_file, "w") as file:
+            json.dump(results, file, indent=1)
+        print(f"------------------------------Baseline saved to {baseline_file}------------------------------")
+    elif os.path.exists(baseline_file):
+        with open(baseline_file) as file:
+            regressions = compare_with_baseline(results, json.load(file), args.tolerance)
+        print("------------------------------Regressions against the baseline------------------------------")
+        print("\n".join(regressions) if regressions else "None")
+        raise SystemExit(1 if regressions else 0)
@@ -0,0 +1,108 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Checkpoint and resume of a client range. Every client is written to its own part file in output/<business model>/parts as
+# soon as it is solved, and the run manifest (manifest.json) records the configuration of the run and the completed clients.
+# A re-launched run with the same configuration loads the completed clients from their parts and only solves the others, so
+# a crash only loses the client that was being solved. The final COST.csv and variable files are then written as usual from
+# the outputs rebuilt from the parts.
+
+# Imports ---------------------------------------------------------------------
+import os
+import json
+import socket
+import numpy as np
+
+# Configuration items that change the result of a client
+RUN_KEYS = ["Model", "FCAS", "saveDetail", "output_dtype", "solver", "solver_options", "race", "race_tolerance", "builder", "template",
+            "LP_fast_path", "engine", "SOC_steps", "rolling_window", "rolling_lookahead", "representative_days", "resample", "compact",
+            "incremental", "incremental_margin", "decomposition", "decomposition_tolerance", "decomposition_iterations"]
+
+def output_directory(inputs, tnum=None):
+    '''Output directory of the run configured in inputs, relative to output/
+    '''
+    if inputs["Model"] == "AOM":
+        return "aggregator_business_model/with_FCAS" if inputs["FCAS"] else "aggregator_business_model/without_FCAS"
+    return f'retail_business_model/tariff_{tnum}/'
+
+def parts_directory(inputs, tnum=None):
+    '''Directory of the part files and the run manifest
+    '''
+    return f'{os.getcwd()}/output/{output_directory(inputs, tnum)}/parts'
+
+def run_signature(inputs, data, tnum=None):
+    '''Configuration of the run as stored in the manifest, parts are only reused by a run with the same signature
+    '''
+    signature = {key: inputs[key] for key in RUN_KEYS}
+    signature.update({"tariff": tnum, "time_intervals": len(data["T"]), "Ids": [str(Id) for Id in data["Ids"]]})
+    return signature
+
+def resume(inputs, data, tnum=None):
+    '''Clients completed by a previous run with the same configuration. The manifest is (re)started if there is none or
+        if it belongs to a different configuration.
+
+        Returns:
+            completed (set): IDs of the clients whose parts can be loaded
+    '''
+    directory = parts_directory(inputs, tnum)
+    signature = run_signature(inputs, data, tnum)
+    os.makedirs(directory, exist_ok=True)
+    manifest  = load_manifest(directory)
+    if manifest.get("signature") != signature:
+        if manifest:
+            print("------------------------------Configuration changed, checkpoint restarted------------------------------")
+        for name in os.listdir(directory):
+            if name.startswith("client_"):
+                os.remove(f'{directory}/{name}')
+        manifest = {"signature": signature, "completed": []}
+        save_manifest(directory, manifest)
+    completed = {cnum for cnum in manifest["completed"] if os.path.exists(part_path(directory, cnum))}
+    if completed:
+        print(f"------------------------------Resuming, {len(completed)} clients already completed------------------------------")
+    return completed
+
+def part_path(directory, cnum):
+    return f'{directory}/client_{cnum}.npz'
+
+def save_part(inputs, cnum, client_slice, tnum=None):
+    '''Write the results of client cnum (runner.outputs_slice) to its part file and mark the client as completed
+    '''
+    directory = parts_directory(inputs, tnum)
+    write_part(part_path(directory, cnum), client_slice)
+
+    manifest = load_manifest(directory)
+    manifest["completed"] = sorted(set(manifest["completed"]) | {cnum})
+    save_manifest(directory, manifest)
+
+def load_part(inputs, cnum, tnum=None):
+    '''Results of client cnum in the form of runner.outputs_slice
+    '''
+    return read_part(part_path(parts_directory(inputs, tnum), cnum))
+
+def write_part(path, client_slice):
+    '''Write a client slice (runner.outputs_slice) to path through a temporary file, so that a part is complete or absent.
+        The temporary file is named after the host and process, as two batch nodes can write the same part at once
+    '''
+    temporary = f'{path[:-len(".npz")]}.{socket.gethostname()}_{os.getpid()}.tmp.npz'
+    np.savez(temporary, **{key: np.asarray(value) for key, value in client_slice.items()})
+    os.replace(temporary, path)
+
+def read_part(path):
+    with np.load(path) as part:
+        return {key: (part[key] if part[key].ndim else part[key].item()) for key in part.files}
+
+def load_manifest(directory):
+    if not os.path.exists(f'{directory}/manifest.json'):
+        return {}
+    with open(f'{directory}/manifest.json') as file:
+        return json.load(file)
+
+def save_manifest(directory, manifest):
+    '''Write the manifest through a temporary file so that a crash never leaves a partial manifest
+    '''
+    with open(f'{directory}/manifest.json.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(f'{directory}/manifest.json.tmp', f'{directory}/manifest.json')
@@ -0,0 +1,273 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Time decomposition of one client's AOM or ROM. The year is split into blocks (calendar months, or a number of blocks of whole
+# days) that are only coupled through the SOC at their boundaries: the SOC at the end of a block is the SOC at the start of
+# the next one. The coupling is relaxed with a price ν per boundary ($/kWh), the value of the energy stored across it. Every
+# block pays ν for the SOC it starts with and earns ν for the SOC it ends with, so the blocks are independent and are solved
+# in parallel on inputs["workers"] processes, each of which builds its blocks once and keeps them. Each iteration
+# - solves the priced blocks: their costs add up to a lower bound of the annual cost, and the SOC the next block wants at a
+#   boundary minus the SOC the previous block leaves there is the excess demand for stored energy;
+# - solves the blocks again one after another, each from the SOC the previous block ends with and with the SOC at its end
+#   valued at the boundary price: a feasible annual solution whose cost is an upper bound;
+# - raises the price of the boundaries with excess demand and lowers the others (subgradient step).
+# It stops when the best upper bound is within `tolerance` of the best lower bound, and therefore of the monolithic model, and
+# keeps the best feasible solution. If `iterations` run out first, it warns and records converged = False with the bounds in
+# the client metrics. The bounds hold when the blocks are solved to optimality (no MIP gap).
+
+# Imports ---------------------------------------------------------------------
+from pyomo.environ import *
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from model import *
+from read import *
+from rolling import window_costs
+from aggregation import intervals_per_day
+from incremental import solution_variables, save_values
+from instrumentation import number, current
+from time import time
+import warnings
+
+def Decomposition_Model(data, outputs, cnum, tnum=None, Model="AOM", blocks="month", tolerance=1e-3, iterations=50, workers=1,
+                        saveDetail=False, FCAS=True, solver="cplex", solver_threads=None, solver_options=None, compact=False):
+    '''Solve AOM or ROM for client cnum (under tariff tnum) as blocks of the year solved in parallel and coordinated by the
+        prices of the SOC at their boundaries
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM
+            Model (String, optional): "AOM" or "ROM"
+            blocks (String or Int, optional): "month" for one block per calendar month, or the number of blocks of whole days
+            tolerance (float, optional): Relative gap between the upper and lower bounds of the annual cost at which to stop
+            iterations (Int, optional): Maximum number of iterations
+            workers (Int, optional): Number of processes that solve the blocks
+            saveDetail (bool, optional): Whether to save variable specific data
+            FCAS (bool, optional): Whether to participate in FCAS markets (AOM only)
+            solver (String, optional): Name of the solver, e.g. "cplex" or "glpk"
+            solver_threads (Int, optional): Number of threads the solver of each block may use, None for the solver's default
+            solver_options (dict, optional): Solver options (model.get_solver)
+            compact (bool, optional): Whether to build the compact formulation of each block (model.build_aggregator_model)
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    FCAS     = FCAS and Model == "AOM"
+    tnum     = tnum if Model == "ROM" else None
+    bounds   = block_bounds(data, blocks)
+    K        = len(bounds)
+    settings = dict(cnum=cnum, tnum=tnum, Model=Model, FCAS=FCAS, compact=compact, saveDetail=saveDetail, solver=solver,
+                    solver_threads=solver_threads, solver_options=solver_options)
+    print(f"------------------------------Decomposition: {K} blocks on {min(workers, K)} processes------------------------------")
+
+    clock = time()
+    pool  = BlockPool(data, bounds, settings, workers)
+    try:
+        ν = initial_prices(data, bounds, tnum)
+        best, UB, LB, θ, stall = None, np.inf, -np.inf, 1.0, 0
+        for iteration in range(1, iterations + 1):
+            # Priced blocks: lower bound and excess demand for stored energy at every boundary
+            priced = pool.solve(ν)
+            bound  = sum(result["bound"] for result in priced)
+            excess = np.array([priced[k + 1]["SOC_start"] - priced[k]["SOC_end"] for k in range(K - 1)])
+            stall = 0 if bound > LB + 1e-9 * abs(bound) else stall + 1
+            LB    = max(LB, bound)
+
+            # Blocks solved one after another from the SOC the previous block leaves, with the SOC at their end valued at
+            # the boundary prices: feasible annual solution
+            feasible = pool.chain(ν)
+            cost     = sum(result["costs"]["total_net_cost"] for result in feasible)
+            if cost < UB:
+                best, UB = feasible, cost
+            gap = (UB - LB) / max(abs(UB), 1e-10)
+            print(f"------------------------------Iteration {iteration}: lower bound {LB:.6f}, upper bound {UB:.6f}, gap {100 * gap:.4f}%------------------------------")
+            converged = gap <= tolerance or not excess.any()
+            if converged:
+                break
+
+            # Subgradient step towards the prices at which the blocks agree on the boundary SOC (Polyak step, halved when
+            # the lower bound stalls)
+            if stall >= 3:
+                θ, stall = θ / 2, 0
+            ν = ν + θ * (UB - bound) / max(np.dot(excess, excess), 1e-12) * excess
+    finally:
+        pool.shutdown()
+
+    # Costs and solver output of the best feasible solution, the model size is the one of the largest block
+    outputs["time"][cnum] = time() - clock
+    for key in ["total_net_cost", "energy_net_cost", "FCAS_net_cost", "cost_c"]:
+        if key in outputs:
+            outputs[key][cnum] = sum(result["costs"][key] for result in best)
+    for key in ["bin_vars", "real_vars", "constraints"]:
+        outputs[key][cnum] = max(result[key] for result in best)
+    if saveDetail:
+        save_values(join_blocks(best, bounds, Model, FCAS), outputs, cnum, Model, FCAS)
+    if current:
+        current["decomposition"] = OrderedDict(iterations=iteration, lower_bound=LB, upper_bound=UB, gap=gap, converged=bool(converged))
+    if not converged:
+        warnings.warn(f"The decomposition of client {cnum} stopped after {iteration} iterations {100 * gap:.4f}% above its lower bound, "
+                      f"more than the tolerance of {100 * tolerance:.4f}%", RuntimeWarning)
+    print(f'Decomposition cost: {outputs["total_net_cost"][cnum]} (lower bound {LB}, {iteration} iterations, {"" if converged else "not "}converged)')
+    print("-----------------------------Outputs done--------------------------------")
+    return outputs
+
+## Blocks ---------------------------------------------------------------------
+def block_bounds(data, blocks="month"):
+    '''Time intervals [start, stop) of the blocks: one per calendar month of data["Time"], or `blocks` blocks of whole days.
+        A block shorter than a day (e.g. the last time stamp of the year in the next month) is joined to the previous one.
+    '''
+    lenT    = len(data["T"])
+    per_day = intervals_per_day(data)
+    if blocks == "month":
+        months = pd.to_datetime(pd.Series(data["Time"]).iloc[:lenT]).dt.month.to_numpy()
+        starts = [0] + [int(t) for t in np.flatnonzero(months[1:] != months[:-1]) + 1]
+    else:
+        n_days = max(lenT // per_day, 1)
+        starts = sorted(set(round(k * n_days / blocks) * per_day for k in range(min(blocks, n_days))))
+    bounds = []
+    for start, stop in zip(starts, starts[1:] + [lenT]):
+        if bounds and stop - start < per_day:
+            bounds[-1] = (bounds[-1][0], stop)
+        else:
+            bounds.append((start, stop))
+    return bounds
+
+def initial_prices(data, bounds, tnum=None):
+    '''Initial price of the SOC at every boundary ($/kWh): the mean energy price (AOM) or buy tariff (ROM) of the day around it
+    '''
+    prices  = np.asarray(data["energy_price"] if tnum is None else data["tariff_buy"][str(tnum)], dtype=float)
+    per_day = intervals_per_day(data)
+    return np.array([prices[max(start - per_day // 2, 0):start + per_day // 2].mean() for start, _ in bounds[1:]])
+
+def join_blocks(results, bounds, Model, FCAS):
+    '''Annual variable values (as incremental.save_values) from the variable values of the blocks
+    '''
+    values = OrderedDict()
+    for name in solution_variables(Model, FCAS):
+        if name == "SOC":
+            values[name] = np.concatenate([results[0]["values"][name][:1]] + [result["values"][name][1:] for result in results])
+        else:
+            values[name] = np.concatenate([result["values"][name] for result in results])
+    return values
+
+class BlockPool:
+    '''Processes that keep the models of their blocks, block k on process k % workers. With one worker, the blocks are kept
+        and solved in this process.
+    '''
+    def __init__(self, data, bounds, settings, workers=1):
+        self.workers = max(1, min(workers, len(bounds)))
+        self.K       = len(bounds)
+        assigned     = [[(k, slice_data(data, *bounds[k])) for k in range(i, self.K, self.workers)] for i in range(self.workers)]
+        if self.workers == 1:
+            self.pools = None
+            init_blocks(assigned[0], settings)
+        else:
+            # One single-process pool per worker, so that every block is always solved by the process that built it
+            self.pools = [ProcessPoolExecutor(max_workers=1, initializer=init_blocks, initargs=(blocks, settings)) for blocks in assigned]
+
+    def solve(self, ν, SOC=None):
+        '''Solve every block with the boundary prices ν, and with the boundary SOC fixed to SOC if given
+
+            Returns:
+                results (list): solve_block result of each block
+        '''
+        feasible = SOC is not None
+        prices   = [(ν[k - 1] if k > 0 else 0, ν[k] if k < self.K - 1 else 0) for k in range(self.K)]
+        fixed    = [(SOC[k - 1] if k > 0 else None, SOC[k] if k < self.K - 1 else None) if feasible else (None, None) for k in range(self.K)]
+        if self.pools is None:
+            return [solve_block(k, *prices[k], *fixed[k], feasible) for k in range(self.K)]
+        futures = [self.pools[k % self.workers].submit(solve_block, k, *prices[k], *fixed[k], feasible) for k in range(self.K)]
+        return [future.result() for future in futures]
+
+    def chain(self, ν):
+        '''Solve the blocks one after another, each from the SOC the previous block ends with, and with the SOC at its end
+            valued at the boundary price ν: a feasible annual solution
+
+            Returns:
+                results (list): solve_block result of each block
+        '''
+        results, SOC = [], None
+        for k in range(self.K):
+            args = (k, ν[k - 1] if k > 0 else 0, ν[k] if k < self.K - 1 else 0, SOC, None, True)
+            results.append(solve_block(*args) if self.pools is None else self.pools[k % self.workers].submit(solve_block, *args).result())
+            SOC = results[-1]["SOC_end"]
+        return results
+
+    def shutdown(self):
+        for pool in self.pools or []:
+            pool.shutdown()
+
+## Block process ---------------------------------------------------------------------
+# Models and settings of the blocks of this process, set by init_blocks
+block_state = {}
+
+def init_blocks(blocks, settings):
+    '''Build the models of the blocks [(k, block data)] of this process with the boundary prices in their objective
+    '''
+    block_state.clear()
+    block_state.update(settings, opt=get_solver(settings["solver"], settings["solver_threads"], settings["solver_options"]), models={}, data={})
+    for k, bdata in blocks:
+        block_state["models"][k] = build_block(bdata, k, settings)
+        block_state["data"][k]   = bdata
+
+def build_block(bdata, k, settings):
+    '''AOM or ROM of block k whose objective also pays ν_start for the SOC at its start and earns ν_end for the SOC at its end.
+        The SOC at the start is free (within the SOC limits) except in the first block.
+    '''
+    cnum, tnum = settings["cnum"], settings["tnum"]
+    if settings["Model"] == "AOM":
+        m = build_aggregator_model(bdata, cnum, settings["FCAS"], compact=settings["compact"])
+        SOC_max = bdata["Max_SOC"]
+    else:
+        m = build_retail_model(bdata, cnum, tnum, compact=settings["compact"])
+        SOC_max = bdata["Max_SOC"][cnum]
+    m.ν_start = Param(initialize=0, mutable=True)
+    m.ν_end   = Param(initialize=0, mutable=True)
+    m.obj.deactivate()
+    m.block_obj = Objective(expr=m.obj.expr + m.ν_start * m.SOC[0] - m.ν_end * m.SOC[len(m.T)], sense=minimize)
+    if k > 0:
+        m.socc.deactivate()
+        m.SOC[0].setlb(bdata["Min_SOC"])
+        m.SOC[0].setub(SOC_max)
+    return m
+
+def solve_block(k, ν_start, ν_end, SOC_start=None, SOC_end=None, feasible=False):
+    '''Solve block k of this process with the boundary prices, and the boundary SOC fixed if given
+
+        Args:
+            feasible (bool, optional): Whether the block is part of a feasible annual solution, whose variable values are kept
+
+        Returns:
+            result (dict): lower bound of the block objective, SOC at both ends, costs (rolling.window_costs), model size and,
+                with saveDetail and feasible, the variable values of the block
+    '''
+    m, bdata = block_state["models"][k], block_state["data"][k]
+    m.ν_start.set_value(ν_start)
+    m.ν_end.set_value(ν_end)
+    ends = [(m.SOC[0], SOC_start), (m.SOC[len(m.T)], SOC_end)]
+    for var, SOC in ends:
+        if SOC is not None:
+            var.fix(float(SOC))
+    clock    = time()
+    solution = solve_model(m, block_state["opt"], bdata, block_state["cnum"], block_state["tnum"])
+    _, n_vars, n_constraints = solver_statistics(m, solution, time() - clock)
+    for var, SOC in ends:
+        if SOC is not None:
+            var.unfix()
+
+    # The solver's best bound keeps the lower bound valid when the block is solved with a MIP gap
+    bound  = number(getattr(solution.problem, "lower_bound", None))
+    costs  = {"total_net_cost": 0, "energy_net_cost": 0, "FCAS_net_cost": 0, "cost_c": 0}
+    window_costs(m, bdata, block_state["cnum"], block_state["tnum"], len(m.T), block_state["Model"], block_state["FCAS"], costs)
+    result = {"bound": min(bound, value(m.block_obj)) if bound is not None else value(m.block_obj), "costs": costs,
+              "SOC_start": value(m.SOC[0]), "SOC_end": value(m.SOC[len(m.T)]),
+              "bin_vars": count_binaries(m), "real_vars": n_vars - count_binaries(m), "constraints": n_constraints}
+    if block_state["saveDetail"] and feasible:
+        result["values"] = {name: variable_values(m.component(name)) for name in solution_variables(block_state["Model"], block_state["FCAS"])}
+    return result
@@ -0,0 +1,210 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Dynamic programming engine of AOM (without FCAS) and ROM. Without FCAS both models dispatch a single BESS over a price
+# series, so they can be solved by a backward recursion over a discretised SOC grid instead of a MILP solver. The grid has
+# SOC_steps + 1 levels between Min_SOC and Max_SOC; in each time interval the BESS moves by a whole number of levels within its
+# charging/discharging power or by exactly its full power, whose end SOC is valued by linear interpolation between the levels.
+# The PV generation and the energy bought/sold follow from the prices in closed form. The gap to the MILP optimum comes from
+# the grid resolution and is reported by `compare_with_MILP`.
+
+# Imports ---------------------------------------------------------------------
+from collections import OrderedDict
+from copy import copy
+from time import time
+import numpy as np
+from read import *
+from instrumentation import *
+
+def Aggregator_DP_Model(data, outputs, cnum, saveDetail=False, FCAS=False, SOC_0=0, SOC_steps=100):
+    '''Solve the AOM of client cnum without FCAS by dynamic programming, fills the same outputs as Aggregator_Optimisation_Model
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            saveDetail (bool, optional): Whether to save variable specific data
+            FCAS (bool, optional): Must be False, the DP engine has no FCAS markets
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            SOC_steps (Int, optional): Number of SOC grid steps between Min_SOC and Max_SOC
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    if FCAS:
+        raise ValueError("The DP engine does not support FCAS markets, set inputs['FCAS'] to False or use the MILP engine")
+    λ_E      = np.asarray(data["energy_price"], dtype=float)
+    start    = time()
+    dispatch = DP_dispatch(λ_E, λ_E, data["load"].iloc[:, cnum].to_numpy(dtype=float), data["PV"].iloc[:, cnum].to_numpy(dtype=float),
+                           data["power"], data["Min_SOC"], data["Max_SOC"], data["eff"], data["Δt"], SOC_0, SOC_steps)
+    record_phase(phase_timings(), "solve", start)
+    print("------------------------------DP solution done------------------------------")
+
+    outputs["time"][cnum]            = time() - start
+    outputs["energy_net_cost"][cnum] = np.dot(λ_E, dispatch["E"]) * data["Δt"]
+    outputs["FCAS_net_cost"][cnum]   = 0
+    outputs["total_net_cost"][cnum]  = outputs["energy_net_cost"][cnum]
+    DP_statistics(outputs, cnum, dispatch)
+    print("Annual cost output done")
+    if saveDetail:
+        save_dispatch(outputs, cnum, dispatch)
+    print("-----------------------------Outputs done--------------------------------")
+    return outputs
+
+def Retail_DP_Model(data, outputs, cnum, tnum, saveDetail=False, SOC_0=0, SOC_steps=100):
+    '''Solve the ROM of client cnum under tariff tnum by dynamic programming, fills the same outputs as Retail_Optimisation_Model
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            tnum (Int): The tariff used in this model
+            saveDetail (bool, optional): Whether to save variable specific data
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            SOC_steps (Int, optional): Number of SOC grid steps between Min_SOC and Max_SOC
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    λ_TB     = np.asarray(data["tariff_buy"][str(tnum)], dtype=float)
+    λ_TS     = np.full(len(λ_TB), data["tariff_sell"][str(tnum)], dtype=float)
+    start    = time()
+    dispatch = DP_dispatch(λ_TB, λ_TS, data["load"].iloc[:, cnum].to_numpy(dtype=float), data["PV"].iloc[:, cnum].to_numpy(dtype=float),
+                           data["power"][cnum], data["Min_SOC"], data["Max_SOC"][cnum], data["eff"][cnum], data["Δt"], SOC_0, SOC_steps)
+    record_phase(phase_timings(), "solve", start)
+    print("------------------------------DP solution done------------------------------")
+
+    outputs["time"][cnum]           = time() - start
+    outputs["total_net_cost"][cnum] = (np.dot(λ_TB, dispatch["E_b"]) - np.dot(λ_TS, dispatch["E_s"])) * data["Δt"]
+    outputs["cost_c"][cnum]         = np.dot(np.asarray(data["energy_price"], dtype=float), dispatch["E"]) * data["Δt"]
+    DP_statistics(outputs, cnum, dispatch)
+    print(f'Retail cost: {outputs["total_net_cost"][cnum]}, wholesale cost: {outputs["cost_c"][cnum]}')
+    print("Annual cost output done")
+    if saveDetail:
+        save_dispatch(outputs, cnum, dispatch)
+        col = column(outputs, cnum)
+        outputs["E_buy"][:, col]  = dispatch["E_b"]
+        outputs["E_sell"][:, col] = dispatch["E_s"]
+    print("-----------------------------Outputs done--------------------------------")
+    return outputs
+
+def DP_dispatch(λ_buy, λ_sell, P_il, MPV, power, SOC_min, SOC_max, η, Δt, SOC_0=0, SOC_steps=100):
+    '''Cost-minimal BESS dispatch on the SOC grid. Buying energy costs λ_buy and selling it earns λ_sell (both λ_E in AOM),
+        which must satisfy λ_buy >= λ_sell, otherwise buying and selling at the same time would be unbounded.
+
+        Args:
+            λ_buy, λ_sell (np.ndarray): Buy and sell price of each time interval ($/kWh)
+            P_il, MPV (np.ndarray): Inflexible load and maximum PV generation of each time interval (kW)
+            power (float): Maximum charging/discharging power of the BESS (kW)
+            SOC_min, SOC_max (float): SOC limits of the BESS (kWh)
+            η (float): Efficiency of the BESS
+            Δt (float): Duration of a time interval (hour)
+            SOC_0 (float, optional): State-of-charge at time step 0 (kWh)
+            SOC_steps (Int, optional): Number of SOC grid steps
+
+        Returns:
+            dispatch (dict): P_c, P_d, PV, E, E_b, E_s (T,) and SOC (T + 1,) arrays, and the number of DP states
+    '''
+    if np.any(λ_buy < λ_sell):
+        raise ValueError("The DP engine needs a buy price at least as high as the sell price in every time interval")
+    δ      = (SOC_max - SOC_min) / SOC_steps
+    levels = np.arange(SOC_steps + 1)
+    # Moves of the SOC in grid levels per time interval: every whole number of levels within the charging and discharging
+    # power, and the exact full-power moves if they are not a whole number of levels, so the grid does not cap the power
+    charge, discharge = power * η * Δt / δ, power * Δt / (η * δ)
+    shifts = np.arange(-int(np.floor(discharge + 1e-9)), int(np.floor(charge + 1e-9)) + 1).astype(float)
+    shifts = np.concatenate([[-discharge] if shifts[0] + discharge > 1e-9 else [], shifts,
+                             [charge] if charge - shifts[-1] > 1e-9 else []])
+    P_c    = np.maximum(shifts, 0) * δ / (η * Δt)
+    P_d    = np.maximum(-shifts, 0) * δ * η / Δt
+
+    # Net energy E of every (time interval, move): the PV generation is chosen in [0, MPV] to bring E to its cheapest value,
+    # as low as possible while selling pays, as high as possible while buying pays and to 0 otherwise
+    demand = P_c[None, :] - P_d[None, :] + P_il[:, None]
+    target = np.where(λ_sell > 0, -np.inf, np.where(λ_buy < 0, np.inf, 0.0))
+    E      = np.clip(target[:, None], demand - MPV[:, None], demand)
+    cost   = (λ_buy[:, None] * np.maximum(E, 0) - λ_sell[:, None] * np.maximum(-E, 0)) * Δt
+
+    # Backward recursion V_t(i) = min_k cost_t(k) + V_t+1(i + k), V_t+1 is linearly interpolated between the grid levels
+    # for the full-power moves that end between two levels
+    target_level = levels[:, None] + shifts[None, :]
+    infeasible   = (target_level < -1e-9) | (target_level > SOC_steps + 1e-9)
+    lower, weight = grid_interpolation(target_level, SOC_steps)
+    V = np.zeros((len(λ_buy) + 1, len(levels)))
+    for t in range(len(λ_buy) - 1, -1, -1):
+        total = cost[t][None, :] + V[t + 1][lower] * (1 - weight) + V[t + 1][lower + 1] * weight
+        total[infeasible] = np.inf
+        V[t] = total.min(axis=1)
+
+    # Forward pass from the initial SOC, which may lie between two grid levels after a full-power move
+    moves = np.empty(len(λ_buy), dtype=int)
+    level = float(np.clip((SOC_0 - SOC_min) / δ, 0, SOC_steps))
+    path  = [level]
+    for t in range(len(λ_buy)):
+        position      = level + shifts
+        lower, weight = grid_interpolation(position, SOC_steps)
+        total = cost[t] + V[t + 1][lower] * (1 - weight) + V[t + 1][lower + 1] * weight
+        total[(position < -1e-9) | (position > SOC_steps + 1e-9)] = np.inf
+        moves[t] = np.argmin(total)
+        level    = float(np.clip(position[moves[t]], 0, SOC_steps))
+        path.append(level)
+
+    E_t = E[np.arange(len(λ_buy)), moves]
+    return {"P_c": P_c[moves], "P_d": P_d[moves], "PV": demand[np.arange(len(λ_buy)), moves] - E_t, "E": E_t,
+            "E_b": np.maximum(E_t, 0), "E_s": np.maximum(-E_t, 0), "SOC": SOC_min + δ * np.array(path),
+            "states": len(λ_buy) * len(levels)}
+
+def grid_interpolation(position, SOC_steps):
+    '''Lower grid level and weight of the upper level for the linear interpolation of a value function at SOC positions
+        (in grid levels), positions outside [0, SOC_steps] are clipped
+    '''
+    position = np.clip(position, 0, SOC_steps)
+    lower    = np.minimum(np.floor(position).astype(int), SOC_steps - 1)
+    return lower, position - lower
+
+def DP_statistics(outputs, cnum, dispatch):
+    '''Model size of the DP: no binaries or constraints, the number of (time interval, SOC level) states as real variables
+    '''
+    outputs["bin_vars"][cnum]    = 0
+    outputs["real_vars"][cnum]   = dispatch["states"]
+    outputs["constraints"][cnum] = 0
+
+def save_dispatch(outputs, cnum, dispatch):
+    '''Save the dispatch of client cnum into the variable arrays of outputs
+    '''
+    col = column(outputs, cnum)
+    outputs["E_b"][:, col] = dispatch["E"]
+    outputs["P_c"][:, col] = dispatch["P_c"]
+    outputs["P_d"][:, col] = dispatch["P_d"]
+    outputs["PV"][:, col]  = dispatch["PV"]
+    outputs["SOC"][:, col] = dispatch["SOC"]
+
+## Accuracy against the MILP ---------------------------------------------------------------------
+def compare_with_MILP(inputs, data, DP_outputs, tnum=None):
+    '''Solve the clients of inputs with the MILP engine and print the cost gap and time of the DP solution against it
+
+        Returns:
+            report (OrderedDict): client ID -> MILP cost, DP cost, absolute and relative gap, solve times
+    '''
+    from runner import run_clients
+    MILP_inputs = copy(inputs)
+    MILP_inputs["engine"]     = "milp"
+    MILP_inputs["checkpoint"] = False
+    MILP_inputs["metrics"]    = False
+    MILP_inputs["progress"]   = False
+    MILP_outputs = run_clients(MILP_inputs, data, initialisation(MILP_inputs, data), tnum)
+
+    report = OrderedDict()
+    print(f"------------------------------DP accuracy ({inputs['SOC_steps']} SOC steps)------------------------------")
+    for cnum in range(inputs["start_client"], inputs["end_client"] + 1):
+        MILP = MILP_outputs["total_net_cost"][cnum]
+        DP   = DP_outputs["total_net_cost"][cnum]
+        gap  = DP - MILP
+        report[cnum] = {"MILP_cost": MILP, "DP_cost": DP, "gap": gap, "relative_gap": gap / abs(MILP) if MILP else 0.0,
+                        "MILP_time": MILP_outputs["time"][cnum], "DP_time": DP_outputs["time"][cnum]}
+        print(f'client {cnum}: MILP {MILP:.4f}, DP {DP:.4f}, gap {gap:.4f} ({100 * report[cnum]["relative_gap"]:.3f}%), '
+              f'time {report[cnum]["MILP_time"]:.2f}s -> {report[cnum]["DP_time"]:.2f}s')
+    return report
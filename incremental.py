@@ -0,0 +1,226 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Incremental re-optimisation of AOM and ROM. The annual solution of every client is stored in output/incremental together
+# with the inputs it was solved for (load, PV, prices, tariff and BESS). When the inputs are revised for part of the year, e.g.
+# the prices of one week or the load of one month, the new inputs are compared with the stored ones and only the changed
+# time intervals, extended by a margin on each side, are re-solved as windows with the SOC at both ends fixed to the stored
+# trajectory. The windows are spliced into the stored annual solution, and the annual costs are computed from the spliced
+# solution. Fixing the SOC at the window ends keeps the rest of the year unchanged, so the result is the best re-plan of the
+# windows, which can differ slightly from a full re-solve; a wider margin lets the BESS re-plan further around the change.
+# A change of the BESS or the sell tariff changes every time interval, and the client is solved again in full.
+
+# Imports ---------------------------------------------------------------------
+from pyomo.environ import *
+from collections import OrderedDict
+from time import time
+import os
+import numpy as np
+from model import *
+from read import *
+
+# Variables of the stored annual solution of each model
+SOLUTION_VARIABLES = {"AOM": ["E", "P_c", "P_d", "PV", "SOC"], "AOM_FCAS": ["L", "R", "L_c", "L_d", "R_c", "R_d", "L_pv", "R_pv"],
+                      "ROM": ["E", "E_b", "E_s", "P_c", "P_d", "PV", "SOC"]}
+
+def Incremental_Model(data, outputs, cnum, tnum=None, Model="AOM", margin=288, saveDetail=False, FCAS=True, solver="cplex",
+                      solver_threads=None, solver_options=None, compact=False):
+    '''Solve AOM or ROM for client cnum (under tariff tnum) by re-solving only the time intervals whose inputs changed since
+        the stored solution, or the whole year if there is no stored solution for the client
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM
+            Model (String, optional): "AOM" or "ROM"
+            margin (Int, optional): Number of time intervals re-solved before and after each changed time interval
+            saveDetail (bool, optional): Whether to save variable specific data
+            FCAS (bool, optional): Whether to participate in FCAS markets (AOM only)
+            solver (String, optional): Name of the solver, e.g. "cplex" or "glpk"
+            solver_threads (Int, optional): Number of threads the solver may use, None for the solver's default
+            solver_options (dict, optional): Solver options (model.get_solver)
+            compact (bool, optional): Whether to build the compact formulation (model.build_aggregator_model)
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    FCAS    = FCAS and Model == "AOM"
+    tnum    = tnum if Model == "ROM" else None
+    opt     = get_solver(solver, solver_threads, solver_options)
+    current = client_inputs(data, cnum, tnum, FCAS)
+    stored  = load_client_solution(cnum, tnum, FCAS)
+    # The model size is the maximum over the windows of this run, not of an earlier solve into the same outputs
+    for key in ["time", "bin_vars", "real_vars", "constraints"]:
+        outputs[key][cnum] = 0
+
+    if stored is None or not same_scalars(stored["inputs"], current):
+        print("------------------------------Incremental: no stored solution for these BESS and tariff, solving the year------------------------------")
+        values = solve_windows(data, outputs, cnum, tnum, Model, FCAS, opt, compact, [(0, len(data["T"]))], None)
+    else:
+        windows = changed_windows(changed_intervals(stored["inputs"], current), margin)
+        print(f"------------------------------Incremental: {len(windows)} windows, {sum(stop - start for start, stop in windows)} of {len(data['T'])} time intervals re-solved------------------------------")
+        values = solve_windows(data, outputs, cnum, tnum, Model, FCAS, opt, compact, windows, stored["values"])
+
+    for key, cost in annual_costs(values, data, tnum, Model, FCAS).items():
+        outputs[key][cnum] = cost
+    if saveDetail:
+        save_values(values, outputs, cnum, Model, FCAS)
+    store_client_solution(cnum, tnum, FCAS, current, values)
+    print(f'Incremental cost: {outputs["total_net_cost"][cnum]}')
+    print("-----------------------------Outputs done--------------------------------")
+    return outputs
+
+## Windows ---------------------------------------------------------------------
+def solve_windows(data, outputs, cnum, tnum, Model, FCAS, opt, compact, windows, values):
+    '''Solve the windows [start, stop) with the SOC at their ends fixed to values["SOC"] and splice them into values
+
+        Args:
+            values (dict): Stored annual solution (variable name -> values), None if the windows cover the year
+
+        Returns:
+            values (dict): Annual solution with the re-solved windows
+    '''
+    names  = solution_variables(Model, FCAS)
+    lenT   = len(data["T"])
+    values = {name: np.copy(array) for name, array in values.items()} if values is not None else \
+             {name: np.zeros((lenT + 1 if name == "SOC" else lenT,) + ((len(data["W"]),) if name in ["L", "R"] else ())) for name in names}
+    for start, stop in windows:
+        wdata = slice_data(data, start, stop)
+        SOC_0 = values["SOC"][start]
+        if Model == "AOM":
+            m = build_aggregator_model(wdata, cnum, FCAS, SOC_0, compact=compact)
+        else:
+            m = build_retail_model(wdata, cnum, tnum, SOC_0, compact=compact)
+        # The SOC at the end of the window is the one of the stored trajectory, unless the window ends the year
+        if stop < lenT:
+            m.SOC_end = Constraint(expr=m.SOC[stop - start] == float(values["SOC"][stop]))
+        clock    = time()
+        solution = solve_model(m, opt, wdata, cnum, tnum)
+        solve_time, n_vars, n_constraints = solver_statistics(m, solution, time() - clock)
+        print(f"------------------------------Window [{start}, {stop}) done: {solution.solver.termination_condition}------------------------------")
+
+        # Solver output, the model size is the one of the largest window
+        outputs["time"][cnum]       += solve_time
+        outputs["bin_vars"][cnum]    = max(outputs["bin_vars"][cnum], count_binaries(m))
+        outputs["real_vars"][cnum]   = max(outputs["real_vars"][cnum], n_vars - count_binaries(m))
+        outputs["constraints"][cnum] = max(outputs["constraints"][cnum], n_constraints)
+        for name in names:
+            if name == "SOC":
+                values[name][start:stop + 1] = variable_values(m.SOC)
+            else:
+                values[name][start:stop] = variable_values(m.component(name))
+    return values
+
+def changed_intervals(stored, current):
+    '''Boolean array over the time intervals, True where any time series of the inputs differs from the stored one
+    '''
+    changed = np.zeros(len(current["load"]), dtype=bool)
+    for name, series in current.items():
+        if np.ndim(series) == 0 or name not in stored:
+            continue
+        if len(stored[name]) != len(series):
+            return np.ones(len(current["load"]), dtype=bool)
+        difference = ~np.isclose(stored[name], series, rtol=0, atol=1e-12)
+        changed   |= difference.any(axis=1) if difference.ndim == 2 else difference
+    return changed
+
+def changed_windows(changed, margin=288):
+    '''Windows [start, stop) that cover the changed time intervals extended by `margin` on each side, overlapping or
+        adjacent windows merged
+    '''
+    windows = []
+    for t in np.flatnonzero(changed):
+        start, stop = max(t - margin, 0), min(t + 1 + margin, len(changed))
+        if windows and start <= windows[-1][1]:
+            windows[-1] = (windows[-1][0], max(windows[-1][1], stop))
+        else:
+            windows.append((start, stop))
+    return [(int(start), int(stop)) for start, stop in windows]
+
+## Stored solutions ---------------------------------------------------------------------
+def client_inputs(data, cnum, tnum=None, FCAS=False):
+    '''Inputs of client cnum that its solution depends on: time series and scalars (BESS, sell tariff). The wholesale price
+        of ROM only changes the wholesale cost, which is computed again from the current data anyway.
+    '''
+    inputs = OrderedDict(load=data["load"].iloc[:, cnum].to_numpy(dtype=float), PV=data["PV"].iloc[:, cnum].to_numpy(dtype=float),
+                         Min_SOC=float(data["Min_SOC"]))
+    if tnum is None:
+        inputs.update(energy_price=np.asarray(data["energy_price"], dtype=float), power=float(data["power"]), Max_SOC=float(data["Max_SOC"]),
+                      eff=float(data["eff"]))
+        if FCAS:
+            inputs.update(R_FCAS_price=np.asarray(data["R_FCAS_price"], dtype=float), L_FCAS_price=np.asarray(data["L_FCAS_price"], dtype=float))
+    else:
+        inputs.update(power=float(data["power"][cnum]), Max_SOC=float(data["Max_SOC"][cnum]), eff=float(data["eff"][cnum]),
+                      tariff_buy=np.asarray(data["tariff_buy"][str(tnum)], dtype=float), tariff_sell=float(data["tariff_sell"][str(tnum)]))
+    return inputs
+
+def same_scalars(stored, current):
+    '''Whether the scalar inputs (BESS, sell tariff) and the number of time intervals are the ones of the stored solution
+    '''
+    for name, value in current.items():
+        if np.ndim(value) == 0 and (name not in stored or float(stored[name]) != value):
+            return False
+    return len(stored["load"]) == len(current["load"])
+
+def solution_variables(Model, FCAS):
+    return SOLUTION_VARIABLES["ROM"] if Model == "ROM" else SOLUTION_VARIABLES["AOM"] + (SOLUTION_VARIABLES["AOM_FCAS"] if FCAS else [])
+
+def solution_file(cnum, tnum=None, FCAS=False):
+    if tnum is not None:
+        tag = f'ROM_tariff_{tnum}'
+    else:
+        tag = "AOM_with_FCAS" if FCAS else "AOM_without_FCAS"
+    return f'{os.getcwd()}/output/incremental/{tag}/client_{cnum}.npz'
+
+def load_client_solution(cnum, tnum=None, FCAS=False):
+    '''Stored inputs and solution of client cnum, None if there is none
+
+        Returns:
+            stored (dict): {"inputs": {name: values}, "values": {variable name: values}}
+    '''
+    path = solution_file(cnum, tnum, FCAS)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as file:
+        return {"inputs": {name[len("input_"):]: file[name] for name in file.files if name.startswith("input_")},
+                "values": {name[len("value_"):]: file[name] for name in file.files if name.startswith("value_")}}
+
+def store_client_solution(cnum, tnum, FCAS, inputs, values):
+    '''Store the annual solution of client cnum with the inputs it was solved for
+    '''
+    path = solution_file(cnum, tnum, FCAS)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, **{f'input_{name}': value for name, value in inputs.items()}, **{f'value_{name}': value for name, value in values.items()})
+
+## Outputs ---------------------------------------------------------------------
+def annual_costs(values, data, tnum, Model, FCAS):
+    '''Annual costs of an annual solution, as model.energy_cost, FCAS_cost and retail_cost of a solved model
+    '''
+    Δt     = data["Δt"]
+    energy = np.dot(np.asarray(data["energy_price"], dtype=float), values["E"]) * Δt
+    if Model == "ROM":
+        λ_TB = np.asarray(data["tariff_buy"][str(tnum)], dtype=float)
+        λ_TS = data["tariff_sell"][str(tnum)]
+        return {"total_net_cost": (np.dot(λ_TB, values["E_b"]) - λ_TS * np.sum(values["E_s"])) * Δt, "cost_c": energy}
+    FCAS_net = -(np.sum(data["R_FCAS_price"] * values["R"]) + np.sum(data["L_FCAS_price"] * values["L"])) * Δt if FCAS else 0
+    return {"energy_net_cost": energy, "FCAS_net_cost": FCAS_net, "total_net_cost": energy + FCAS_net}
+
+def save_values(values, outputs, cnum, Model, FCAS):
+    '''Save the variable values of an annual solution into outputs, as model.aggregator_outputs and retail_outputs
+    '''
+    col = column(outputs, cnum)
+    outputs["E_b"][:, col] = values["E"]
+    if Model == "ROM":
+        outputs["E_buy"][:, col]  = values["E_b"]
+        outputs["E_sell"][:, col] = values["E_s"]
+    if FCAS:
+        outputs["L_b"][:, :, col] = values["L"]
+        outputs["R_b"][:, :, col] = values["R"]
+        for var in ["L_c", "L_d", "R_c", "R_d", "L_pv", "R_pv"]:
+            outputs[var][:, col] = values[var]
+    for var in ["P_c", "P_d", "PV", "SOC"]:
+        outputs[var][:, col] = values[var]
@@ -0,0 +1,158 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Instrumentation of the runs. For every client it records the wall time, the resident memory (RSS) after each phase and the
+# peak RSS during it (model parameters, variables, objective, constraints, solve, extraction), the model size and the solver
+# statistics (termination condition, branch-and-bound nodes, MIP gap), and the run records the time of reading the inputs and
+# writing the outputs. With inputs["metrics"] each record is appended as one JSON line to output/metrics.jsonl, and with
+# inputs["progress"] the number of completed clients, the elapsed time and the estimated time to completion are printed after
+# every client.
+
+# Imports ---------------------------------------------------------------------
+import os
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from time import time
+import numpy as np
+
+# Identifies the records of this run in output/metrics.jsonl
+RUN_ID = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+
+# Metrics of the client being solved in this process, reset by begin_client
+current = OrderedDict()
+# Progress of the client range in the main process, reset by begin_run
+progress = {}
+
+## Phases ---------------------------------------------------------------------
+def record_phase(timings, phase, start):
+    '''Add the time since start to timings[phase] (if timings is given) and return the current time. If timings are the
+        phase times of the current client, its RSS after the phase is recorded too.
+    '''
+    now = time()
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0) + now - start
+        if timings is current.get("phases"):
+            current["rss_MB"][phase]  = rss_MB()
+            current["peak_MB"][phase] = peak_rss_MB()
+            reset_peak_rss()
+    return now
+
+def phase_timings():
+    '''Phase times of the client being solved, None outside begin_client/end_client
+    '''
+    return current.get("phases")
+
+def rss_MB():
+    '''Resident memory of this process (MB). Without /proc (not Linux), the peak resident memory instead.
+    '''
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1e6
+    except (OSError, ValueError, AttributeError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def peak_rss_MB():
+    '''Peak resident memory of this process (MB) since the last reset_peak_rss, or since it started without /proc (not Linux)
+    '''
+    try:
+        with open("/proc/self/status") as file:
+            return next(int(line.split()[1]) for line in file if line.startswith("VmHWM")) / 1024
+    except (OSError, ValueError, StopIteration):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def reset_peak_rss():
+    '''Reset the peak resident memory of this process to its current RSS, where Linux allows it
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+def solver_peak_MB():
+    '''Peak resident memory of the largest solver process this process has started (MB), 0 for in-process solvers
+    '''
+    import resource
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+## Clients ---------------------------------------------------------------------
+def begin_client(cnum, tnum=None):
+    '''Start recording the metrics of client cnum (under tariff tnum) in this process
+    '''
+    current.clear()
+    current.update(client=cnum, tariff=tnum, source="solved", phases=OrderedDict(), rss_MB=OrderedDict(), peak_MB=OrderedDict(),
+                   solver=OrderedDict(), start=time())
+    reset_peak_rss()
+
+def record_solver(solution):
+    '''Termination condition, status, branch-and-bound nodes, MIP gap and time reported by the solver for the current client
+    '''
+    if not current:
+        return
+    lower = number(getattr(solution.problem, "lower_bound", None))
+    upper = number(getattr(solution.problem, "upper_bound", None))
+    current["solver"].update(termination=str(solution.solver.termination_condition), status=str(solution.solver.status),
+                             nodes=number(getattr(getattr(solution.solver.statistics, "branch_and_bound", None), "number_of_created_subproblems", None)),
+                             gap=abs(upper - lower) / max(abs(upper), 1e-10) if lower is not None and upper is not None else None,
+                             time=number(getattr(solution.solver, "time", None)))
+
+def end_client(outputs, cnum):
+    '''Stop recording client cnum and add its total wall time, final RSS and model size
+
+        Returns:
+            metrics (OrderedDict): JSON serialisable record of the client
+    '''
+    metrics = OrderedDict((key, value) for key, value in current.items() if key != "start")
+    metrics["wall_time"] = time() - current["start"]
+    metrics["rss_MB"]["end"] = rss_MB()
+    metrics["model"] = OrderedDict((key, number(outputs[key][cnum])) for key in ["bin_vars", "real_vars", "constraints"])
+    current.clear()
+    return metrics
+
+def number(value):
+    '''Plain float of a reported value, None if it is missing or not a number (e.g. Pyomo's UndefinedData)
+    '''
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if np.isnan(value) or np.isinf(value) else value
+
+## Run ---------------------------------------------------------------------
+def begin_run(total):
+    '''Start the progress of a client range of total clients
+    '''
+    progress.update(total=total, done=0, start=time())
+
+def client_done(inputs, metrics):
+    '''Log the metrics of a completed client and print the progress of the run
+    '''
+    log_metrics(inputs, metrics)
+    if not progress:
+        return
+    progress["done"] += 1
+    if inputs["progress"]:
+        elapsed = time() - progress["start"]
+        ETA     = elapsed / progress["done"] * (progress["total"] - progress["done"])
+        print(f'------------------------------{progress["done"]}/{progress["total"]} clients done, elapsed '
+              f'{timedelta(seconds=round(elapsed))}, ETA {timedelta(seconds=round(ETA))}------------------------------')
+
+def log_phase(inputs, phase, start, tnum=None):
+    '''Log a phase of the run outside the clients (reading the inputs, writing the outputs) that started at start
+    '''
+    log_metrics(inputs, OrderedDict(phase=phase, tariff=tnum, time=time() - start, rss_MB=rss_MB()))
+
+def log_metrics(inputs, record):
+    '''Append a record to output/metrics.jsonl if inputs["metrics"]
+    '''
+    if not inputs["metrics"]:
+        return
+    os.makedirs(f'{os.getcwd()}/output', exist_ok=True)
+    with open(f'{os.getcwd()}/output/metrics.jsonl', "a") as file:
+        file.write(json.dumps(OrderedDict(run=RUN_ID, Model=inputs["Model"], FCAS=inputs["FCAS"], **record), default=str) + "\n")
@@ -17,13 +17,61 @@
 # 2. change the inputs["FCAS"] to decide whether the aggregator participates in the FCAS market, if it does, please change it to True, 
 #    if it only participates in the Energy market, please change it to False.
 # 3. inputs["Model"] indicates which model is running, you can choose between AOM and ROM
-# 4. inputs['saveDetail']: Whether to save variable values.
-# 5. After you have completed all the configurations, simply run the model.
+# 4. inputs['saveDetail']: Whether to save variable values, inputs["output_dtype"]: "float64" or "float32" for the saved values.
+# 5. inputs["workers"]: number of worker processes that solve clients in parallel (1 runs the clients one after another), 
+#    inputs["solver_threads"]: number of threads each solver may use (None for the solver's default).
+# 6. inputs["rolling_window"]: solve the year as windows of this many time intervals (288 = one day, 2016 = one week) instead of
+#    one annual model, inputs["rolling_lookahead"]: extra time intervals solved after each window, inputs["rolling_report"]: 
+#    whether to also run the full-horizon model and print the cost gap of the rolling horizon.
+# 7. inputs["builder"]: "pyomo" builds the model with Pyomo rules and solves it with inputs["solver"], "matrix" assembles it as 
+#    sparse matrices straight from the data and solves it with HiGHS (much faster model generation).
+# 8. inputs["template"]: build the model once with mutable parameters and only update them for each client and tariff, 
+#    re-solving on a persistent solver. inputs["tariffs"]: the ROM tariffs to run, range(0, 4) runs all four tariffs.
+# 9. inputs["LP_fast_path"]: relax the charging/discharging binaries where they are likely unnecessary, check the LP solution
+#    for complementarity and only fall back to binaries in the time intervals that violate it.
+# 10. inputs["cache"]: read the input files through the binary cache in data/.cache, which is built on the first run and 
+#     rebuilt when a source file changes. inputs["lazy_columns"]: without the cache, read only the load and PV columns of the
+#     client range (any other client is read when it is first used), so a run of a few clients starts quickly with little memory.
+# 11. inputs["checkpoint"]: write every client to output/.../parts as soon as it is solved; re-running with the same inputs 
+#     skips the clients that are already completed and writes the final files from all parts.
+# 12. inputs["output_format"]: format of the variable values, "csv", "parquet" (needs pyarrow), "hdf5" (needs h5py) or "npz".
+# 13. inputs["warm_start"]: start the MILP from an initial feasible point, "heuristic" (price-threshold dispatch) or "previous"
+#     (the client's last solution under another tariff or from a previous run), inputs["warm_start_report"]: compare the time
+#     to the first incumbent and the solve time with and without the warm start.
+# 14. inputs["engine"]: "milp" solves the models with inputs["solver"], "dp" solves AOM without FCAS and ROM by dynamic programming
+#     over inputs["SOC_steps"] SOC levels (no solver needed), inputs["dp_report"]: compare the DP costs with the MILP optimum.
+# 15. inputs["result_cache"]: load clients whose inputs and settings were already solved from output/result_cache and solve
+#     clients with identical inputs once, inputs["result_cache_size"]: size of the cache (MB) before old entries are evicted.
+# 16. inputs["metrics"]: append the phase times, memory, model size and solver statistics of every client and the read/write
+#     times to output/metrics.jsonl, inputs["progress"]: print the completed clients and the estimated time to completion.
+# 17. inputs["solver_options"]: MIP gap, time limit and any native options of the solver, inputs["race"]: solve every client with
+#     several solvers or option sets at once and keep the first result within inputs["race_tolerance"] (relative MIP gap).
+# 18. inputs["representative_days"]: approximate the annual costs from this many clustered representative days, inputs["resample"]:
+#     average this many time intervals into one, inputs["aggregation_report"]: compare with the full-resolution costs.
+# 19. inputs["sweep"]: solve the client range for every combination of the BESS power, energy and efficiency grids and write
+#     the cost surfaces to output/.../BESS_sweep.npz.
+# 20. inputs["compact"]: build the compact formulation of AOM and ROM, with the same costs from fewer variables and constraints,
+#     inputs["compact_report"]: compare the model size and solve time of the full and compact formulations.
+# 21. inputs["incremental"]: re-solve only the time intervals whose load, PV or prices changed since the client's last incremental
+#     run (output/incremental), extended by inputs["incremental_margin"] time intervals on each side, and keep the rest of the year.
+# 22. inputs["decomposition"]: split each client's year into blocks ("month" or a number of blocks of whole days) solved in parallel
+#     on inputs["workers"] processes and coordinated by prices on the boundary SOC until the cost is within
+#     inputs["decomposition_tolerance"] of the monolithic model (at most inputs["decomposition_iterations"] iterations).
+# 23. inputs["memory_budget"]: peak memory (MB) the run must fit in, None for no limit. The model memory is measured on short
+#     horizons of the first client and the compact formulation, float32 outputs, fewer workers or a rolling horizon are used
+#     until the estimated peak fits, e.g. 8000 to run AOM with FCAS on an 8 GB machine.
+# 24. inputs["validate"]: check the stored variable values of every client against the constraints of the model and recompute
+#     its costs with NumPy (no solver), and print the worst violation of each client (needs inputs["saveDetail"]).
+# 25. After you have completed all the configurations, simply run the model.
 
 # Imports ---------------------------------------------------------------------
 from read import *
 from model import *
 from write import *
+from runner import *
+from sweep import *
+from memory_budget import *
+from validate import *
 from collections  import OrderedDict
 from time import time
 import numpy as np
@@ -42,53 +90,178 @@ inputs["FCAS"]           = False
 inputs["Model"]          = "ROM"
 # Whether to save variable values                                             
 inputs["saveDetail"]     = False                                              
+# dtype of the saved variable values, "float64" or "float32"
+inputs["output_dtype"]   = "float64"
+# format of the saved variable values, "csv", "parquet", "hdf5" or "npz"
+inputs["output_format"]  = "csv"
+# whether to read the inputs through the binary cache
+inputs["cache"]          = False
+# whether to read only the load and PV columns of the client range (without the cache)
+inputs["lazy_columns"]   = False
+# whether to reuse the results of clients with the same inputs and settings, and the size of the result cache (MB)
+inputs["result_cache"]      = False
+inputs["result_cache_size"] = 1024
+# whether to log the metrics of every client to output/metrics.jsonl, and whether to print the progress and ETA of the run
+inputs["metrics"]        = False
+inputs["progress"]       = False
+# peak memory of the run (MB), the settings are adapted to fit it, None = no limit
+inputs["memory_budget"]  = None
+# whether to save each client as soon as it is solved and resume from the saved clients
+inputs["checkpoint"]     = False
+# which solver to use, "cplex", "glpk", "cbc", "gurobi" or "appsi_highs"
+inputs["solver"]         = "cplex"
+# solver options, the relative MIP gap and time limit (s) are translated for each solver, None = solver default
+inputs["solver_options"] = {"mip_gap": None, "time_limit": None}
+# solve each client with several contenders at once and keep the first result within race_tolerance (None = no race),
+# e.g. [{"solver": "cplex"}, {"solver": "cbc"}, {"solver": "cplex", "solver_options": {"mip_gap": 1e-3}}]
+inputs["race"]           = None
+inputs["race_tolerance"] = 1e-4
+# how to solve the model, "milp" or "dp"
+inputs["engine"]         = "milp"
+# number of SOC grid steps of the "dp" engine
+inputs["SOC_steps"]      = 100
+# whether to check the stored solutions against the constraints and recompute their costs (needs saveDetail)
+inputs["validate"]       = False
+# whether to compare the "dp" engine with the MILP optimum
+inputs["dp_report"]      = False
+# how to build the model, "pyomo" or "matrix"
+inputs["builder"]        = "pyomo"
+# whether to reuse one template model with mutable parameters for all clients and tariffs
+inputs["template"]       = False
+# whether to solve through the LP fast path
+inputs["LP_fast_path"]   = False
+# whether to build the compact formulation, and whether to compare it with the full formulation
+inputs["compact"]        = False
+inputs["compact_report"] = False
+# whether to re-solve only the time intervals whose inputs changed since the last incremental run, and the time intervals
+# re-solved around each change (288 = one day)
+inputs["incremental"]        = False
+inputs["incremental_margin"] = 288
+# blocks of the time decomposition of each client, "month", a number of blocks or None (one monolithic model), the relative
+# gap between the cost and its lower bound at which to stop, and the maximum number of iterations
+inputs["decomposition"]            = None
+inputs["decomposition_tolerance"]  = 1e-3
+inputs["decomposition_iterations"] = 50
+# initial point of the MILP, None, "heuristic" or "previous"
+inputs["warm_start"]        = None
+# whether to report the solve with and without the warm start
+inputs["warm_start_report"] = False
+# ROM tariffs to run, range(0, 4) = all four tariffs
+inputs["tariffs"]        = range(0, 1)
+# number of worker processes solving clients in parallel (1 = serial), or the blocks of each client with decomposition
+inputs["workers"]        = 1
+# number of threads of each solver, keep workers * solver_threads <= number of cores (None = solver default)
+inputs["solver_threads"] = None
+# rolling horizon window in time intervals, None = one full-horizon model per client
+inputs["rolling_window"]    = None
+# look-ahead time intervals solved after each window (not kept)
+inputs["rolling_lookahead"] = 0
+# whether to compare the rolling horizon with the full-horizon model
+inputs["rolling_report"]    = False
+# number of representative days solved instead of the whole year, None = all days
+inputs["representative_days"] = None
+# number of time intervals averaged into one before solving (6 = 30 minutes, 12 = hourly), None = full resolution
+inputs["resample"]             = None
+# whether to compare the representative days or resampled model with the full-resolution model
+inputs["aggregation_report"]   = False
+# grids of BESS power (kW), energy (kWh) and efficiency to sweep after the run, None = no sweep,
+# e.g. {"power": [3, 5, 7], "energy": [6.5, 10, 13.5], "eff": [0.9, 0.95]} (without "eff" the efficiency of DER.xlsx is kept)
+inputs["sweep"]                = None
 # max : 92                                                 
 inputs["number_clients"] = inputs["end_client"] - inputs["start_client"] + 1
 
-print(f'#############################################################################################################')
-print(f'# The model that is running now is {inputs["Model"]}.')
-print(f'# Participate in FCAS markets? - {inputs["FCAS"]}')
-print(f'# Save variable values?        - {inputs["saveDetail"]}')
-print(f'# The range of clients is from {inputs["start_client"]} to {inputs["end_client"] }')
-print(f'#############################################################################################################')
+# The guard keeps the worker processes of the parallel mode from re-running the optimisation when they import main.py
+if __name__ == "__main__":
+    print(f'#############################################################################################################')
+    print(f'# The model that is running now is {inputs["Model"]}.')
+    print(f'# Participate in FCAS markets? - {inputs["FCAS"]}')
+    print(f'# Save variable values?        - {inputs["saveDetail"]}')
+    print(f'# Workers x solver threads     - {inputs["workers"]} x {inputs["solver_threads"]}')
+    print(f'# The range of clients is from {inputs["start_client"]} to {inputs["end_client"] }')
+    print(f'#############################################################################################################')
 
-## Aggregator Optimisation Model (AOM)
-if inputs["Model"] == "AOM":
-    #! Read the Indices, sets, and Parameters 
-    data    = read_aggregator_business_model("aggregator_model_data/DER.xlsx", "aggregator_model_data/Prices.csv", "aggregator_model_data/Load time_series.csv", "aggregator_model_data/PV time_series.csv")
-    outputs = initialisation(inputs, data)
+    # Load and PV columns read at the start, None for all columns
+    lazy_clients = range(inputs["start_client"], inputs["end_client"] + 1) if inputs["lazy_columns"] else None
+
+    ## Aggregator Optimisation Model (AOM)
+    if inputs["Model"] == "AOM":
+        #! Read the Indices, sets, and Parameters 
+        clock   = time()
+        data    = read_aggregator_business_model("aggregator_model_data/DER.xlsx", "aggregator_model_data/Prices.csv", "aggregator_model_data/Load time_series.csv", "aggregator_model_data/PV time_series.csv", cache=inputs["cache"], clients=lazy_clients)
+        full_data = data
+        if inputs["resample"]:
+            data = resample_data(data, inputs["resample"])
+        if inputs["memory_budget"]:
+            inputs = plan_memory(inputs, data)
+        outputs = initialisation(inputs, data)
+        log_phase(inputs, "read", clock)
     
-    #! Planning optimisation 
-    for cnum in range(inputs["start_client"], inputs["end_client"] + 1):
-        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} :::::::::::::::::::::::::::::::")
-        outputs = Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=inputs["saveDetail"], FCAS=inputs["FCAS"])
+        #! Planning optimisation 
+        outputs = run_clients(inputs, data, outputs)
+        if inputs["validate"]:
+            validate_outputs(inputs, data, outputs)
+        if inputs["rolling_window"] and inputs["rolling_report"]:
+            compare_with_full_horizon(inputs, data, outputs)
+        if inputs["warm_start"] and inputs["warm_start_report"]:
+            warm_start_report(inputs, data)
+        if inputs["compact_report"]:
+            compact_report(inputs, data)
+        if inputs["engine"] == "dp" and inputs["dp_report"]:
+            compare_with_MILP(inputs, data, outputs)
+        if (inputs["representative_days"] or inputs["resample"]) and inputs["aggregation_report"]:
+            compare_with_full_resolution(inputs, full_data, outputs)
+        if inputs["sweep"]:
+            sweep_BESS(inputs, data)
         
-    #! Print and write the outputs to the folder output/aggregator_business_model/with_FCAS or without_FCAS
-    if inputs["FCAS"]:    
-        write_cost_outputs(outputs, inputs, data, "aggregator_business_model/with_FCAS")
-        if inputs["saveDetail"]:
-            write_var_output(outputs, inputs, data, "aggregator_business_model/with_FCAS")
-    else:
-        write_cost_outputs(outputs, inputs, data, "aggregator_business_model/without_FCAS")
-        if inputs["saveDetail"]:
-            write_var_output(outputs, inputs, data, "aggregator_business_model/without_FCAS")
+        #! Print and write the outputs to the folder output/aggregator_business_model/with_FCAS or without_FCAS
+        clock = time()
+        if inputs["FCAS"]:    
+            write_cost_outputs(outputs, inputs, data, "aggregator_business_model/with_FCAS")
+            if inputs["saveDetail"]:
+                write_var_output(outputs, inputs, data, "aggregator_business_model/with_FCAS")
+        else:
+            write_cost_outputs(outputs, inputs, data, "aggregator_business_model/without_FCAS")
+            if inputs["saveDetail"]:
+                write_var_output(outputs, inputs, data, "aggregator_business_model/without_FCAS")
+        log_phase(inputs, "write", clock)
     
-    print("------------------------------Writing done------------------------------")
+        print("------------------------------Writing done------------------------------")
 
-## Retail Optimisation Model (ROM)
-elif inputs["Model"] == "ROM":
-    #! Read the Indices, sets, and Parameters 
-    data    = read_retail_business_model("retail_model_data/DER.xlsx", "retail_model_data/retail_sell.csv", "retail_model_data/retail_buy.csv", "retail_model_data/Wholesale prices.csv", "retail_model_data/Inflexible load.csv", "retail_model_data/PV.csv")
-    outputs = initialisation(inputs, data)
+    ## Retail Optimisation Model (ROM)
+    elif inputs["Model"] == "ROM":
+        #! Read the Indices, sets, and Parameters 
+        clock   = time()
+        data    = read_retail_business_model("retail_model_data/DER.xlsx", "retail_model_data/retail_sell.csv", "retail_model_data/retail_buy.csv", "retail_model_data/Wholesale prices.csv", "retail_model_data/Inflexible load.csv", "retail_model_data/PV.csv", cache=inputs["cache"], clients=lazy_clients)
+        full_data = data
+        if inputs["resample"]:
+            data = resample_data(data, inputs["resample"])
+        if inputs["memory_budget"]:
+            inputs = plan_memory(inputs, data, inputs["tariffs"][0])
+        outputs = initialisation(inputs, data)
+        log_phase(inputs, "read", clock)
     
-    #! Planning optimisation based on four tariffs
-    for tnum in range(0, 1):
-        for cnum in range(inputs["start_client"], inputs["end_client"] + 1):
-            print(f"::::::::::::::::::::::::::::::: client ID = {cnum} with tariff {tnum} :::::::::::::::::::::::::::::::")
-            outputs = Retail_Optimisation_Model(data, outputs, cnum, tnum, saveDetail=inputs["saveDetail"])
-        #! Print and write the outputs to the folder output/retail_business_model/tariff_{tnum}
-        write_cost_outputs(outputs, inputs, data, f'retail_business_model/tariff_{tnum}/')
-        if inputs["saveDetail"]:
-            write_var_output_v2(outputs, inputs, data, f'retail_business_model/tariff_{tnum}/')
+        #! Planning optimisation based on four tariffs
+        for tnum in inputs["tariffs"]:
+            outputs = run_clients(inputs, data, outputs, tnum)
+            if inputs["validate"]:
+                validate_outputs(inputs, data, outputs, tnum)
+            if inputs["rolling_window"] and inputs["rolling_report"]:
+                compare_with_full_horizon(inputs, data, outputs, tnum)
+            if inputs["warm_start"] and inputs["warm_start_report"]:
+                warm_start_report(inputs, data, tnum)
+            if inputs["compact_report"]:
+                compact_report(inputs, data, tnum)
+            if inputs["engine"] == "dp" and inputs["dp_report"]:
+                compare_with_MILP(inputs, data, outputs, tnum)
+            if (inputs["representative_days"] or inputs["resample"]) and inputs["aggregation_report"]:
+                compare_with_full_resolution(inputs, full_data, outputs, tnum)
+            if inputs["sweep"]:
+                sweep_BESS(inputs, data, tnum)
+            #! Print and write the outputs to the folder output/retail_business_model/tariff_{tnum}
+            clock = time()
+            write_cost_outputs(outputs, inputs, data, f'retail_business_model/tariff_{tnum}/')
+            if inputs["saveDetail"]:
+                write_var_output_v2(outputs, inputs, data, f'retail_business_model/tariff_{tnum}/')
+            log_phase(inputs, "write", clock, tnum)
         
-    print("------------------------------Writing done------------------------------")
+        print("------------------------------Writing done------------------------------")
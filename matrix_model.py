@@ -0,0 +1,393 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Matrix-form builder of AOM and ROM. The formulation is exactly the one of model.py (objective (1)/(18), constraints (2)-(17)
+# and (19)-(26)), but instead of calling a Pyomo rule once per time interval, every constraint family is assembled at once
+# from the NumPy arrays in `data` into one sparse CSR matrix A with row bounds, variable bounds, a cost vector c and the
+# integrality of the variables:
+#
+#       min c'x   s.t.   row_lb <= A x <= row_ub,   lb <= x <= ub,   x[j] integer if integrality[j] = 1
+#
+# The matrices are handed in bulk to HiGHS through scipy.optimize.milp. `check_equivalence` verifies the matrices against
+# the Pyomo formulation of model.py.
+
+# Imports ---------------------------------------------------------------------
+from pyomo.environ import *
+from collections import OrderedDict
+from time import time
+from scipy.optimize import milp, Bounds, LinearConstraint
+import scipy.sparse as sp
+import numpy as np
+from model import *
+from instrumentation import *
+
+## Matrix form ---------------------------------------------------------------------
+def aggregator_matrices(data, cnum, FCAS=True, SOC_0=0, timings=None):
+    '''Assemble the AOM of client cnum in matrix form
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            cnum (Int): client number or ID
+            FCAS (bool, optional): Whether to participate in FCAS markets
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            timings (dict, optional): Phase times, the assembly time of the parameters, variables, objective and constraints is added
+
+        Returns:
+            mat (OrderedDict): c, A, row_lb, row_ub, lb, ub, integrality and the offset of each variable in x ("index")
+    '''
+    clock = time()
+    lenT = len(data["T"])
+    lenW = len(data["W"])
+    P_il = data["load"].iloc[:, cnum].to_numpy(dtype=float)
+    MPV  = data["PV"].iloc[:, cnum].to_numpy(dtype=float)
+    MP_C, MP_D = data["power"], data["power"]
+    SOC_min, SOC_max = data["Min_SOC"], data["Max_SOC"]
+    Δt, η = data["Δt"], data["eff"]
+    clock = record_phase(timings, "parameters", clock)
+
+    ##! Variables: name, length, lower bound, upper bound, integer
+    variables = [("E", lenT, -np.inf, np.inf, 0), ("P_c", lenT, 0, np.inf, 0), ("P_d", lenT, 0, np.inf, 0), ("PV", lenT, 0, np.inf, 0),
+                 ("SOC", lenT + 1, -np.inf, np.inf, 0), ("τ", lenT, 0, 1, 1)]
+    if FCAS:
+        variables += [("L", lenT * lenW, 0, np.inf, 0), ("R", lenT * lenW, 0, np.inf, 0)]
+        variables += [(name, lenT, 0, np.inf, 0) for name in ["L_c", "L_d", "R_c", "R_d", "L_pv", "R_pv"]]
+    mat = new_matrices(variables)
+    x   = mat["index"]
+    clock = record_phase(timings, "variables", clock)
+
+    ##! Objective function (1)
+    mat["c"][x["E"]] = data["energy_price"].to_numpy(dtype=float) * Δt
+    if FCAS:
+        mat["c"][x["R"]] = -data["R_FCAS_price"].reshape(-1) * Δt
+        mat["c"][x["L"]] = -data["L_FCAS_price"].reshape(-1) * Δt
+    clock = record_phase(timings, "objective", clock)
+
+    ##! Constraints
+    T, T1 = np.arange(lenT), np.arange(1, lenT + 1)
+    ones  = np.ones(lenT)
+    rows  = []
+    # Constraint (2): E[t] - P_c[t] + P_d[t] + PV[t] == P_il[t]
+    rows.append(constraint_rows([(x["E"], ones), (x["P_c"], -ones), (x["P_d"], ones), (x["PV"], ones)], P_il, P_il))
+    # Constraints (3)-(4): P_d[t] + MP_D τ[t] <= MP_D and P_c[t] - MP_C τ[t] <= 0
+    rows.append(constraint_rows([(x["P_d"], ones), (x["τ"], MP_D * ones)], -np.inf, MP_D))
+    rows.append(constraint_rows([(x["P_c"], ones), (x["τ"], -MP_C * ones)], -np.inf, 0))
+    # Constraint (5): SOC[t+1] - SOC[t] - P_c[t] η Δt + P_d[t] Δt / η == 0
+    rows.append(constraint_rows([(x["SOC"][T1], ones), (x["SOC"][T], -ones), (x["P_c"], -η * Δt * ones), (x["P_d"], Δt / η * ones)], 0, 0))
+    # Constraint (6): SOC_min <= SOC[t+1] <= SOC_max
+    rows.append(constraint_rows([(x["SOC"][T1], ones)], SOC_min, SOC_max))
+    # Constraint (15): 0 <= PV[t] <= MPV[t]
+    rows.append(constraint_rows([(x["PV"], ones)], 0, MPV))
+    # Additional SOC constraint: SOC[0] == SOC_0
+    rows.append(constraint_rows([(x["SOC"][[0]], np.ones(1))], SOC_0, SOC_0))
+
+    if FCAS:
+        TW, Tw = np.arange(lenT * lenW), np.repeat(T, lenW)
+        ones_w = np.ones(lenT * lenW)
+        # Constraints (9)-(10): R[t, w] - R_c[t] - R_d[t] - R_pv[t] <= 0 and L[t, w] - L_c[t] - L_d[t] - L_pv[t] <= 0
+        rows.append(constraint_rows([(x["R"][TW], ones_w), (x["R_c"][Tw], -ones_w), (x["R_d"][Tw], -ones_w), (x["R_pv"][Tw], -ones_w)], -np.inf, 0))
+        rows.append(constraint_rows([(x["L"][TW], ones_w), (x["L_c"][Tw], -ones_w), (x["L_d"][Tw], -ones_w), (x["L_pv"][Tw], -ones_w)], -np.inf, 0))
+        # Constraints (11)-(12): R_d[t] + P_d[t] <= MP_D and R_c[t] - P_c[t] <= 0
+        rows.append(constraint_rows([(x["R_d"], ones), (x["P_d"], ones)], -np.inf, MP_D))
+        rows.append(constraint_rows([(x["R_c"], ones), (x["P_c"], -ones)], -np.inf, 0))
+        # Constraints (13)-(14): L_c[t] + P_c[t] <= MP_C and L_d[t] - P_d[t] <= 0
+        rows.append(constraint_rows([(x["L_c"], ones), (x["P_c"], ones)], -np.inf, MP_C))
+        rows.append(constraint_rows([(x["L_d"], ones), (x["P_d"], -ones)], -np.inf, 0))
+        # Constraints (7)-(8): (L_c[t] η + L_d[t] / η) Δt + SOC[t+1] <= SOC_max and (R_c[t] η + R_d[t] / η) Δt - SOC[t+1] <= -SOC_min
+        rows.append(constraint_rows([(x["L_c"], η * Δt * ones), (x["L_d"], Δt / η * ones), (x["SOC"][T1], ones)], -np.inf, SOC_max))
+        rows.append(constraint_rows([(x["R_c"], η * Δt * ones), (x["R_d"], Δt / η * ones), (x["SOC"][T1], -ones)], -np.inf, -SOC_min))
+        # Constraints (16)-(17): R_pv[t] + PV[t] <= MPV[t] and L_pv[t] - PV[t] <= 0
+        rows.append(constraint_rows([(x["R_pv"], ones), (x["PV"], ones)], -np.inf, MPV))
+        rows.append(constraint_rows([(x["L_pv"], ones), (x["PV"], -ones)], -np.inf, 0))
+
+    mat = stack_rows(mat, rows)
+    record_phase(timings, "constraints", clock)
+    return mat
+
+def retail_matrices(data, cnum, tnum, SOC_0=0, timings=None):
+    '''Assemble the ROM of client cnum under tariff tnum in matrix form
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            cnum (Int): client number or ID
+            tnum (Int): The tariff used in this model
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            timings (dict, optional): Phase times, the assembly time of the parameters, variables, objective and constraints is added
+
+        Returns:
+            mat (OrderedDict): c, A, row_lb, row_ub, lb, ub, integrality and the offset of each variable in x ("index")
+    '''
+    clock = time()
+    lenT = len(data["T"])
+    P_il = data["load"].iloc[:, cnum].to_numpy(dtype=float)
+    MPV  = data["PV"].iloc[:, cnum].to_numpy(dtype=float)
+    MP_C, MP_D = data["power"][cnum], data["power"][cnum]
+    SOC_min, SOC_max = data["Min_SOC"], data["Max_SOC"][cnum]
+    Δt, η = data["Δt"], data["eff"][cnum]
+    clock = record_phase(timings, "parameters", clock)
+
+    ##! Variables: name, length, lower bound, upper bound, integer
+    variables = [("E", lenT, -np.inf, np.inf, 0), ("P_c", lenT, 0, np.inf, 0), ("P_d", lenT, 0, np.inf, 0), ("PV", lenT, -np.inf, np.inf, 0),
+                 ("SOC", lenT + 1, -np.inf, np.inf, 0), ("τ", lenT, 0, 1, 1), ("E_b", lenT, 0, np.inf, 0), ("E_s", lenT, 0, np.inf, 0)]
+    mat = new_matrices(variables)
+    x   = mat["index"]
+    clock = record_phase(timings, "variables", clock)
+
+    ##! Objective function (18)
+    mat["c"][x["E_b"]] = data["tariff_buy"][str(tnum)].to_numpy(dtype=float) * Δt
+    mat["c"][x["E_s"]] = -data["tariff_sell"][str(tnum)] * Δt
+    clock = record_phase(timings, "objective", clock)
+
+    ##! Constraints
+    T, T1 = np.arange(lenT), np.arange(1, lenT + 1)
+    ones  = np.ones(lenT)
+    rows  = []
+    # Constraint (19): E[t] - P_c[t] + P_d[t] + PV[t] == P_il[t]
+    rows.append(constraint_rows([(x["E"], ones), (x["P_c"], -ones), (x["P_d"], ones), (x["PV"], ones)], P_il, P_il))
+    # Constraint (20): E[t] - E_b[t] + E_s[t] == 0
+    rows.append(constraint_rows([(x["E"], ones), (x["E_b"], -ones), (x["E_s"], ones)], 0, 0))
+    # Constraints (22)-(23): P_d[t] + MP_D τ[t] <= MP_D and P_c[t] - MP_C τ[t] <= 0
+    rows.append(constraint_rows([(x["P_d"], ones), (x["τ"], MP_D * ones)], -np.inf, MP_D))
+    rows.append(constraint_rows([(x["P_c"], ones), (x["τ"], -MP_C * ones)], -np.inf, 0))
+    # Constraint (24): SOC[t+1] - SOC[t] - P_c[t] η Δt + P_d[t] Δt / η == 0
+    rows.append(constraint_rows([(x["SOC"][T1], ones), (x["SOC"][T], -ones), (x["P_c"], -η * Δt * ones), (x["P_d"], Δt / η * ones)], 0, 0))
+    # Constraint (25): SOC_min <= SOC[t+1] <= SOC_max
+    rows.append(constraint_rows([(x["SOC"][T1], ones)], SOC_min, SOC_max))
+    # Constraint (26): 0 <= PV[t] <= MPV[t]
+    rows.append(constraint_rows([(x["PV"], ones)], 0, MPV))
+    # Additional SOC constraint: SOC[0] == SOC_0
+    rows.append(constraint_rows([(x["SOC"][[0]], np.ones(1))], SOC_0, SOC_0))
+
+    mat = stack_rows(mat, rows)
+    record_phase(timings, "constraints", clock)
+    return mat
+
+def new_matrices(variables):
+    '''Lay the variables out in x and initialise the cost vector, variable bounds and integrality
+    '''
+    mat   = OrderedDict(index=OrderedDict())
+    start = 0
+    lb, ub, integrality = [], [], []
+    for name, length, low, up, integer in variables:
+        mat["index"][name] = np.arange(start, start + length)
+        lb.append(np.full(length, low, dtype=float))
+        ub.append(np.full(length, up, dtype=float))
+        integrality.append(np.full(length, integer))
+        start += length
+    mat["c"]           = np.zeros(start)
+    mat["lb"]          = np.concatenate(lb)
+    mat["ub"]          = np.concatenate(ub)
+    mat["integrality"] = np.concatenate(integrality)
+    return mat
+
+def constraint_rows(terms, row_lb, row_ub):
+    '''One family of constraints in coordinate form. Row i has the coefficient coef[i] on the variable columns[i] of each
+        (columns, coef) term.
+    '''
+    n_rows  = len(terms[0][0])
+    rows    = np.tile(np.arange(n_rows), len(terms))
+    columns = np.concatenate([columns for columns, _ in terms])
+    coefs   = np.concatenate([coef for _, coef in terms])
+    return rows, columns, coefs, np.broadcast_to(row_lb, n_rows), np.broadcast_to(row_ub, n_rows)
+
+def stack_rows(mat, families):
+    '''Stack the constraint families into one CSR matrix with its row bounds
+    '''
+    offset = 0
+    rows, columns, coefs, row_lb, row_ub = [], [], [], [], []
+    for r, j, a, low, up in families:
+        rows.append(r + offset)
+        columns.append(j)
+        coefs.append(a)
+        row_lb.append(low)
+        row_ub.append(up)
+        offset += len(low)
+    mat["A"] = sp.csr_matrix((np.concatenate(coefs), (np.concatenate(rows), np.concatenate(columns))), shape=(offset, len(mat["c"])))
+    mat["row_lb"] = np.concatenate(row_lb).astype(float)
+    mat["row_ub"] = np.concatenate(row_ub).astype(float)
+    return mat
+
+def solve_matrices(mat, time_limit=None, mip_gap=None):
+    '''Hand the matrices in bulk to HiGHS
+
+        Returns:
+            x (np.ndarray): Optimal solution
+            result: Result of scipy.optimize.milp
+    '''
+    options = {}
+    if time_limit is not None:
+        options["time_limit"] = time_limit
+    if mip_gap is not None:
+        options["mip_rel_gap"] = mip_gap
+    result = milp(mat["c"], integrality=mat["integrality"], bounds=Bounds(mat["lb"], mat["ub"]),
+                  constraints=LinearConstraint(mat["A"], mat["row_lb"], mat["row_ub"]), options=options)
+    if result.x is None:
+        raise RuntimeError(f"The matrix model has no solution: {result.message}")
+    return result.x, result
+
+## Models ---------------------------------------------------------------------
+def Aggregator_Matrix_Model(data, outputs, cnum, saveDetail=False, FCAS=True, SOC_0=0, solver_options=None):
+    '''AOM built in matrix form, fills the same outputs as Aggregator_Optimisation_Model
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            saveDetail (bool, optional): Whether to save variable specific data
+            FCAS (bool, optional): Whether to participate in FCAS markets
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            solver_options (dict, optional): "mip_gap" and "time_limit" of HiGHS, other options are ignored
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    mat = aggregator_matrices(data, cnum, FCAS, SOC_0, timings=phase_timings())
+    print("------------------------------Matrices done------------------------------")
+    start = time()
+    x, result = solve_matrices(mat, (solver_options or {}).get("time_limit"), (solver_options or {}).get("mip_gap"))
+    solved = record_phase(phase_timings(), "solve", start)
+    record_matrix_solver(result, solved - start)
+    print("------------------------------Solution done------------------------------")
+    print(result.message)
+
+    ##! Output
+    values = {name: x[index] for name, index in mat["index"].items()}
+    outputs["time"][cnum]        = solved - start
+    outputs["bin_vars"][cnum]    = len(values["τ"])
+    outputs["real_vars"][cnum]   = len(x) - outputs["bin_vars"][cnum]
+    outputs["constraints"][cnum] = mat["A"].shape[0]
+    outputs["total_net_cost"][cnum]  = np.dot(mat["c"], x)
+    outputs["energy_net_cost"][cnum] = np.dot(mat["c"][mat["index"]["E"]], values["E"])
+    outputs["FCAS_net_cost"][cnum]   = outputs["total_net_cost"][cnum] - outputs["energy_net_cost"][cnum]
+    print("Annual cost output done")
+    if saveDetail:
+        save_values(outputs, data, cnum, values, FCAS)
+    print("-----------------------------Outputs done--------------------------------")
+    record_phase(phase_timings(), "extract", solved)
+
+    return outputs
+
+def Retail_Matrix_Model(data, outputs, cnum, tnum, saveDetail=False, SOC_0=0, solver_options=None):
+    '''ROM built in matrix form, fills the same outputs as Retail_Optimisation_Model
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            tnum (Int): The tariff used in this model
+            saveDetail (bool, optional): Whether to save variable specific data
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            solver_options (dict, optional): "mip_gap" and "time_limit" of HiGHS, other options are ignored
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    mat = retail_matrices(data, cnum, tnum, SOC_0, timings=phase_timings())
+    print("------------------------------Matrices done------------------------------")
+    start = time()
+    x, result = solve_matrices(mat, (solver_options or {}).get("time_limit"), (solver_options or {}).get("mip_gap"))
+    solved = record_phase(phase_timings(), "solve", start)
+    record_matrix_solver(result, solved - start)
+    print("------------------------------Solution done------------------------------")
+    print(result.message)
+
+    ##! Output
+    values = {name: x[index] for name, index in mat["index"].items()}
+    outputs["time"][cnum]        = solved - start
+    outputs["bin_vars"][cnum]    = len(values["τ"])
+    outputs["real_vars"][cnum]   = len(x) - outputs["bin_vars"][cnum]
+    outputs["constraints"][cnum] = mat["A"].shape[0]
+    outputs["total_net_cost"][cnum] = np.dot(mat["c"], x)
+    outputs["cost_c"][cnum]         = np.dot(data["energy_price"].to_numpy(dtype=float), values["E"]) * data["Δt"]
+    print(f'Retail cost: {outputs["total_net_cost"][cnum]}, wholesale cost: {outputs["cost_c"][cnum]}')
+    if saveDetail:
+        save_values(outputs, data, cnum, values, False)
+        outputs["E_buy"][:, column(outputs, cnum)]  = values["E_b"]
+        outputs["E_sell"][:, column(outputs, cnum)] = values["E_s"]
+    print("-----------------------------Outputs done--------------------------------")
+    record_phase(phase_timings(), "extract", solved)
+
+    return outputs
+
+# Termination condition of each scipy.optimize.milp status, named as Pyomo's TerminationCondition
+MILP_TERMINATION = {0: "optimal", 1: "maxTimeLimit", 2: "infeasible", 3: "unbounded"}
+
+def record_matrix_solver(result, solve_time):
+    '''instrumentation.record_solver for the result of scipy.optimize.milp
+    '''
+    if not current:
+        return
+    current["solver"].update(termination=MILP_TERMINATION.get(result.status, "other"), status=result.message,
+                             nodes=number(getattr(result, "mip_node_count", None)), gap=number(getattr(result, "mip_gap", None)),
+                             time=solve_time)
+
+def save_values(outputs, data, cnum, values, FCAS):
+    '''Save the variable values of client cnum into outputs, in the same layout as model.py
+    '''
+    col = column(outputs, cnum)
+    outputs["E_b"][:, col] = values["E"]
+    if FCAS:
+        lenW = len(data["W"])
+        outputs["L_b"][:, :, col] = values["L"].reshape(-1, lenW)
+        outputs["R_b"][:, :, col] = values["R"].reshape(-1, lenW)
+        for name in ["L_c", "L_d", "R_c", "R_d", "L_pv", "R_pv"]:
+            outputs[name][:, col] = values[name]
+    outputs["P_c"][:, col] = values["P_c"]
+    outputs["P_d"][:, col] = values["P_d"]
+    outputs["SOC"][:, col] = values["SOC"]
+    outputs["PV"][:, col]  = values["PV"]
+
+## Equivalence with the Pyomo formulation ---------------------------------------------------------------------
+def check_equivalence(data, cnum, tnum=None, Model="AOM", FCAS=True, solver=None, tol=1e-6):
+    '''Check the matrix form against the Pyomo formulation of model.py: the optimum of the matrix form is loaded into the
+        Pyomo model, which must then satisfy every Pyomo constraint and give the same objective value. If a solver is given,
+        the Pyomo model is also solved and both optima must agree.
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM
+            Model (String, optional): "AOM" or "ROM"
+            FCAS (bool, optional): Whether to participate in FCAS markets (AOM only)
+            solver (String, optional): Solver of the Pyomo model, None to skip solving it
+            tol (float, optional): Absolute tolerance of constraint violations and relative tolerance of objective values
+
+        Returns:
+            report (OrderedDict): sizes of both formulations, worst violation, objective values and whether they are equivalent
+    '''
+    if Model == "AOM":
+        mat = aggregator_matrices(data, cnum, FCAS)
+        m   = build_aggregator_model(data, cnum, FCAS)
+    else:
+        mat = retail_matrices(data, cnum, tnum)
+        m   = build_retail_model(data, cnum, tnum)
+    x, _ = solve_matrices(mat)
+
+    # Load the matrix solution into the Pyomo variables (x is laid out in the order of the Pyomo index sets)
+    for name, index in mat["index"].items():
+        for var, v in zip(getattr(m, name).values(), x[index]):
+            var.set_value(v, skip_validation=True)
+
+    report = OrderedDict()
+    report["matrix_size"] = mat["A"].shape
+    report["pyomo_size"]  = (sum(len(c) for c in m.component_objects(Constraint, active=True)), sum(len(v) for v in m.component_objects(Var)))
+    report["max_violation"] = 0.0
+    for constraint in m.component_data_objects(Constraint, active=True):
+        body = value(constraint.body)
+        if constraint.has_lb():
+            report["max_violation"] = max(report["max_violation"], float(value(constraint.lower) - body))
+        if constraint.has_ub():
+            report["max_violation"] = max(report["max_violation"], float(body - value(constraint.upper)))
+    report["matrix_objective"] = float(np.dot(mat["c"], x))
+    report["pyomo_objective"]  = value(m.obj)
+    equivalent = report["matrix_size"] == report["pyomo_size"] and report["max_violation"] <= tol \
+                 and abs(report["matrix_objective"] - report["pyomo_objective"]) <= tol * max(1, abs(report["pyomo_objective"]))
+    if solver is not None:
+        get_solver(solver).solve(m, tee=False)
+        report["pyomo_optimum"] = value(m.obj)
+        equivalent = equivalent and abs(report["matrix_objective"] - report["pyomo_optimum"]) <= tol * max(1, abs(report["pyomo_optimum"]))
+    report["equivalent"] = bool(equivalent)
+    print(f'Matrix form vs Pyomo of client {cnum}: {report}')
+    return report
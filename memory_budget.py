@@ -0,0 +1,152 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Memory budget of a run (inputs["memory_budget"], MB). The memory of a run is the data and the interpreter of every process,
+# the outputs container (initialisation) and, while a client is solved, its Pyomo model and the solver's copy of it, which
+# grow linearly with the number of time intervals. The model memory per time interval is measured by solving the first client
+# over two short horizons (the peak RSS of this process and of the solver processes during each solve), and the peak of the
+# run is estimated for the configured settings. If it is above the budget, the strategies below are added one at a time
+# until the estimate fits:
+# - the compact formulation (fewer variables and constraints, the same costs)
+# - float32 variable values in the outputs (half the memory of the outputs container)
+# - fewer worker processes (every worker holds the data, an outputs container and a model)
+# - a rolling horizon of four weeks, one week or one day (smaller models, a small cost gap, see rolling.py)
+# In this mode, the model of a client is also released (garbage collected) before the next client is built.
+
+# Imports ---------------------------------------------------------------------
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from copy import copy
+import numpy as np
+from read import *
+from runner import *
+from instrumentation import rss_MB, peak_rss_MB, reset_peak_rss, solver_peak_MB
+
+# Number of time intervals of the two horizons solved to measure the model memory
+PROBE_INTERVALS = (1008, 2016)
+
+def plan_memory(inputs, data, tnum=None):
+    '''Settings of inputs whose estimated peak memory fits inputs["memory_budget"] (MB)
+
+        Args:
+            inputs (OrderedDict): MILP model configuration
+            data (OrderedDict): Model information
+            tnum (Int, optional): The tariff used in ROM
+
+        Returns:
+            planned (OrderedDict): Copy of inputs with the strategies that fit the budget, or all strategies if none fits
+    '''
+    budget = inputs["memory_budget"]
+    plans  = memory_plans(inputs, data)
+    # Model memory of each formulation in the plans
+    models = OrderedDict()
+    for _, planned in plans:
+        if planned["compact"] not in models:
+            models[planned["compact"]] = model_memory(planned, data, tnum)
+    base   = rss_MB()
+    print(f"------------------------------Memory budget {budget:.0f} MB: {base:.0f} MB in use------------------------------")
+    for compact, model in models.items():
+        print(f'------------------------------{"Compact" if compact else "Full"} model: {model[0]:.1f} MB + '
+              f'{1000 * model[1]:.2f} MB per 1000 time intervals------------------------------')
+    for strategy, planned in plans:
+        estimate = estimate_memory(planned, data, models[planned["compact"]], base)
+        print(f"------------------------------{strategy}: estimated peak {estimate:.0f} MB------------------------------")
+        if estimate <= budget:
+            return planned
+    print(f"------------------------------No strategy fits {budget:.0f} MB, running with all of them------------------------------")
+    return planned
+
+def memory_plans(inputs, data):
+    '''Settings with the memory strategies added one at a time, from the configured settings to the smallest ones
+
+        Returns:
+            plans (list): (description, inputs) of each step
+    '''
+    planned = copy(inputs)
+    plans   = [("As configured", copy(planned))]
+    pyomo   = inputs["engine"] == "milp" and inputs["builder"] == "pyomo"
+    if pyomo and not planned["compact"]:
+        planned["compact"] = True
+        plans.append(("Compact formulation", copy(planned)))
+    if planned["saveDetail"] and planned["output_dtype"] != "float32":
+        planned["output_dtype"] = "float32"
+        plans.append(("float32 outputs", copy(planned)))
+    while planned["workers"] > 1:
+        planned["workers"] = planned["workers"] // 2
+        plans.append((f"{planned['workers']} worker{'s' if planned['workers'] > 1 else ''}", copy(planned)))
+    # Rolling horizons only replace the monolithic annual model
+    if pyomo and not (planned["rolling_window"] or planned["representative_days"] or planned["decomposition"] or planned["incremental"]):
+        per_day = 24 / data["Δt"]
+        for days, name in [(28, "four weeks"), (7, "one week"), (1, "one day")]:
+            window = int(round(days * per_day))
+            if window < len(data["T"]):
+                planned["rolling_window"], planned["rolling_lookahead"] = window, 0
+                plans.append((f"Rolling horizon of {name} ({window} time intervals)", copy(planned)))
+    return plans
+
+def estimate_memory(inputs, data, model, base):
+    '''Estimated peak memory (MB) of a run: this process with its outputs, and every worker process with the data, an outputs
+        container and the model of one client (or its share of the decomposition blocks)
+
+        Args:
+            model (tuple): Model memory (MB) as (constant, per time interval), see model_memory
+            base (float): Memory in use before the run (MB), the interpreter and the data
+    '''
+    clients = inputs["end_client"] - inputs["start_client"] + 1
+    outputs = outputs_memory(inputs, data)
+    client  = model[0] + model[1] * model_horizon(inputs, data)
+    workers = min(inputs["workers"], clients) if not inputs["decomposition"] else inputs["workers"]
+    if workers <= 1:
+        return base + outputs + client
+    return base + outputs + workers * (base + outputs + client)
+
+def model_horizon(inputs, data):
+    '''Number of time intervals of the largest model a process holds at a time
+    '''
+    lenT = len(data["T"])
+    if inputs["rolling_window"]:
+        return min(inputs["rolling_window"] + inputs["rolling_lookahead"], lenT)
+    if inputs["representative_days"]:
+        return round(24 / data["Δt"])
+    if inputs["decomposition"]:
+        # Every worker keeps the models of its blocks
+        blocks = 12 if inputs["decomposition"] == "month" else inputs["decomposition"]
+        return lenT * int(np.ceil(blocks / max(min(inputs["workers"], blocks), 1))) / blocks
+    return lenT
+
+def outputs_memory(inputs, data):
+    '''Memory of the variable arrays of the outputs container (MB), allocated by initialisation
+    '''
+    return sum(value.nbytes for value in initialisation(inputs, data).values() if isinstance(value, np.ndarray)) / 1e6
+
+def model_memory(inputs, data, tnum=None):
+    '''Memory of the model of a client as a linear function of the number of time intervals, measured from the peak RSS of
+        solving the first client over each of PROBE_INTERVALS (in this process, and in the solver process for shell solvers)
+
+        Returns:
+            model (tuple): (constant MB, MB per time interval)
+    '''
+    probe_inputs = copy(inputs)
+    probe_inputs.update(start_client=inputs["start_client"], end_client=inputs["start_client"], saveDetail=False, workers=1,
+                        checkpoint=False, result_cache=False, metrics=False, progress=False, race=None, incremental=False,
+                        decomposition=None, representative_days=None, rolling_window=None, warm_start=None)
+    sizes, peaks = [], []
+    for probe in PROBE_INTERVALS:
+        sizes.append(min(probe, len(data["T"])))
+        # A new process for every probe, so that memory freed by an earlier solve is not reused
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            peaks.append(pool.submit(probe_memory, probe_inputs, slice_data(data, 0, sizes[-1]), tnum).result())
+    per_interval = max((peaks[1] - peaks[0]) / (sizes[1] - sizes[0]), 0) if sizes[1] > sizes[0] else peaks[1] / sizes[1]
+    return max(peaks[1] - per_interval * sizes[1], 0), per_interval
+
+def probe_memory(inputs, data, tnum=None):
+    '''Peak memory (MB) added by solving the first client of inputs over data, in this process and in the solver process of
+        a shell solver, which holds its own copy of the model
+    '''
+    reset_peak_rss()
+    before = rss_MB()
+    solve_client(inputs, data, initialisation(inputs, data), inputs["start_client"], tnum)
+    return peak_rss_MB() - before + solver_peak_MB()
@@ -18,11 +18,19 @@
 
 # Imports ---------------------------------------------------------------------
 from pyomo.environ import *
+from time import time
+from collections import OrderedDict
+import os
+import re
+import tempfile
 import numpy as np
 import pandas as pd
 from read import *
+from dp_model import *
+from instrumentation import *
 
-def Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=False, FCAS=True):
+def Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=False, FCAS=True, solver="cplex", solver_threads=None, SOC_0=0,
+                                  LP_fast_path=False, solver_options=None, warm_start=None, engine="milp", SOC_steps=100, compact=False):
     '''This model plans energy and capacity bids based on wholesale prices to minimise energy costs and maximise the FCAS market revenues. Objective function is in (1).
         It has the following constraints:
             1. Total energy constraint (2)
@@ -36,11 +44,152 @@ def Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=False, FCAS=Tr
             cnum (Int): client number or ID
             saveDetail (bool, optional): Whether to save variable specific data
             FCAS (bool, optional): Whether to participate in FCAS markets
+            solver (String, optional): Name of the solver, e.g. "cplex" or "glpk"
+            solver_threads (Int, optional): Number of threads the solver may use, None for the solver's default
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            LP_fast_path (bool, optional): Whether to solve through the LP fast path (solve_LP_fast_path)
+            solver_options (dict, optional): Solver options, "mip_gap", "time_limit" or native options (get_solver)
+            warm_start (String, optional): Initial point of the MILP, None, "heuristic" or "previous" (warm_start_seed)
+            engine (String, optional): "milp" solves the MILP with solver, "dp" the dynamic program of dp_model.py
+            SOC_steps (Int, optional): Number of SOC grid steps of the "dp" engine
+            compact (bool, optional): Whether to build the compact formulation of the model (see build_aggregator_model)
 
         Returns:
             outputs: Optimisation outputs
     '''
+    if engine == "dp":
+        return Aggregator_DP_Model(data, outputs, cnum, saveDetail, FCAS, SOC_0, SOC_steps)
+    m = build_aggregator_model(data, cnum, FCAS, SOC_0, timings=phase_timings(), compact=compact)
+
+    ##! Solver 
+    opt      = get_solver(solver, solver_threads, solver_options)
+    start    = time()
+    solution = solve_model(m, opt, data, cnum, None, LP_fast_path, warm_start)
+    print("------------------------------Solution done------------------------------")
+    
+    ##! Output 
+    return aggregator_outputs(m, solution, time() - start, data, outputs, cnum, saveDetail, FCAS)
+
+def aggregator_outputs(m, solution, solve_time, data, outputs, cnum, saveDetail=False, FCAS=True):
+    '''Save the solver output, the annual costs and (if saveDetail) the variable values of the solved AOM into outputs
+
+        Args:
+            m: Solved Pyomo model
+            solution: Results returned by the solver
+            solve_time (float): Wall time of the solve (s), used if the solver does not report its time
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            saveDetail (bool, optional): Whether to save variable specific data
+            FCAS (bool, optional): Whether to participate in FCAS markets
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    start = time()
+    # Solver output
+    outputs["time"][cnum], n_vars, outputs["constraints"][cnum] = solver_statistics(m, solution, solve_time)
+    outputs["bin_vars"][cnum]    = count_binaries(m)
+    outputs["real_vars"][cnum]   = n_vars - outputs["bin_vars"][cnum]
+    print(solution.solver.termination_condition) 
+    print(solution.solver.termination_message) 
+    print(solution.solver.status)
+    
+    # Annual costs for client cnum
+    outputs["energy_net_cost"][cnum] = energy_cost(m, data)
+    outputs["FCAS_net_cost"][cnum]   = FCAS_cost(m, data) if FCAS else 0
+    outputs["total_net_cost"][cnum]  = outputs["energy_net_cost"][cnum] + outputs["FCAS_net_cost"][cnum]
+    print("Annual cost output done") 
+    
+    # Whether to save variable specific data
+    if saveDetail:
+        col = column(outputs, cnum)
+        # Energy bid
+        outputs["E_b"][:, col] = variable_values(m.E)
+        if FCAS:
+            # FCAS bid
+            outputs["L_b"][:, :, col] = variable_values(m.L)
+            outputs["R_b"][:, :, col] = variable_values(m.R)
+            # FCAS bid related to BESS
+            outputs["L_c"][:, col] = variable_values(m.L_c)
+            outputs["L_d"][:, col] = variable_values(m.L_d)
+            outputs["R_c"][:, col] = variable_values(m.R_c)
+            outputs["R_d"][:, col] = variable_values(m.R_d)
+        print("energy and FCAS bid output done")
+        
+        # BESS charging/discharging
+        outputs["P_c"][:, col] = variable_values(m.P_c)
+        outputs["P_d"][:, col] = variable_values(m.P_d)
+        outputs["SOC"][:, col] = variable_values(m.SOC)
+        print("BESS charging/discharging output done")
+        
+        # PV generation
+        outputs["PV"][:, col] = variable_values(m.PV)
+        if FCAS:
+            # FCAS bid related to PV
+            outputs["L_pv"][:, col] = variable_values(m.L_pv)
+            outputs["R_pv"][:, col] = variable_values(m.R_pv)
+        print("PV generation output done") 
+    print("-----------------------------Outputs done--------------------------------")
+    record_phase(phase_timings(), "extract", start)
+    
+    return outputs
+
+def variable_values(var):
+    '''Values of all indices of a solved variable (or of an Expression of the compact formulation) at once, as an array
+        of shape (T,) or (T, W) for the FCAS variables
+    '''
+    if var.ctype is Expression:
+        values = np.array([value(v) for v in var.values()], dtype=float)
+    else:
+        values = np.array([v.value for v in var.values()], dtype=float)
+    if var.dim() == 2:
+        return values.reshape(-1, len(list(var.index_set().subsets())[-1]))
+    return values
+
+# Costs of a solved model computed from the extracted values, over all time intervals or the first `kept` ones (rolling.py)
+def energy_cost(m, data, kept=None):
+    '''Cost of the energy bids E at the wholesale energy price λ_E
+    '''
+    λ_E = np.asarray(data["energy_price"], dtype=float)[:kept]
+    return np.dot(λ_E, variable_values(m.E)[:kept]) * data["Δt"]
+
+def FCAS_cost(m, data, kept=None):
+    '''Net cost (negative revenue) of the FCAS bids R and L of AOM
+    '''
+    revenue = np.sum(data["R_FCAS_price"][:kept] * variable_values(m.R)[:kept]) + np.sum(data["L_FCAS_price"][:kept] * variable_values(m.L)[:kept])
+    return -revenue * data["Δt"]
+
+def retail_cost(m, data, tnum, kept=None):
+    '''Retail cost (18) of ROM under tariff tnum
+    '''
+    λ_TB = np.asarray(data["tariff_buy"][str(tnum)], dtype=float)[:kept]
+    λ_TS = data["tariff_sell"][str(tnum)]
+    return (np.dot(λ_TB, variable_values(m.E_b)[:kept]) - λ_TS * np.sum(variable_values(m.E_s)[:kept])) * data["Δt"]
+
+def build_aggregator_model(data, cnum, FCAS=True, SOC_0=0, mutable=False, timings=None, compact=False):
+    '''Build the AOM of client cnum: indices, parameters, variables, objective function (1) and constraints (2)-(17).
+
+        The compact formulation has the same optimal costs with fewer variables and constraints: the energy bid E of
+        constraint (2) is an Expression instead of a variable, constraints (6) and (15) are bounds of SOC and PV, and the FCAS
+        bids of constraints (9)-(10) are Expressions. Each bid R[t, w] (L[t, w]) is only limited by the raise (lower) capacity
+        of time interval t, so it is optimal to bid the whole capacity in every market with a positive price and nothing in
+        the other markets; the three bids of a time interval are one capacity that earns the positive prices.
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            cnum (Int): client number or ID
+            FCAS (bool, optional): Whether to participate in FCAS markets
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            mutable (bool, optional): Whether the parameters are mutable, so that the model can be reused for other clients (template.py)
+            timings (dict, optional): Build time (s) of each phase is added to it (benchmark.py)
+            compact (bool, optional): Whether to build the compact formulation
+
+        Returns:
+            m: Pyomo model
+    '''
     m = ConcreteModel()
+    clock = time()
     
     ##! Indices
     lenT    = len(data["T"])
@@ -54,54 +203,66 @@ def Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=False, FCAS=Tr
     
     ##! Parameters    
     # Inflexible load profile (kW)
-    m.P_il = Param(m.T, initialize=data["load"].iloc[:, cnum])
+    m.P_il = Param(m.T, initialize=data["load"].iloc[:, cnum], mutable=mutable)
     # (Maximum) PV generation profile (kW)
-    m.MPV  = Param(m.T, initialize=data["PV"].iloc[:, cnum])
+    m.MPV  = Param(m.T, initialize=data["PV"].iloc[:, cnum], mutable=mutable)
     # Maximum charging power of the BESS (kW)
-    MP_C = data["power"]
+    MP_C = scalar_param(m, "MP_C", data["power"], mutable)
     # Maximum discharging power of the BESS (kW)
-    MP_D = data["power"]
+    MP_D = scalar_param(m, "MP_D", data["power"], mutable)
     # Minimum, maximum state-of-charge of the BESS (kW)
     SOC_min = data["Min_SOC"]
-    SOC_max = data["Max_SOC"]
+    SOC_max = scalar_param(m, "SOC_max", data["Max_SOC"], mutable)
     # Energy wholesale prices ($/kWh)
-    m.λ_E = Param(m.T,  initialize=data["energy_price"])
+    m.λ_E = Param(m.T,  initialize=data["energy_price"], mutable=mutable)
     # Duration of time interval t (hour)
     Δt = data["Δt"]
     # Efficiency of the BESS
-    η  = data["eff"]
+    η  = scalar_param(m, "η", data["eff"], mutable)
     
     # Parameters related to FCAS markets
     if FCAS:
         # Raise FCAS prices ($/kW) 
         def init_Param_RFCAS(model, t, w):
             return data["R_FCAS_price"][t, w]
-        m.λ_R = Param(m.T, m.W, initialize=init_Param_RFCAS)
+        m.λ_R = Param(m.T, m.W, initialize=init_Param_RFCAS, mutable=mutable)
         # Lower FCAS prices ($/kW) 
         def init_Param_LFCAS(model, t, w):
             return data["L_FCAS_price"][t, w]
-        m.λ_L = Param(m.T, m.W, initialize=init_Param_LFCAS)
+        m.λ_L = Param(m.T, m.W, initialize=init_Param_LFCAS, mutable=mutable)
+        if compact:
+            # Markets in which the whole raise/lower capacity is bid (positive price)
+            m.R_on = Param(m.T, m.W, initialize=positive_prices(data["R_FCAS_price"]), mutable=mutable)
+            m.L_on = Param(m.T, m.W, initialize=positive_prices(data["L_FCAS_price"]), mutable=mutable)
     print("------------------------------Parameters done----------------------------")
+    clock = record_phase(timings, "parameters", clock)
     
     ##! Variables
-    # Energy bids (kW)
-    m.E   = Var(m.T,     within=Reals)
+    # Energy bids (kW), an Expression in the compact formulation (below)
+    if not compact:
+        m.E = Var(m.T,     within=Reals)
     # Charging/discharging power of the BESS (kW)
     m.P_c = Var(m.T,     within=Reals, bounds=GE_0_Bound_V2)
     m.P_d = Var(m.T,     within=Reals, bounds=GE_0_Bound_V2)
-    # PV generation (kW)
-    m.PV  = Var(m.T,     within=Reals, bounds=GE_0_Bound_V2)
-    # State-of-charge (kWh)
-    m.SOC = Var(m.T_SOC, within=Reals)
+    # PV generation (kW), and state-of-charge (kWh): bounded by constraints (15) and (6), or by the bounds in the compact formulation
+    if compact:
+        m.PV  = Var(m.T,     within=Reals, bounds=lambda m, t: (0, m.MPV[t]))
+        m.SOC = Var(m.T_SOC, within=Reals, bounds=lambda m, t: (SOC_min, SOC_max) if t > 0 else (None, None))
+    else:
+        m.PV  = Var(m.T,     within=Reals, bounds=GE_0_Bound_V2)
+        m.SOC = Var(m.T_SOC, within=Reals)
     # Charging or discharging (0 or 1)
     m.τ   = Var(m.T,     within=Binary)
+    if compact:
+        # Energy bids (kW) of constraint (2)
+        m.E = Expression(m.T, rule=lambda m, t: m.P_c[t] - m.P_d[t] + m.P_il[t] - m.PV[t])
     
     # Variables related to FCAS markets
     if FCAS:
-        # Lower FCAS bids (kW) 
-        m.L    = Var(m.T, m.W, within=Reals, bounds=GE_0_Bound_V1)
-        # Raise FCAS bids (kW) 
-        m.R    = Var(m.T, m.W, within=Reals, bounds=GE_0_Bound_V1)
+        # Lower/raise FCAS bids (kW), Expressions in the compact formulation (below)
+        if not compact:
+            m.L = Var(m.T, m.W, within=Reals, bounds=GE_0_Bound_V1)
+            m.R = Var(m.T, m.W, within=Reals, bounds=GE_0_Bound_V1)
         # Lower capacity provided by BESS (kW)
         m.L_c  = Var(m.T,      within=Reals, bounds=GE_0_Bound_V2)
         m.L_d  = Var(m.T,      within=Reals, bounds=GE_0_Bound_V2)
@@ -111,7 +272,12 @@ def Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=False, FCAS=Tr
         # Raise/lower capacity provided by PV (kW)
         m.L_pv = Var(m.T,      within=Reals, bounds=GE_0_Bound_V2)
         m.R_pv = Var(m.T,      within=Reals, bounds=GE_0_Bound_V2)
+        if compact:
+            # Lower/raise FCAS bids (kW): the whole capacity of constraints (9)-(10) in the markets with a positive price
+            m.L = Expression(m.T, m.W, rule=lambda m, t, w: m.L_on[t, w] * (m.L_c[t] + m.L_d[t] + m.L_pv[t]))
+            m.R = Expression(m.T, m.W, rule=lambda m, t, w: m.R_on[t, w] * (m.R_c[t] + m.R_d[t] + m.R_pv[t]))
     print("------------------------------Variables done------------------------------")
+    clock = record_phase(timings, "variables", clock)
     
     ##! Objective function
     def obj_rule(m):
@@ -126,12 +292,14 @@ def Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=False, FCAS=Tr
             return (summation(m.λ_E, m.E)) * Δt
     m.obj = Objective(rule=obj_rule, sense=minimize)
     print("------------------------------Objective function done---------------------")
+    clock = record_phase(timings, "objective", clock)
     
     ##! Constraints
     # Constraint (2) defines the net energy usage of the client
     def Constraint_2(m, t):
         return m.E[t] == m.P_c[t] - m.P_d[t] + m.P_il[t] - m.PV[t]
-    m.constrs2 = Constraint(m.T, rule = Constraint_2)
+    if not compact:
+        m.constrs2 = Constraint(m.T, rule = Constraint_2)
     
     # Constraints (3)-(4) specify the lower and upper bounds of the BESS's discharging or charging power at time t
     def Constraint_3(m, t):
@@ -149,26 +317,29 @@ def Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=False, FCAS=Tr
     
     def Constraint_6(m, t):
         return (SOC_min, m.SOC[t + 1], SOC_max)
-    m.constrs6 = Constraint(m.T, rule = Constraint_6)
+    if not compact:
+        m.constrs6 = Constraint(m.T, rule = Constraint_6)
     
     # Constraint (15) sets the range of pv generation based on the forecasted solar power
     def Constraint_15(m, t):
         return (0, m.PV[t], m.MPV[t])
-    m.constrs15 = Constraint(m.T, rule = Constraint_15)
+    if not compact:
+        m.constrs15 = Constraint(m.T, rule = Constraint_15)
     
-    # Additional SOC constraint to ensure that SOC is 0 at time step 0
-    m.socc = Constraint(expr=m.SOC[0] == 0)
+    # Additional SOC constraint to ensure that SOC is SOC_0 (0 by default) at time step 0
+    m.socc = Constraint(expr=m.SOC[0] == scalar_param(m, "SOC_0", SOC_0, mutable))
     
     # Constraints related to FCAS markets
     if FCAS:
         #  Constraint (9)-(10) defines total FCAS bids in FCAS raise markets and FCAS lower markets
         def Constraint_9(m, t, w):
             return m.R[t, w] <= m.R_c[t] + m.R_d[t] + m.R_pv[t]
-        m.constrs9 = Constraint(m.T, m.W, rule = Constraint_9)
         
         def Constraint_10(m, t, w):
             return m.L[t, w] <= m.L_c[t] + m.L_d[t] + m.L_pv[t]
-        m.constrs10 = Constraint(m.T, m.W, rule = Constraint_10)
+        if not compact:
+            m.constrs9  = Constraint(m.T, m.W, rule = Constraint_9)
+            m.constrs10 = Constraint(m.T, m.W, rule = Constraint_10)
         
         # Constraint (11)-(12) define the quantity of raise capacity provided by BESS (kW).
         def Constraint_11(m, t):
@@ -206,78 +377,126 @@ def Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=False, FCAS=Tr
             return m.L_pv[t] <= m.PV[t]
         m.constrs17 = Constraint(m.T, rule = Constraint_17)       
     print("------------------------------Constraints done----------------------------")
+    clock = record_phase(timings, "constraints", clock)
+    
+    return m
+
+def Retail_Optimisation_Model(data, outputs, cnum, tnum, saveDetail=False, solver="cplex", solver_threads=None, SOC_0=0,
+                              LP_fast_path=False, solver_options=None, warm_start=None, engine="milp", SOC_steps=100, compact=False):
+    '''This model plans energy bids based on tariffs to minimise energy cost. Objective function is in (18).
+        It has the following constraints:
+            1. Energy constraints (19)-(21)
+            2. Battery energy storage systems constraints (22)-(25)
+            3. Photovoltaic systems constraint (26)
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container   
+            cnum (Int): client number or ID
+            tnum (Int): The tariff used in this model
+            saveDetail (bool, optional): Whether to save variable specific data
+            solver (String, optional): Name of the solver, e.g. "cplex" or "glpk"
+            solver_threads (Int, optional): Number of threads the solver may use, None for the solver's default
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            LP_fast_path (bool, optional): Whether to solve through the LP fast path (solve_LP_fast_path)
+            solver_options (dict, optional): Solver options, "mip_gap", "time_limit" or native options (get_solver)
+            warm_start (String, optional): Initial point of the MILP, None, "heuristic" or "previous" (warm_start_seed)
+            engine (String, optional): "milp" solves the MILP with solver, "dp" the dynamic program of dp_model.py
+            SOC_steps (Int, optional): Number of SOC grid steps of the "dp" engine
+            compact (bool, optional): Whether to build the compact formulation of the model (see build_aggregator_model)
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    if engine == "dp":
+        return Retail_DP_Model(data, outputs, cnum, tnum, saveDetail, SOC_0, SOC_steps)
+    m = build_retail_model(data, cnum, tnum, SOC_0, timings=phase_timings(), compact=compact)
 
     ##! Solver 
-    opt      = SolverFactory('cplex')  # or opt = SolverFactory('glpk')
-    solution = opt.solve(m, tee=False)               
+    opt      = get_solver(solver, solver_threads, solver_options)
+    start    = time()
+    solution = solve_model(m, opt, data, cnum, tnum, LP_fast_path, warm_start)
     print("------------------------------Solution done------------------------------")
     
     ##! Output 
+    return retail_outputs(m, solution, time() - start, data, outputs, cnum, tnum, saveDetail)
+
+def retail_outputs(m, solution, solve_time, data, outputs, cnum, tnum, saveDetail=False):
+    '''Save the solver output, the annual costs and (if saveDetail) the variable values of the solved ROM into outputs
+
+        Args:
+            m: Solved Pyomo model
+            solution: Results returned by the solver
+            solve_time (float): Wall time of the solve (s), used if the solver does not report its time
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            tnum (Int): The tariff used in this model
+            saveDetail (bool, optional): Whether to save variable specific data
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    start = time()
     # Solver output
-    outputs["time"][cnum]        = solution.Solver.Time
-    outputs["bin_vars"][cnum]    = len(m.τ)
-    outputs["real_vars"][cnum]   = solution.Problem.Number_of_variables - outputs["bin_vars"][cnum]
-    outputs["constraints"][cnum] = solution.Problem.Number_of_constraints
+    outputs["time"][cnum], n_vars, outputs["constraints"][cnum] = solver_statistics(m, solution, solve_time)
+    outputs["bin_vars"][cnum]    = count_binaries(m)
+    outputs["real_vars"][cnum]   = n_vars - outputs["bin_vars"][cnum]
     print(solution.solver.termination_condition) 
     print(solution.solver.termination_message) 
     print(solution.solver.status)
     
-    # Annual costs for client cnum
-    outputs["total_net_cost"][cnum]  = value(m.obj)
-    outputs["energy_net_cost"][cnum] = (value(summation(m.λ_E, m.E))) * Δt
-    outputs["FCAS_net_cost"][cnum]   = outputs["total_net_cost"][cnum] - outputs["energy_net_cost"][cnum]
+    # Annual costs for client cnum under tariff tnum
+    outputs["total_net_cost"][cnum] = retail_cost(m, data, tnum)
+    outputs["cost_c"][cnum]         = energy_cost(m, data) # wholesale cost
+    print(f'Retail cost: {outputs["total_net_cost"][cnum]}, wholesale cost: {outputs["cost_c"][cnum]}')
     print("Annual cost output done") 
     
     # Whether to save variable specific data
     if saveDetail:
+        col = column(outputs, cnum)
         # Energy bid
-        outputs["E_b"][:, cnum] = np.array([value(m.E[t]) for t in data["T"]])
-        if FCAS:
-            # FCAS bid
-            outputs["L_b"][:, cnum] = ["-".join([str(value(m.L[t, w])) for w in data["W"]]) for t in data["T"]]
-            outputs["R_b"][:, cnum] = ["-".join([str(value(m.R[t, w])) for w in data["W"]]) for t in data["T"]]
-            # FCAS bid related to BESS
-            outputs["L_c"][:, cnum] = np.array([value(m.L_c[t]) for t in data["T"]])
-            outputs["L_d"][:, cnum] = np.array([value(m.L_d[t]) for t in data["T"]])
-            outputs["R_c"][:, cnum] = np.array([value(m.R_c[t]) for t in data["T"]])
-            outputs["R_d"][:, cnum] = np.array([value(m.R_d[t]) for t in data["T"]])
-        print("energy and FCAS bid output done")
+        outputs["E_b"][:, col]    = variable_values(m.E)
+        # Energy bought
+        outputs["E_buy"][:, col]  = variable_values(m.E_b)
+        # Energy bought
+        outputs["E_sell"][:, col] = variable_values(m.E_s)
+        print("energy bid output done")
         
-        # BESS charging/discharging
-        outputs["P_c"][:, cnum] = np.array([value(m.P_c[t]) for t in data["T"]])
-        outputs["P_d"][:, cnum] = np.array([value(m.P_d[t]) for t in data["T"]])
-        outputs["SOC"][:, cnum] = np.array([value(m.SOC[t]) for t in range(lenT + 1)])
+        # BESS charging/discharging and SOC
+        outputs["P_c"][:, col] = variable_values(m.P_c)
+        outputs["P_d"][:, col] = variable_values(m.P_d)
+        outputs["SOC"][:, col] = variable_values(m.SOC)
         print("BESS charging/discharging output done")
         
         # PV generation
-        outputs["PV"][:, cnum] = np.array([value(m.PV[t]) for t in data["T"]])
-        if FCAS:
-            # FCAS bid related to PV
-            outputs["L_pv"][:, cnum] = np.array([value(m.L_pv[t]) for t in data["T"]])
-            outputs["R_pv"][:, cnum] = np.array([value(m.R_pv[t]) for t in data["T"]])
+        outputs["PV"][:, col] = variable_values(m.PV)
         print("PV generation output done") 
-    print("-----------------------------Outputs done--------------------------------")
+    print("------------------------------Outputs done------------------------------")
+    record_phase(phase_timings(), "extract", start)
     
     return outputs
 
-def Retail_Optimisation_Model(data, outputs, cnum, tnum, saveDetail=False):
-    '''This model plans energy bids based on tariffs to minimise energy cost. Objective function is in (18).
-        It has the following constraints:
-            1. Energy constraints (19)-(21)
-            2. Battery energy storage systems constraints (22)-(25)
-            3. Photovoltaic systems constraint (26)
+def build_retail_model(data, cnum, tnum, SOC_0=0, mutable=False, timings=None, compact=False):
+    '''Build the ROM of client cnum under tariff tnum: indices, parameters, variables, objective function (18) and constraints (19)-(26).
+
+        In the compact formulation, the energy bid E of constraint (19) and the energy sold E_s = E_b - E of constraint (20)
+        are Expressions, E_s >= 0 is the only constraint left of (19)-(20), and constraints (25) and (26) are bounds of SOC and PV.
 
         Args:
             data (OrderedDict): Parameter data of the model
-            outputs (OrderedDict): Optimisation outputs container   
             cnum (Int): client number or ID
             tnum (Int): The tariff used in this model
-            saveDetail (bool, optional): Whether to save variable specific data
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            mutable (bool, optional): Whether the parameters are mutable, so that the model can be reused for other clients and tariffs (template.py)
+            timings (dict, optional): Build time (s) of each phase is added to it (benchmark.py)
+            compact (bool, optional): Whether to build the compact formulation
 
         Returns:
-            outputs: Optimisation outputs
+            m: Pyomo model
     '''
     m = ConcreteModel()
+    clock = time()
     
     ##! Indices
     lenT    = len(data["T"])
@@ -288,45 +507,56 @@ def Retail_Optimisation_Model(data, outputs, cnum, tnum, saveDetail=False):
     
     ##! Parameters   
     # Inflexible load profile (kW)
-    m.P_il = Param(m.T, initialize=data["load"].iloc[:, cnum])
+    m.P_il = Param(m.T, initialize=data["load"].iloc[:, cnum], mutable=mutable)
     # PV generation profile (kW)
-    m.MPV  = Param(m.T, initialize=data["PV"].iloc[:, cnum])
+    m.MPV  = Param(m.T, initialize=data["PV"].iloc[:, cnum], mutable=mutable)
     # Maximum charging power of the BESS (kW) 
-    MP_C = data["power"][cnum]
+    MP_C = scalar_param(m, "MP_C", data["power"][cnum], mutable)
     # Maximum discharging power of the BESS (kW) 
-    MP_D = data["power"][cnum]
+    MP_D = scalar_param(m, "MP_D", data["power"][cnum], mutable)
     # Minimum, maximum state-of-charge of the BESS (kW)
     SOC_min = data["Min_SOC"]
-    SOC_max = data["Max_SOC"][cnum]
+    SOC_max = scalar_param(m, "SOC_max", data["Max_SOC"][cnum], mutable)
     # Tariff: buy price ($/kWh)
-    m.λ_TB = Param(m.T, initialize=data["tariff_buy"][str(tnum)])
+    m.λ_TB = Param(m.T, initialize=data["tariff_buy"][str(tnum)], mutable=mutable)
     # Tariff: sell price ($/kWh)
-    λ_TS   = data["tariff_sell"][str(tnum)] 
+    λ_TS   = scalar_param(m, "λ_TS", data["tariff_sell"][str(tnum)], mutable)
     # Wholesale price ($/kWh)
-    m.λ_E  = Param(m.T, initialize=data["energy_price"])
+    m.λ_E  = Param(m.T, initialize=data["energy_price"], mutable=mutable)
     
     # Length of the time interval t (h)
     Δt = data["Δt"]
     # Efficiency of the BESS
-    η  = data["eff"][cnum]
+    η  = scalar_param(m, "η", data["eff"][cnum], mutable)
     print("------------------------------Parameters done----------------------------")
+    clock = record_phase(timings, "parameters", clock)
     
     ##! Variables
-    # Energy bids (kW)
-    m.E   = Var(m.T,     within=Reals)
+    # Energy bids (kW), an Expression in the compact formulation (below)
+    if not compact:
+        m.E   = Var(m.T,     within=Reals)
     # Charging/discharging power of the BESS (kW)
     m.P_c = Var(m.T,     within=Reals, bounds=GE_0_Bound_V2)
     m.P_d = Var(m.T,     within=Reals, bounds=GE_0_Bound_V2)
-    # PV generation (kW)
-    m.PV  = Var(m.T,     within=Reals)
-    # State-of-charge (kWh)
-    m.SOC = Var(m.T_SOC, within=Reals)
+    # PV generation (kW), and state-of-charge (kWh): bounded by constraints (26) and (25), or by the bounds in the compact formulation
+    if compact:
+        m.PV  = Var(m.T,     within=Reals, bounds=lambda m, t: (0, m.MPV[t]))
+        m.SOC = Var(m.T_SOC, within=Reals, bounds=lambda m, t: (SOC_min, SOC_max) if t > 0 else (None, None))
+    else:
+        m.PV  = Var(m.T,     within=Reals)
+        m.SOC = Var(m.T_SOC, within=Reals)
     # Charging or discharging (0 or 1)
     m.τ   = Var(m.T,     within=Binary)
     # Energy bought and energy sold (kw)
     m.E_b = Var(m.T,     within=Reals, bounds=GE_0_Bound_V2)
-    m.E_s = Var(m.T,     within=Reals, bounds=GE_0_Bound_V2)  
+    if compact:
+        # Energy bids and energy sold (kW) of constraints (19) and (20)
+        m.E   = Expression(m.T, rule=lambda m, t: m.P_c[t] - m.P_d[t] + m.P_il[t] - m.PV[t])
+        m.E_s = Expression(m.T, rule=lambda m, t: m.E_b[t] - m.E[t])
+    else:
+        m.E_s = Var(m.T,     within=Reals, bounds=GE_0_Bound_V2)
     print("------------------------------Variables done-----------------------------")
+    clock = record_phase(timings, "variables", clock)
     
     ##! Objective function
     def obj_rule(m):
@@ -335,17 +565,22 @@ def Retail_Optimisation_Model(data, outputs, cnum, tnum, saveDetail=False):
         return (sum(-1 * λ_TS * m.E_s[t] + m.λ_TB[t] * m.E_b[t] for t in data["T"])) * Δt
     m.obj = Objective(rule=obj_rule, sense=minimize)
     print("------------------------------Objective function done--------------------")
+    clock = record_phase(timings, "objective", clock)
     
     #! Constraints
     # Constraint (19) defines the consumption or generation of the prosumer
     def Constraint_19(m, t):
         return m.E[t] == m.P_c[t] - m.P_d[t] + m.P_il[t] - m.PV[t]
-    m.constrs19 = Constraint(m.T, rule = Constraint_19)
     
     # Constraint (20) connect the energy bought and energy sold to the total energy consumption.
     def Constraint_20(m, t):
         return m.E[t] == m.E_b[t] - m.E_s[t]
-    m.constrs20 = Constraint(m.T, rule = Constraint_20)
+    if compact:
+        # The energy sold is non-negative
+        m.constrs20 = Constraint(m.T, rule = lambda m, t: m.E_s[t] >= 0)
+    else:
+        m.constrs19 = Constraint(m.T, rule = Constraint_19)
+        m.constrs20 = Constraint(m.T, rule = Constraint_20)
     
     # Constraints (22) and (23) set the ranges of the discharging power and charging power
     def Constraint_22(m, t):
@@ -363,55 +598,350 @@ def Retail_Optimisation_Model(data, outputs, cnum, tnum, saveDetail=False):
     
     def Constraint_25(m, t):
         return (SOC_min, m.SOC[t + 1], SOC_max)
-    m.constrs25 = Constraint(m.T, rule = Constraint_25)
+    if not compact:
+        m.constrs25 = Constraint(m.T, rule = Constraint_25)
     
     # Constraint (26) sets the range of pv generation based on the forecasted solar power.
     def Constraint_26(m, t):
         return (0, m.PV[t], m.MPV[t])
-    m.constrs26 = Constraint(m.T, rule = Constraint_26)
+    if not compact:
+        m.constrs26 = Constraint(m.T, rule = Constraint_26)
     
-    # Additional SOC constraint to ensure that SOC is 0 at time step 0.
-    m.socc = Constraint(expr=m.SOC[0] == 0) 
+    # Additional SOC constraint to ensure that SOC is SOC_0 (0 by default) at time step 0.
+    m.socc = Constraint(expr=m.SOC[0] == scalar_param(m, "SOC_0", SOC_0, mutable)) 
     print("------------------------------Constraints done---------------------------")
-
-    ##! Solver 
-    opt      = SolverFactory('cplex')  # or opt = SolverFactory('glpk')
-    solution = opt.solve(m, tee=False)             
-    print("------------------------------Solution done------------------------------")
+    clock = record_phase(timings, "constraints", clock)
     
-    ##! Output 
-    print(solution.solver.termination_condition) 
-    print(solution.solver.termination_message) 
-    print(solution.solver.status)
-    
-    # Annual costs for client cnum under tariff tnum
-    outputs["total_net_cost"][cnum] = value(m.obj)
-    outputs["cost_c"][cnum]         = value(summation(m.λ_E, m.E)) * Δt # wholesale cost
-    print(f'Retail cost: {outputs["total_net_cost"][cnum]}, wholesale cost: {outputs["cost_c"][cnum]}')
-    print("Annual cost output done") 
-    
-    # Whether to save variable specific data
-    if saveDetail:
-        # Energy bid
-        outputs["E_b"][:, cnum]    = np.array([value(m.E[t]) for t in data["T"]])
-        # Energy bought
-        outputs["E_buy"][:, cnum]  = np.array([value(m.E_b[t]) for t in data["T"]])
-        # Energy bought
-        outputs["E_sell"][:, cnum] = np.array([value(m.E_s[t]) for t in data["T"]])
-        print("energy bid output done")
-        
-        # BESS charging/discharging and SOC
-        outputs["P_c"][:, cnum] = np.array([value(m.P_c[t]) for t in data["T"]])
-        outputs["P_d"][:, cnum] = np.array([value(m.P_d[t]) for t in data["T"]])
-        outputs["SOC"][:, cnum] = np.array([value(m.SOC[t]) for t in range(lenT + 1)])
-        print("BESS charging/discharging output done")
-        
-        # PV generation
-        outputs["PV"][:, cnum] = np.array([value(m.PV[t]) for t in data["T"]])
-        print("PV generation output done") 
-    print("------------------------------Outputs done------------------------------")
-    
-    return outputs
+    return m
+
+## LP fast path ---------------------------------------------------------------------
+def solve_model(m, opt, data, cnum, tnum=None, LP_fast_path=False, warm_start=None):
+    '''Solve the AOM (tnum is None) or ROM of client cnum, through the LP fast path or from a warm start if asked
+
+        Args:
+            warm_start (String, optional): None, "heuristic" or "previous" (see warm_start_seed)
+
+        Returns:
+            solution: Results returned by the solver
+    '''
+    start = time()
+    if LP_fast_path:
+        solution = solve_LP_fast_path(m, opt, safe_intervals(data, cnum, tnum, FCAS=hasattr(m, "W")))
+    elif not warm_start:
+        solution = opt.solve(m, tee=False)
+    else:
+        apply_seed(m, warm_start_seed(m, data, cnum, tnum, warm_start))
+        solution = opt.solve(m, tee=False, warmstart=opt.warm_start_capable())
+        store_solution(m, cnum, tnum)
+    record_phase(phase_timings(), "solve", start)
+    record_solver(solution)
+    return solution
+
+def safe_intervals(data, cnum, tnum=None, FCAS=True):
+    '''Time intervals in which the charging/discharging binary τ is likely unnecessary: with an efficiency below 1
+        simultaneous charging and discharging only wastes energy, which does not pay while the energy prices are non-negative.
+        With FCAS it can pay, as both P_c and P_d give headroom for the raise and lower bids (12) and (14), so no time interval
+        of an AOM with FCAS is safe. The complementarity check of solve_LP_fast_path decides whether the LP solution is optimal.
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM, None for AOM
+            FCAS (bool, optional): Whether the AOM participates in FCAS markets
+
+        Returns:
+            safe (np.ndarray): Boolean array over the time intervals
+    '''
+    if tnum is None:
+        η    = data["eff"]
+        safe = (np.asarray(data["energy_price"], dtype=float) >= 0) & (not FCAS)
+    else:
+        η    = data["eff"][cnum]
+        safe = (np.asarray(data["tariff_buy"][str(tnum)], dtype=float) >= 0) & (data["tariff_sell"][str(tnum)] >= 0)
+    return safe & (η < 1)
+
+def solve_LP_fast_path(m, opt, safe, tol=1e-6, max_rounds=10):
+    '''Solve the model with τ relaxed to [0, 1] in the safe time intervals. The relaxation can only be cheaper than the MILP,
+        so if P_c and P_d are complementary (not both positive) in every time interval, its solution is optimal for the MILP.
+        Otherwise τ is made binary again only in the violating time intervals and the model is re-solved.
+
+        Args:
+            m: Pyomo model (AOM or ROM)
+            opt: Solver
+            safe (np.ndarray): Boolean array of the time intervals in which τ starts relaxed
+            tol (float, optional): Power (kW) below which P_c or P_d counts as zero
+            max_rounds (Int, optional): Number of re-solves before falling back to the full MILP
+
+        Returns:
+            solution: Results returned by the solver
+    '''
+    for t in m.T:
+        m.τ[t].domain = UnitInterval if safe[t] else Binary
+    for rounds in range(max_rounds + 1):
+        relaxed  = [t for t in m.T if not m.τ[t].is_binary()]
+        print(f"------------------------------LP fast path: {len(relaxed)} of {len(m.τ)} τ relaxed------------------------------")
+        solution = opt.solve(m, tee=False)
+        violated = [t for t in relaxed if value(m.P_c[t]) > tol and value(m.P_d[t]) > tol]
+        if not violated:
+            # Round τ to the charging or discharging state of the complementary solution
+            for t in relaxed:
+                m.τ[t].set_value(1 if value(m.P_c[t]) > tol else 0)
+            return solution
+        for t in (violated if rounds < max_rounds - 1 else relaxed):
+            m.τ[t].domain = Binary
+    return solution
+
+## Warm start ---------------------------------------------------------------------
+# Solutions of the clients solved by this process: (model tag, client) -> {variable name: values}
+solutions = {}
+
+def warm_start_seed(m, data, cnum, tnum=None, warm_start="heuristic"):
+    '''Initial feasible point for the MILP of client cnum. "previous" uses the last solution of the same client (under
+        another tariff, or from a previous run through output/warm_start) and falls back to the heuristic dispatch.
+
+        Returns:
+            seed (dict): variable name -> values
+    '''
+    if warm_start == "previous":
+        tag = warm_start_tag(m, tnum)
+        if (tag, cnum) not in solutions and os.path.exists(solution_path(tag, cnum)):
+            with np.load(solution_path(tag, cnum)) as stored:
+                solutions[tag, cnum] = {name: stored[name] for name in stored.files}
+        seed = solutions.get((tag, cnum))
+        if seed is not None and len(seed["P_c"]) == len(m.T):
+            return seed
+    return heuristic_dispatch(m, data, cnum, tnum)
+
+def heuristic_dispatch(m, data, cnum, tnum=None):
+    '''Price-threshold dispatch of the BESS: charge at full power while the price (energy price in AOM, buy tariff in ROM)
+        is in its lowest third and discharge while it is in its highest third, within the SOC limits, without FCAS bids.
+        It is a feasible point of AOM and ROM.
+
+        Returns:
+            seed (dict): variable name -> values
+    '''
+    if tnum is None:
+        price = np.asarray(data["energy_price"], dtype=float)
+        power, SOC_max, η = data["power"], data["Max_SOC"], data["eff"]
+    else:
+        price = np.asarray(data["tariff_buy"][str(tnum)], dtype=float)
+        power, SOC_max, η = data["power"][cnum], data["Max_SOC"][cnum], data["eff"][cnum]
+    SOC_min   = data["Min_SOC"]
+    Δt        = data["Δt"]
+    low, high = np.quantile(price, [1 / 3, 2 / 3])
+
+    P_c = np.zeros(len(price))
+    P_d = np.zeros(len(price))
+    SOC = np.zeros(len(price) + 1)
+    SOC[0] = value(m.socc.upper)
+    for t in range(len(price)):
+        if price[t] <= low or SOC[t] < SOC_min:
+            P_c[t] = max(0.0, min(power, (SOC_max - SOC[t]) / (η * Δt)))
+        elif price[t] >= high:
+            P_d[t] = max(0.0, min(power, (SOC[t] - SOC_min) * η / Δt))
+        SOC[t + 1] = SOC[t] + (P_c[t] * η - P_d[t] / η) * Δt
+
+    PV   = data["PV"].iloc[:, cnum].to_numpy(dtype=float)
+    E    = P_c - P_d + data["load"].iloc[:, cnum].to_numpy(dtype=float) - PV
+    seed = {"E": E, "P_c": P_c, "P_d": P_d, "PV": PV, "SOC": SOC, "τ": (P_c > 0).astype(float)}
+    if tnum is not None:
+        seed["E_b"] = np.maximum(E, 0)
+        seed["E_s"] = np.maximum(-E, 0)
+    return seed
+
+def apply_seed(m, seed):
+    '''Set the variable values of m to the seed, the variables missing from it (the FCAS bids of the heuristic) to 0
+    '''
+    for var in m.component_objects(Var):
+        values = np.ravel(seed[var.name]) if var.name in seed else np.zeros(len(var))
+        for v, val in zip(var.values(), values.tolist()):
+            v.set_value(round(val) if v.is_binary() else val, skip_validation=True)
+
+def store_solution(m, cnum, tnum=None):
+    '''Keep the solution of client cnum for the next warm start, in this process and in output/warm_start
+    '''
+    tag  = warm_start_tag(m, tnum)
+    path = solution_path(tag, cnum)
+    solutions[tag, cnum] = {var.name: variable_values(var) for var in m.component_objects(Var)}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, **solutions[tag, cnum])
+
+def warm_start_tag(m, tnum=None):
+    '''Model of the stored solutions: ROM, or AOM with or without FCAS, in the full or compact formulation
+    '''
+    suffix = "_compact" if is_compact(m) else ""
+    if tnum is not None:
+        return "ROM" + suffix
+    return ("AOM_with_FCAS" if hasattr(m, "W") else "AOM_without_FCAS") + suffix
+
+def solution_path(tag, cnum):
+    return f'{os.getcwd()}/output/warm_start/{tag}/client_{cnum}.npz'
+
+# Log lines giving the time (s) of an incumbent, and log lines of an accepted MIP start (incumbent at time 0)
+INCUMBENT_PATTERNS = [re.compile(r"^\s*\S?\s+\d+\s+\d+\s+\d+\s+[\d.]+%\s+\S+\s+(?!inf\b)\S+\s.*\s([\d.]+)s\s*$"),  # HiGHS
+                      re.compile(r"Found incumbent of value \S+ after ([\d.]+) sec"),                                # CPLEX
+                      re.compile(r"Integer solution of \S+ found .*\(([\d.]+) seconds\)")]                           # CBC
+MIP_START_PATTERNS = [re.compile(r"MIP start solution is feasible"), re.compile(r"MIP start .* defined initial solution"),
+                      re.compile(r"Loaded user MIP start with objective")]
+
+def first_incumbent_time(log):
+    '''Time (s) to the first incumbent in a solver log, None if the log of the solver is not recognised
+    '''
+    for line in log.splitlines():
+        if any(pattern.search(line) for pattern in MIP_START_PATTERNS):
+            return 0.0
+        for pattern in INCUMBENT_PATTERNS:
+            match = pattern.search(line)
+            if match:
+                return float(match.groups()[-1])
+    return None
+
+def logged_solve(m, opt, **kwargs):
+    '''Solve m and return the results with the solver log
+    '''
+    with tempfile.TemporaryDirectory() as directory:
+        logfile = f'{directory}/solver.log'
+        if hasattr(opt, "config") and "logfile" in opt.config:
+            opt.config.logfile = logfile
+            solution = opt.solve(m, tee=False, **kwargs)
+            opt.config.logfile = ""
+        else:
+            solution = opt.solve(m, tee=False, logfile=logfile, **kwargs)
+        with open(logfile) as file:
+            return solution, file.read()
+
+def warm_start_report(inputs, data, tnum=None):
+    '''Solve the clients of inputs cold and from the warm start inputs["warm_start"], and print the time to the first
+        incumbent and the total solve time of both
+
+        Returns:
+            report (OrderedDict): client ID -> times and objective values of the cold and warm solves
+    '''
+    report = OrderedDict()
+    tnum   = tnum if inputs["Model"] == "ROM" else None
+    print("------------------------------Warm start report------------------------------")
+    for cnum in range(inputs["start_client"], inputs["end_client"] + 1):
+        report[cnum] = {}
+        for name, warm_start in [("cold", None), ("warm", inputs["warm_start"])]:
+            if tnum is None:
+                m = build_aggregator_model(data, cnum, inputs["FCAS"])
+            else:
+                m = build_retail_model(data, cnum, tnum)
+            # A fresh solver for each solve, so that neither reuses the other's search
+            opt = get_solver(inputs["solver"], inputs["solver_threads"], inputs["solver_options"])
+            if warm_start:
+                apply_seed(m, warm_start_seed(m, data, cnum, tnum, warm_start))
+            start         = time()
+            solution, log = logged_solve(m, opt, warmstart=bool(warm_start) and opt.warm_start_capable())
+            report[cnum][name] = {"first_incumbent": first_incumbent_time(log), "time": time() - start, "objective": value(m.obj)}
+        cold, warm = report[cnum]["cold"], report[cnum]["warm"]
+        print(f'client {cnum}: first incumbent {cold["first_incumbent"]}s -> {warm["first_incumbent"]}s, '
+              f'solve time {cold["time"]:.2f}s -> {warm["time"]:.2f}s, objective {cold["objective"]:.4f} -> {warm["objective"]:.4f}')
+    return report
+
+def is_compact(m):
+    '''Whether m is the compact formulation, in which the energy bid E is an Expression
+    '''
+    return m.E.ctype is Expression
+
+def positive_prices(prices):
+    '''{(t, w): 1 if the FCAS price of market w is positive in time interval t else 0}, the markets in which the compact
+        formulation bids the whole FCAS capacity
+    '''
+    return {(t, w): float(price > 0) for (t, w), price in np.ndenumerate(np.asarray(prices, dtype=float))}
+
+def compact_report(inputs, data, tnum=None):
+    '''Build and solve the clients of inputs in the full and the compact formulation, and print the number of variables
+        and constraints, the build and solve times and the objective of both
+
+        Returns:
+            report (OrderedDict): client ID -> model size, times and objective value of the full and compact models
+    '''
+    report = OrderedDict()
+    tnum   = tnum if inputs["Model"] == "ROM" else None
+    print("------------------------------Compact formulation report------------------------------")
+    for cnum in range(inputs["start_client"], inputs["end_client"] + 1):
+        report[cnum] = {}
+        for name, compact in [("full", False), ("compact", True)]:
+            start = time()
+            if tnum is None:
+                m = build_aggregator_model(data, cnum, inputs["FCAS"], compact=compact)
+            else:
+                m = build_retail_model(data, cnum, tnum, compact=compact)
+            build_time = time() - start
+            opt        = get_solver(inputs["solver"], inputs["solver_threads"], inputs["solver_options"])
+            start      = time()
+            solution   = opt.solve(m, tee=False)
+            solve_time, n_vars, n_constraints = solver_statistics(m, solution, time() - start)
+            report[cnum][name] = {"variables": n_vars, "constraints": n_constraints, "build_time": build_time,
+                                  "solve_time": solve_time, "objective": value(m.obj)}
+        full, compact = report[cnum]["full"], report[cnum]["compact"]
+        print(f'client {cnum}: variables {full["variables"]} -> {compact["variables"]}, constraints {full["constraints"]} -> '
+              f'{compact["constraints"]}, build time {full["build_time"]:.2f}s -> {compact["build_time"]:.2f}s, solve time '
+              f'{full["solve_time"]:.2f}s -> {compact["solve_time"]:.2f}s, objective {full["objective"]:.6f} -> {compact["objective"]:.6f}')
+    return report
+
+def count_binaries(m):
+    '''Number of binary τ of the model
+    '''
+    return sum(1 for t in m.T if m.τ[t].is_binary())
+
+def scalar_param(m, name, value, mutable=False):
+    '''Scalar parameter of the model: the plain value, or a mutable Param component of m named name if mutable
+    '''
+    if not mutable:
+        return value
+    m.add_component(name, Param(initialize=value, mutable=True))
+    return m.component(name)
+
+def solver_statistics(m, solution, solve_time):
+    '''Solver time, number of variables and number of constraints of a solved model. Solvers that do not report them
+        (e.g. the persistent ones) fall back to the measured wall time and the size of the Pyomo model.
+    '''
+    reported_time = getattr(solution.solver, "time", None)
+    n_vars        = getattr(solution.problem, "number_of_variables", None)
+    n_constraints = getattr(solution.problem, "number_of_constraints", None)
+    if not n_vars or not n_constraints or np.isnan(n_vars) or np.isnan(n_constraints):
+        n_vars        = sum(len(var) for var in m.component_objects(Var, active=True))
+        n_constraints = sum(len(con) for con in m.component_objects(Constraint, active=True))
+    return (reported_time if reported_time else solve_time), n_vars, n_constraints
+
+def get_solver(solver="cplex", threads=None, options=None):
+    '''Create the solver used by the models, limit the number of threads it may use and set its options
+
+        Args:
+            solver (String, optional): Name of the solver, e.g. "cplex", "glpk", "cbc" or "appsi_highs"
+            threads (Int, optional): Number of threads, None for the solver's default (GLPK is single-threaded)
+            options (dict, optional): Solver options. "mip_gap" (relative) and "time_limit" (s) are translated to the
+                solver's own option names (SOLVER_OPTION_NAMES), any other option is passed to the solver as it is.
+                Options set to None are left at the solver's default.
+
+        Returns:
+            opt: Pyomo solver
+    '''
+    opt = SolverFactory(solver)
+    if threads is not None and solver in SOLVER_THREAD_OPTION:
+        opt.options[SOLVER_THREAD_OPTION[solver]] = threads
+    for name, value in (options or {}).items():
+        if value is not None:
+            opt.options[SOLVER_OPTION_NAMES.get(solver, {}).get(name, name)] = value
+    return opt
+
+# Name of the thread limit option of each solver
+SOLVER_THREAD_OPTION = {"cplex": "threads", "cbc": "threads", "gurobi": "Threads", "appsi_highs": "threads", "highs": "threads",
+                        "appsi_cplex": "threads", "appsi_cbc": "threads", "appsi_gurobi": "Threads"}
+# Names of the relative MIP gap and time limit options of each solver
+SOLVER_OPTION_NAMES = {
+    "cplex":        {"mip_gap": "mip_tolerances_mipgap", "time_limit": "timelimit"},
+    "appsi_cplex":  {"mip_gap": "mip_tolerances_mipgap", "time_limit": "timelimit"},
+    "glpk":         {"mip_gap": "mipgap", "time_limit": "tmlim"},
+    "cbc":          {"mip_gap": "ratioGap", "time_limit": "sec"},
+    "appsi_cbc":    {"mip_gap": "ratioGap", "time_limit": "sec"},
+    "gurobi":       {"mip_gap": "MIPGap", "time_limit": "TimeLimit"},
+    "appsi_gurobi": {"mip_gap": "MIPGap", "time_limit": "TimeLimit"},
+    "highs":        {"mip_gap": "mip_rel_gap", "time_limit": "time_limit"},
+    "appsi_highs":  {"mip_gap": "mip_rel_gap", "time_limit": "time_limit"},
+}
 
 def GE_0_Bound_V1(model, i, j):
     '''Ancillary function to define x_i_j > 0
@@ -11,10 +11,13 @@
 import numpy as np
 import pandas as pd
 from collections import OrderedDict
+from copy import copy
+import hashlib
+import json
 import os
 
 ## Read aggregator business model data ---------------------------------------------------------------------
-def read_aggregator_business_model(DERFile, PriceFile, LoadFile, PVFile):
+def read_aggregator_business_model(DERFile, PriceFile, LoadFile, PVFile, cache=False, clients=None):
     '''Read the data related to aggregator business model
 
         Args:
@@ -22,19 +25,25 @@ def read_aggregator_business_model(DERFile, PriceFile, LoadFile, PVFile):
             PriceFile : File path of wholesale prices
             LoadFile :  File path of Load time series
             PVFile :    File path of PV time series
+            cache :     Whether to read the data through the binary cache in data/.cache (see cached_read)
+            clients :   Clients whose load and PV columns are read now, the other columns are only read if accessed (see LazyColumns).
+                        None reads all columns. With the cache, the memory-mapped columns are only loaded if accessed anyway.
 
         Returns:
             data (OrderedDict): A dictionary that contains all the information needed to optimise DER.
     '''
     data = OrderedDict()
     # Read BESS data, and clients' id
-    readSameBESS(DERFile, data)
+    cached_read(readSameBESS, [DERFile], data, cache)
     # Read energy and FCAS wholesale prices
-    readWholesalePrices(PriceFile, data)
-    # Read clients' load
-    readLoad(LoadFile, data)
-    # Read clients' PV generation
-    readPV(PVFile, data)
+    cached_read(readWholesalePrices, [PriceFile], data, cache)
+    # Read clients' load and PV generation: all columns, or only the columns of clients (the cache memory-maps the columns)
+    if clients is None or cache:
+        cached_read(readLoad, [LoadFile], data, cache)
+        cached_read(readPV, [PVFile], data, cache)
+    else:
+        data["load"] = LazyColumns(LoadFile, clients)
+        data["PV"]   = LazyColumns(PVFile, clients, drop_last=True)
     # Compute other parameters useful to the MILP optimisation model
     readSetting(data)
     
@@ -59,21 +68,13 @@ def readWholesalePrices(PriceFile, data):
     data["Time"]         = df_Prices["Time"]
     ## Orignal price is $/MWh, now change to kwh
     # Energy wholesale prices
-    data["energy_price"] = df_Prices["ENERGY"].apply(lambda x: x / 1000).iloc[:105120]
+    data["energy_price"] = (df_Prices["ENERGY"] / 1000).iloc[:105120]
     # FCAS market prices (Raise - 6s, 60s, 5min and lower - 6s, 60s, 5min)
-    tmp_R_FCAS = []
-    tmp_L_FCAS = []
-    for i in ["RAISE6S", "RAISE60S", "RAISE5MIN"]:
-        tmp_R_FCAS.append(df_Prices[i].apply(lambda x: x / 1000).iloc[:105120])
-        
-    for i in ["LOWER6S", "LOWER60S", "LOWER5MIN"]:
-        tmp_L_FCAS.append(df_Prices[i].apply(lambda x: x / 1000).iloc[:105120])
-
-    data["R_FCAS_price"] = pd.concat(tmp_R_FCAS, axis=1).to_numpy()
-    data["L_FCAS_price"] = pd.concat(tmp_L_FCAS, axis=1).to_numpy()
+    data["R_FCAS_price"] = (df_Prices[["RAISE6S", "RAISE60S", "RAISE5MIN"]] / 1000).iloc[:105120].to_numpy()
+    data["L_FCAS_price"] = (df_Prices[["LOWER6S", "LOWER60S", "LOWER5MIN"]] / 1000).iloc[:105120].to_numpy()
 
 ## Read retail business model data ---------------------------------------------------------------------
-def read_retail_business_model(DERFile, tariffSellFile, tariffBuyFile, WholesalePriceFile, LoadFile, PVFile):
+def read_retail_business_model(DERFile, tariffSellFile, tariffBuyFile, WholesalePriceFile, LoadFile, PVFile, cache=False, clients=None):
     '''read the data related to retail business model
 
         Args:
@@ -83,21 +84,27 @@ def read_retail_business_model(DERFile, tariffSellFile, tariffBuyFile, Wholesale
             WholesalePriceFile : File path of wholesale prices
             LoadFile : File path of load time series
             PVFile : File path of PV time series
+            cache : Whether to read the data through the binary cache in data/.cache (see cached_read)
+            clients : Clients whose load and PV columns are read now, the other columns are only read if accessed (see LazyColumns).
+                      None reads all columns. With the cache, the memory-mapped columns are only loaded if accessed anyway.
 
         Returns:
             data (OrderedDict): A dictionary that contains all the information needed to optimise DER.
     '''
     data = OrderedDict()
     # Read BESS data for each client, and clients' id
-    readDiffBESS(DERFile, data)
+    cached_read(readDiffBESS, [DERFile], data, cache)
     # Read the four tariff energy sales prices and energy purchase prices, and also the time
-    readTariff(tariffSellFile, tariffBuyFile, data)
+    cached_read(readTariff, [tariffSellFile, tariffBuyFile], data, cache)
     # Read energy wholesale prices and also time intervals
-    readWholesalePrice(WholesalePriceFile, data)
-    # Read clients' load
-    readLoad(LoadFile, data)
-    # Read clients' PV generation
-    readPV(PVFile, data)
+    cached_read(readWholesalePrice, [WholesalePriceFile], data, cache)
+    # Read clients' load and PV generation: all columns, or only the columns of clients (the cache memory-maps the columns)
+    if clients is None or cache:
+        cached_read(readLoad, [LoadFile], data, cache)
+        cached_read(readPV, [PVFile], data, cache)
+    else:
+        data["load"] = LazyColumns(LoadFile, clients)
+        data["PV"]   = LazyColumns(PVFile, clients, drop_last=True)
     # Compute other parameters useful to the MILP optimisation model
     readSetting(data)
     
@@ -161,9 +168,240 @@ def readSetting(data):
     # time interval = 1/12 h = 5min
     data["Δt"] = (365 * 24) / lenT
 
+## Binary cache ---------------------------------------------------------------------
+def cached_read(reader, files, data, cache=True):
+    '''Run reader(*files, data), or load the entries it adds to data from the binary cache in data/.cache.
+        The cache stores every entry in its parsed form (unit scaling already applied) as .npy files that are memory-mapped
+        when loaded, and a manifest with the size, modification time and SHA-256 hash of each source file. It is rebuilt
+        when a source file changes: a different size or hash invalidates it, a different modification time alone only 
+        triggers the hash comparison.
+
+        Args:
+            reader (function): One of the read functions above
+            files (list): File paths passed to the reader, relative to the data directory
+            data (OrderedDict): The data dictionary the reader adds its entries to
+            cache (bool, optional): Whether to use the cache, False simply runs the reader
+    '''
+    if not cache:
+        return reader(*files, data)
+
+    name      = hashlib.sha1("|".join([reader.__name__] + files).encode()).hexdigest()[:16]
+    cache_dir = f'{os.getcwd()}/data/.cache/{reader.__name__}-{name}'
+    manifest  = load_manifest(cache_dir)
+    sources   = cache_sources(files, manifest)
+    if manifest is not None and sources is not None:
+        for key, spec in manifest["entries"].items():
+            data[key] = load_entry(cache_dir, key, spec)
+        if sources != manifest["sources"]:
+            manifest["sources"] = sources
+            save_manifest(cache_dir, manifest)
+        return
+
+    keys = set(data.keys())
+    reader(*files, data)
+    os.makedirs(cache_dir, exist_ok=True)
+    # The entries are written first and the manifest last, so a reader never finds a manifest without its entries
+    manifest = {"sources": {f: file_fingerprint(f, with_hash=True) for f in files},
+                "entries": {key: save_entry(cache_dir, key, data[key]) for key in data if key not in keys}}
+    save_manifest(cache_dir, manifest)
+
+def file_fingerprint(file, with_hash=False):
+    '''Size, modification time and (optionally) SHA-256 hash of a source file
+    '''
+    path = f'{os.getcwd()}/data/{file}'
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if with_hash:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        fingerprint["sha256"] = digest.hexdigest()
+    return fingerprint
+
+def cache_sources(files, manifest):
+    '''Fingerprints of the source files if the cache described by manifest is still valid for them, None otherwise
+    '''
+    if manifest is None or set(manifest["sources"]) != set(files):
+        return None
+    sources = {}
+    for file in files:
+        cached      = manifest["sources"][file]
+        fingerprint = file_fingerprint(file)
+        if fingerprint["size"] != cached["size"]:
+            return None
+        if fingerprint["mtime"] != cached["mtime"]:
+            fingerprint = file_fingerprint(file, with_hash=True)
+            if fingerprint["sha256"] != cached["sha256"]:
+                return None
+        sources[file] = dict(cached, mtime=fingerprint["mtime"])
+    return sources
+
+def load_manifest(cache_dir):
+    '''Manifest of a cache directory, None if there is no cache yet
+    '''
+    if not os.path.exists(f'{cache_dir}/manifest.json'):
+        return None
+    with open(f'{cache_dir}/manifest.json') as f:
+        return json.load(f)
+
+def save_manifest(cache_dir, manifest):
+    '''Write the manifest of a cache directory, atomically so that concurrent readers never see a partial manifest
+    '''
+    temp = f'{cache_dir}/manifest.{os.getpid()}.tmp'
+    with open(temp, 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp, f'{cache_dir}/manifest.json')
+
+def save_array(cache_dir, key, array):
+    '''Write one .npy file of the cache directory through a temporary file and os.replace, so that a process that already
+        memory-mapped the previous file keeps reading it and a new reader only sees the complete file
+    '''
+    temp = f'{cache_dir}/{key}.{os.getpid()}.tmp.npy'
+    np.save(temp, array)
+    os.replace(temp, f'{cache_dir}/{key}.npy')
+
+def save_entry(cache_dir, key, value):
+    '''Save one entry of data into the cache directory and return its description for the manifest
+    '''
+    if isinstance(value, dict):
+        return {"type": "dict", "items": {k: save_entry(cache_dir, f'{key}-{k}', v) for k, v in value.items()}}
+    if isinstance(value, pd.DataFrame):
+        # Column-major, so that the column of one client is contiguous on disk
+        save_array(cache_dir, key, np.asfortranarray(value.to_numpy(dtype=float)))
+        return {"type": "frame", "columns": [str(c) for c in value.columns]}
+    if isinstance(value, pd.Series):
+        is_str = value.dtype == object or pd.api.types.is_string_dtype(value.dtype)
+        save_array(cache_dir, key, value.to_numpy(dtype=str) if is_str else value.to_numpy())
+        return {"type": "series", "name": value.name if isinstance(value.name, str) else None, "str": bool(is_str)}
+    if isinstance(value, pd.api.extensions.ExtensionArray):
+        value = np.asarray(value, dtype=object)
+    if isinstance(value, np.ndarray):
+        save_array(cache_dir, key, value.astype(str) if value.dtype == object else value)
+        return {"type": "array", "object": bool(value.dtype == object)}
+    return {"type": "scalar", "value": value.item() if isinstance(value, np.generic) else value}
+
+def load_entry(cache_dir, key, spec):
+    '''Load one entry of data from the cache directory, large arrays are memory-mapped
+    '''
+    if spec["type"] == "dict":
+        return {k: load_entry(cache_dir, f'{key}-{k}', s) for k, s in spec["items"].items()}
+    if spec["type"] == "scalar":
+        return spec["value"]
+    array = np.load(f'{cache_dir}/{key}.npy', mmap_mode="r")
+    if spec["type"] == "frame":
+        return pd.DataFrame(array, columns=spec["columns"], copy=False)
+    if spec["type"] == "series":
+        return pd.Series(array.astype(object) if spec["str"] else array, name=spec["name"], copy=False)
+    return np.array(array, dtype=object) if spec["object"] else np.asarray(array)
+
+## Time windows ---------------------------------------------------------------------
+def slice_data(data, start, stop):
+    '''Take the time intervals [start, stop) of the data as a new data dictionary, e.g. one window of a rolling horizon.
+        The duration of a time interval Δt stays the one of the original data.
+    '''
+    window = OrderedDict(data)
+    for key in TIME_SERIES:
+        if key not in data:
+            continue
+        if isinstance(data[key], dict):
+            window[key] = {k: v.iloc[start:stop].reset_index(drop=True) for k, v in data[key].items()}
+        elif isinstance(data[key], np.ndarray):
+            window[key] = data[key][start:stop]
+        else:
+            window[key] = data[key].iloc[start:stop].reset_index(drop=True)
+    window["T"] = range(stop - start)
+    return window
+
+# Entries of data that are indexed by the time interval
+TIME_SERIES = ["Time", "energy_price", "R_FCAS_price", "L_FCAS_price", "tariff_buy", "load", "PV"]
+
+## Lazy client columns ---------------------------------------------------------------------
+class LazyColumns:
+    '''Load or PV time series of which only the accessed client columns are read from the CSV file. It supports the
+        accesses made to data["load"] and data["PV"]: .iloc[:, cnum] gives the Series of client cnum, .iloc[start:stop] the
+        time intervals [start, stop) (see slice_data), and len(), .columns and .shape as for the DataFrame of readLoad/readPV.
+    '''
+    def __init__(self, file, clients=(), drop_last=False):
+        '''Read the columns of clients from file (relative to the data directory), drop_last drops the last row as readPV does
+        '''
+        self.path    = f'{os.getcwd()}/data/{file}'
+        # The first column is the time
+        self.columns = pd.read_csv(self.path, nrows=0).columns[1:]
+        self.values  = {}
+        self.read(list(clients) or [0])
+        self.length  = len(next(iter(self.values.values()))) - (1 if drop_last else 0)
+        # Time intervals of the file averaged into one (see resample) and the time intervals of the window (see window)
+        self.factor  = 1
+        self.rows    = range(self.length)
+
+    def read(self, clients):
+        '''Read the columns of clients that are not read yet, in one pass over the file
+        '''
+        missing = [cnum for cnum in clients if cnum not in self.values]
+        if missing:
+            frame = pd.read_csv(self.path, usecols=[self.columns[cnum] for cnum in missing], dtype=float)
+            self.values.update({cnum: frame[self.columns[cnum]].to_numpy() for cnum in missing})
+
+    def column(self, cnum):
+        self.read([cnum])
+        values = self.values[cnum][:self.length]
+        if self.factor > 1:
+            values = values.reshape(-1, self.factor).mean(axis=1)
+        return pd.Series(values[self.rows.start:self.rows.stop], name=self.columns[cnum])
+
+    def window(self, rows):
+        '''The same columns restricted to the time intervals rows (a slice)
+        '''
+        window = copy(self)
+        window.rows = self.rows[rows]
+        return window
+
+    def resample(self, factor):
+        '''The same columns with every `factor` consecutive time intervals averaged into one (see aggregation.resample_data)
+        '''
+        if self.rows != range(len(self)):
+            raise ValueError("Only whole time series can be resampled")
+        resampled = copy(self)
+        resampled.factor = self.factor * factor
+        resampled.rows   = range(len(self) // factor)
+        return resampled
+
+    @property
+    def iloc(self):
+        return LazyIndexer(self)
+
+    @property
+    def shape(self):
+        return (len(self.rows), len(self.columns))
+
+    def __len__(self):
+        return len(self.rows)
+
+    def reset_index(self, drop=True):
+        return self
+
+    def __array__(self, dtype=None, copy=None):
+        self.read(range(len(self.columns)))
+        return np.column_stack([self.column(cnum) for cnum in range(len(self.columns))]).astype(dtype or float)
+
+class LazyIndexer:
+    '''.iloc of LazyColumns: [:, cnum] or [start:stop]
+    '''
+    def __init__(self, frame):
+        self.frame = frame
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple) and key[0] == slice(None):
+            return self.frame.column(key[1])
+        if isinstance(key, slice):
+            return self.frame.window(key)
+        raise IndexError(f"LazyColumns only supports .iloc[:, cnum] and .iloc[start:stop], not {key}")
+
 ## Output initialisation ---------------------------------------------------------------------
 def initialisation(inputs, data):
-    '''configure the optimisation results container
+    '''configure the optimisation results container. The variable arrays have one column per client of the range
+        (see column) and are only allocated if inputs["saveDetail"], with the dtype inputs["output_dtype"].
     '''
     outputs      = OrderedDict()
     client_range = range(inputs["start_client"], inputs["end_client"] + 1)
@@ -180,25 +418,43 @@ def initialisation(inputs, data):
     # Electricity wholesale cost for ROM
     outputs["cost_c"] = [0 for _ in range(len(data["Ids"]))]
     
-    # Variable information
-    outputs["E_b"]    = np.zeros((len(data["T"]),   len(data["Ids"])))
-    outputs["E_buy"]  = np.zeros((len(data["T"]),   len(data["Ids"])))
-    outputs["E_sell"] = np.zeros((len(data["T"]),   len(data["Ids"])))
-    
-    outputs["L_b"] = np.zeros((len(data["T"]),      len(data["Ids"])), dtype=np.object)
-    outputs["R_b"] = np.zeros((len(data["T"]),      len(data["Ids"])), dtype=np.object)
-    
-    outputs["L_c"] = np.zeros((len(data["T"]),      len(data["Ids"])))
-    outputs["L_d"] = np.zeros((len(data["T"]),      len(data["Ids"])))
-    outputs["R_c"] = np.zeros((len(data["T"]),      len(data["Ids"])))
-    outputs["R_d"] = np.zeros((len(data["T"]),      len(data["Ids"])))
-    
-    outputs["PV"]   = np.zeros((len(data["T"]),     len(data["Ids"])))
-    outputs["L_pv"] = np.zeros((len(data["T"]),     len(data["Ids"])))
-    outputs["R_pv"] = np.zeros((len(data["T"]),     len(data["Ids"])))
-    
-    outputs["SOC"]  = np.zeros((len(data["T"]) + 1, len(data["Ids"])))
-    outputs["P_c"]  = np.zeros((len(data["T"]),     len(data["Ids"])))
-    outputs["P_d"]  = np.zeros((len(data["T"]),     len(data["Ids"])))
+    # Variable information, only allocated for the clients in the range and the variables of the model that is run
+    outputs["clients"] = client_range
+    if inputs["saveDetail"]:
+        n_clients = len(client_range)
+        lenT      = len(data["T"])
+        dtype     = inputs["output_dtype"]
+        FCAS      = inputs["Model"] == "AOM" and inputs["FCAS"]
+        
+        outputs["E_b"] = np.zeros((lenT, n_clients), dtype=dtype)
+        if inputs["Model"] == "ROM":
+            outputs["E_buy"]  = np.zeros((lenT, n_clients), dtype=dtype)
+            outputs["E_sell"] = np.zeros((lenT, n_clients), dtype=dtype)
+        
+        if FCAS:
+            # FCAS bids of the three markets w
+            outputs["L_b"] = np.zeros((lenT, len(data["W"]), n_clients), dtype=dtype)
+            outputs["R_b"] = np.zeros((lenT, len(data["W"]), n_clients), dtype=dtype)
+            
+            outputs["L_c"] = np.zeros((lenT, n_clients), dtype=dtype)
+            outputs["L_d"] = np.zeros((lenT, n_clients), dtype=dtype)
+            outputs["R_c"] = np.zeros((lenT, n_clients), dtype=dtype)
+            outputs["R_d"] = np.zeros((lenT, n_clients), dtype=dtype)
+        
+        outputs["PV"] = np.zeros((lenT, n_clients), dtype=dtype)
+        if FCAS:
+            outputs["L_pv"] = np.zeros((lenT, n_clients), dtype=dtype)
+            outputs["R_pv"] = np.zeros((lenT, n_clients), dtype=dtype)
+        
+        outputs["SOC"] = np.zeros((lenT + 1, n_clients), dtype=dtype)
+        outputs["P_c"] = np.zeros((lenT, n_clients), dtype=dtype)
+        outputs["P_d"] = np.zeros((lenT, n_clients), dtype=dtype)
     
-    return outputs
\ No newline at end of file
+    return outputs
+
+def column(outputs, cnum):
+    '''Column of client cnum in the variable arrays of outputs, which only hold the clients of outputs["clients"]
+    '''
+    if cnum not in outputs["clients"]:
+        raise IndexError(f'Client {cnum} is outside the client range {outputs["clients"].start}-{outputs["clients"].stop - 1} of the outputs')
+    return cnum - outputs["clients"].start
@@ -0,0 +1,83 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Content-addressed cache of client results. The key of a client is a hash of everything its result depends on: its load
+# and PV columns, its BESS parameters, the price series, the tariff, the model and the solver settings. A client whose key is
+# in the cache is loaded instead of solved, and clients of a run with byte-identical inputs are solved once. The cache lives
+# in output/result_cache and the least recently used entries are evicted when it grows beyond inputs["result_cache_size"] MB.
+
+# Imports ---------------------------------------------------------------------
+import os
+import json
+import hashlib
+from time import time
+import numpy as np
+from checkpoint import load_manifest, save_manifest
+
+# Configuration items that change the result of a client
+RESULT_KEYS = ["Model", "FCAS", "solver", "solver_options", "race", "race_tolerance", "builder", "template", "LP_fast_path", "rolling_window",
+               "rolling_lookahead", "engine", "SOC_steps", "representative_days", "resample", "compact",
+               "incremental", "incremental_margin", "decomposition", "decomposition_tolerance", "decomposition_iterations"]
+
+def cache_directory():
+    return f'{os.getcwd()}/output/result_cache'
+
+def result_key(inputs, data, cnum, tnum=None):
+    '''Hash of the inputs and settings of client cnum (under tariff tnum)
+    '''
+    settings = {key: inputs[key] for key in RESULT_KEYS}
+    settings.update({"tariff": tnum if inputs["Model"] == "ROM" else None, "Δt": data["Δt"]})
+    digest = hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode())
+    for array in client_arrays(inputs, data, cnum, tnum):
+        digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+    return digest.hexdigest()
+
+def client_arrays(inputs, data, cnum, tnum=None):
+    '''Data that the result of client cnum depends on
+    '''
+    arrays = [data["load"].iloc[:, cnum].to_numpy(), data["PV"].iloc[:, cnum].to_numpy(), data["energy_price"].to_numpy(), [data["Min_SOC"]]]
+    if inputs["Model"] == "AOM":
+        arrays += [[data["power"], data["Max_SOC"], data["eff"]]]
+        if inputs["FCAS"]:
+            arrays += [data["R_FCAS_price"], data["L_FCAS_price"]]
+    else:
+        arrays += [[data["power"][cnum], data["Max_SOC"][cnum], data["eff"][cnum], data["tariff_sell"][str(tnum)]],
+                   data["tariff_buy"][str(tnum)].to_numpy()]
+    return arrays
+
+def load_result(inputs, key):
+    '''Cached results of key in the form of runner.outputs_slice, None if there are none (or no variable values although
+        inputs["saveDetail"] asks for them)
+    '''
+    directory = cache_directory()
+    index     = load_manifest(directory)
+    if key not in index or (inputs["saveDetail"] and not index[key]["detail"]):
+        return None
+    with np.load(f'{directory}/{key}.npz') as entry:
+        client_slice = {name: (entry[name] if entry[name].ndim else entry[name].item()) for name in entry.files}
+    index[key]["used"] = time()
+    save_manifest(directory, index)
+    print(f"------------------------------Result cache hit {key[:12]}------------------------------")
+    return client_slice
+
+def store_result(inputs, key, client_slice):
+    '''Store the results of a client under key and evict the least recently used entries beyond the cache size
+    '''
+    directory = cache_directory()
+    os.makedirs(directory, exist_ok=True)
+    np.savez(f'{directory}/{key}.tmp.npz', **{name: np.asarray(value) for name, value in client_slice.items()})
+    os.replace(f'{directory}/{key}.tmp.npz', f'{directory}/{key}.npz')
+
+    index = load_manifest(directory)
+    index[key] = {"size": os.path.getsize(f'{directory}/{key}.npz'), "used": time(), "detail": "E_b" in client_slice}
+    total = sum(entry["size"] for entry in index.values())
+    for old in sorted(index, key=lambda entry: index[entry]["used"]):
+        if total <= inputs["result_cache_size"] * 1e6 or old == key:
+            break
+        total -= index[old]["size"]
+        os.remove(f'{directory}/{old}.npz')
+        del index[old]
+    save_manifest(directory, index)
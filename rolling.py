@@ -0,0 +1,154 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Rolling horizon mode of AOM and ROM. Instead of one model over the whole year, the year is solved as a sequence of windows
+# (e.g. days or weeks), optionally extended by a look-ahead period. Only the first `window` time intervals of each solved
+# window are kept, and the SOC at the end of them becomes the initial SOC of the next window in place of SOC[0] == 0.
+# The windows are much smaller models than the annual one, which cuts memory and solve time at the price of a (usually small)
+# cost gap against the full-horizon solution, reported by `rolling_horizon_report`.
+
+# Imports ---------------------------------------------------------------------
+from pyomo.environ import *
+from collections import OrderedDict
+from copy import copy
+from time import time
+from model import *
+from read import *
+
+def Rolling_Horizon_Model(data, outputs, cnum, tnum=None, Model="AOM", window=288, lookahead=0, saveDetail=False, FCAS=True,
+                          solver="cplex", solver_threads=None, LP_fast_path=False, solver_options=None, compact=False):
+    '''Solve AOM or ROM for client cnum over consecutive windows, carrying the final SOC of each window over to the next
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM
+            Model (String, optional): "AOM" or "ROM"
+            window (Int, optional): Number of time intervals kept from each window (288 = one day, 2016 = one week)
+            lookahead (Int, optional): Number of extra time intervals solved after each window but not kept
+            saveDetail (bool, optional): Whether to save variable specific data
+            FCAS (bool, optional): Whether to participate in FCAS markets (AOM only)
+            solver (String, optional): Name of the solver, e.g. "cplex" or "glpk"
+            solver_threads (Int, optional): Number of threads the solver may use, None for the solver's default
+            LP_fast_path (bool, optional): Whether to solve the windows through the LP fast path (model.solve_LP_fast_path)
+            solver_options (dict, optional): Solver options of each window (model.get_solver)
+            compact (bool, optional): Whether to build the compact formulation of each window (model.build_aggregator_model)
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    lenT  = len(data["T"])
+    FCAS  = FCAS and Model == "AOM"
+    opt   = get_solver(solver, solver_threads, solver_options)
+    costs = {"total_net_cost": 0, "energy_net_cost": 0, "FCAS_net_cost": 0, "cost_c": 0}
+    # The model size is the maximum over the windows of this run, not of an earlier solve into the same outputs
+    for key in ["time", "bin_vars", "real_vars", "constraints"]:
+        outputs[key][cnum] = 0
+
+    SOC_0 = 0
+    if saveDetail:
+        outputs["SOC"][0, column(outputs, cnum)] = SOC_0
+    for start in range(0, lenT, window):
+        stop  = min(start + window + lookahead, lenT)
+        kept  = min(window, lenT - start)
+        wdata = slice_data(data, start, stop)
+        if Model == "AOM":
+            m = build_aggregator_model(wdata, cnum, FCAS, SOC_0, compact=compact)
+        else:
+            m = build_retail_model(wdata, cnum, tnum, SOC_0, compact=compact)
+        clock    = time()
+        solution = solve_model(m, opt, wdata, cnum, tnum if Model == "ROM" else None, LP_fast_path)
+        solve_time, n_vars, n_constraints = solver_statistics(m, solution, time() - clock)
+        print(f"------------------------------Window [{start}, {start + kept}) done: {solution.solver.termination_condition}------------------------------")
+
+        # Solver output, the model size is the one of the largest window
+        outputs["time"][cnum]       += solve_time
+        outputs["bin_vars"][cnum]    = max(outputs["bin_vars"][cnum], count_binaries(m))
+        outputs["real_vars"][cnum]   = max(outputs["real_vars"][cnum], n_vars - count_binaries(m))
+        outputs["constraints"][cnum] = max(outputs["constraints"][cnum], n_constraints)
+
+        # Costs of the kept time intervals
+        window_costs(m, wdata, cnum, tnum, kept, Model, FCAS, costs)
+        if saveDetail:
+            save_window(m, outputs, cnum, start, kept, Model, FCAS)
+        # Final SOC of the kept time intervals is the initial SOC of the next window
+        SOC_0 = value(m.SOC[kept])
+
+    for key, cost in costs.items():
+        outputs[key][cnum] = cost
+    print(f'Rolling horizon cost: {outputs["total_net_cost"][cnum]}')
+    print("-----------------------------Outputs done--------------------------------")
+
+    return outputs
+
+def window_costs(m, wdata, cnum, tnum, kept, Model, FCAS, costs):
+    '''Add the costs of the first `kept` time intervals of a solved window to costs
+    '''
+    energy = energy_cost(m, wdata, kept)
+    if Model == "AOM":
+        FCAS_net = FCAS_cost(m, wdata, kept) if FCAS else 0
+        costs["energy_net_cost"] += energy
+        costs["FCAS_net_cost"]   += FCAS_net
+        costs["total_net_cost"]  += energy + FCAS_net
+    else:
+        costs["total_net_cost"] += retail_cost(m, wdata, tnum, kept)
+        costs["cost_c"]         += energy
+
+def save_window(m, outputs, cnum, start, kept, Model, FCAS):
+    '''Save the variable values of the first `kept` time intervals of a solved window into outputs
+    '''
+    rows = slice(start, start + kept)
+    col  = column(outputs, cnum)
+    outputs["E_b"][rows, col] = variable_values(m.E)[:kept]
+    if Model == "ROM":
+        outputs["E_buy"][rows, col]  = variable_values(m.E_b)[:kept]
+        outputs["E_sell"][rows, col] = variable_values(m.E_s)[:kept]
+    if FCAS:
+        outputs["L_b"][rows, :, col] = variable_values(m.L)[:kept]
+        outputs["R_b"][rows, :, col] = variable_values(m.R)[:kept]
+        for var in ["L_c", "L_d", "R_c", "R_d", "L_pv", "R_pv"]:
+            outputs[var][rows, col] = variable_values(getattr(m, var))[:kept]
+    outputs["P_c"][rows, col] = variable_values(m.P_c)[:kept]
+    outputs["P_d"][rows, col] = variable_values(m.P_d)[:kept]
+    outputs["PV"][rows, col]  = variable_values(m.PV)[:kept]
+    outputs["SOC"][start + 1:start + kept + 1, col] = variable_values(m.SOC)[1:kept + 1]
+
+## Comparison with the full-horizon model ---------------------------------------------------------------------
+def rolling_horizon_report(full_outputs, rolling_outputs, client_range):
+    '''Print the cost gap and solver time of the rolling horizon solution against the full-horizon solution
+
+        Args:
+            full_outputs (OrderedDict): Outputs of the full-horizon model
+            rolling_outputs (OrderedDict): Outputs of the rolling horizon model
+            client_range (range): Client IDs to compare
+
+        Returns:
+            report (OrderedDict): client ID -> full cost, rolling cost, absolute and relative gap, solver times
+    '''
+    report = OrderedDict()
+    print("------------------------------Rolling horizon report------------------------------")
+    for cnum in client_range:
+        full = full_outputs["total_net_cost"][cnum]
+        roll = rolling_outputs["total_net_cost"][cnum]
+        gap  = roll - full
+        report[cnum] = {"full_cost": full, "rolling_cost": roll, "gap": gap, "relative_gap": gap / abs(full) if full else 0.0,
+                        "full_time": full_outputs["time"][cnum], "rolling_time": rolling_outputs["time"][cnum]}
+        print(f'client {cnum}: full {full:.4f}, rolling {roll:.4f}, gap {gap:.4f} ({100 * report[cnum]["relative_gap"]:.3f}%), '
+              f'solver time {report[cnum]["full_time"]:.2f}s -> {report[cnum]["rolling_time"]:.2f}s')
+    return report
+
+def compare_with_full_horizon(inputs, data, rolling_outputs, tnum=None):
+    '''Solve the clients of inputs with the full-horizon model and report the gap of the rolling horizon outputs
+    '''
+    from runner import run_clients
+    full_inputs = copy(inputs)
+    full_inputs["rolling_window"] = None
+    full_inputs["checkpoint"]     = False
+    full_inputs["metrics"]        = False
+    full_inputs["progress"]       = False
+    full_outputs = run_clients(full_inputs, data, initialisation(full_inputs, data), tnum)
+    return rolling_horizon_report(full_outputs, rolling_outputs, range(inputs["start_client"], inputs["end_client"] + 1))
@@ -0,0 +1,342 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Run AOM or ROM over the client range specified in main.py. The clients are independent optimisation problems, so they
+# can either be solved one after another (serial) or be distributed over a pool of worker processes (parallel). Every worker
+# returns its slice of `outputs` and the slices are merged back into the container of the main process, which gives exactly
+# the same `outputs` as the serial run. With inputs["checkpoint"], every client is written to disk as soon as it is solved and
+# the clients completed by a previous run with the same configuration are loaded instead of solved (see checkpoint.py).
+# With inputs["result_cache"], clients are looked up in the content-addressed result cache first (see result_cache.py).
+# The metrics of every client (phase times, memory, model size, solver statistics) are logged through instrumentation.py.
+# With inputs["race"], every client is solved by several solvers or option sets at once and the first acceptable result is kept.
+# With inputs["decomposition"], the clients are solved one after another and the workers solve the blocks of each client.
+# With inputs["memory_budget"], the model of every client is released before the next one is built (see memory_budget.py).
+
+# Imports ---------------------------------------------------------------------
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import copy
+import multiprocessing
+import queue
+import gc
+import os
+import signal
+import numpy as np
+from model import *
+from read import *
+from rolling import *
+from aggregation import *
+from incremental import *
+from decomposition import *
+from matrix_model import *
+from template import *
+from checkpoint import *
+from result_cache import *
+from instrumentation import *
+
+# Seconds between the liveness checks of the race contenders while waiting for their results
+RACE_POLL = 5
+
+## Single client ---------------------------------------------------------------------
+def solve_client(inputs, data, outputs, cnum, tnum=None):
+    '''Run the model configured in inputs for one client
+
+        Args:
+            inputs (OrderedDict): MILP model configuration
+            data (OrderedDict): Model information
+            outputs (OrderedDict): Outputs container
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    if inputs["engine"] == "dp":
+        modes = [mode for mode in ["race", "incremental", "decomposition", "rolling_window", "representative_days", "template"] if inputs[mode]]
+        modes += ["builder = 'matrix'"] if inputs["builder"] == "matrix" else []
+        if modes:
+            raise ValueError(f"The DP engine solves the whole horizon of a client, it does not support {', '.join(modes)}; "
+                             "use the MILP engine")
+    if inputs["builder"] == "matrix":
+        modes = [mode for mode in ["incremental", "decomposition", "rolling_window", "representative_days", "template", "compact",
+                                   "LP_fast_path", "warm_start"] if inputs[mode]]
+        if modes:
+            raise ValueError(f"The matrix builder solves the plain model with HiGHS, it does not support {', '.join(modes)}; "
+                             "use builder = 'pyomo'")
+    if inputs["race"]:
+        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} (race of {len(inputs['race'])} contenders) :::::::::::::::::::::::::::::::")
+        return race_client(inputs, data, outputs, cnum, tnum)
+    elif inputs["incremental"]:
+        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} (incremental) :::::::::::::::::::::::::::::::")
+        return Incremental_Model(data, outputs, cnum, tnum, Model=inputs["Model"], margin=inputs["incremental_margin"],
+                                 saveDetail=inputs["saveDetail"], FCAS=inputs["FCAS"], solver=inputs["solver"],
+                                 solver_threads=inputs["solver_threads"], solver_options=inputs["solver_options"], compact=inputs["compact"])
+    elif inputs["decomposition"]:
+        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} (decomposition into {inputs['decomposition']} blocks) :::::::::::::::::::::::::::::::")
+        return Decomposition_Model(data, outputs, cnum, tnum, Model=inputs["Model"], blocks=inputs["decomposition"],
+                                   tolerance=inputs["decomposition_tolerance"], iterations=inputs["decomposition_iterations"],
+                                   workers=inputs["workers"], saveDetail=inputs["saveDetail"], FCAS=inputs["FCAS"], solver=inputs["solver"],
+                                   solver_threads=inputs["solver_threads"], solver_options=inputs["solver_options"], compact=inputs["compact"])
+    elif inputs["rolling_window"]:
+        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} (rolling horizon of {inputs['rolling_window']}) :::::::::::::::::::::::::::::::")
+        return Rolling_Horizon_Model(data, outputs, cnum, tnum, Model=inputs["Model"], window=inputs["rolling_window"],
+                                     lookahead=inputs["rolling_lookahead"], saveDetail=inputs["saveDetail"], FCAS=inputs["FCAS"],
+                                     solver=inputs["solver"], solver_threads=inputs["solver_threads"], LP_fast_path=inputs["LP_fast_path"],
+                                     solver_options=inputs["solver_options"], compact=inputs["compact"])
+    elif inputs["representative_days"]:
+        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} ({inputs['representative_days']} representative days) :::::::::::::::::::::::::::::::")
+        return Representative_Days_Model(data, outputs, cnum, tnum, Model=inputs["Model"], days=inputs["representative_days"],
+                                         saveDetail=inputs["saveDetail"], FCAS=inputs["FCAS"], solver=inputs["solver"],
+                                         solver_threads=inputs["solver_threads"], solver_options=inputs["solver_options"],
+                                         compact=inputs["compact"])
+    elif inputs["builder"] == "matrix":
+        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} (matrix form) :::::::::::::::::::::::::::::::")
+        if inputs["Model"] == "AOM":
+            return Aggregator_Matrix_Model(data, outputs, cnum, saveDetail=inputs["saveDetail"], FCAS=inputs["FCAS"],
+                                           solver_options=inputs["solver_options"])
+        return Retail_Matrix_Model(data, outputs, cnum, tnum, saveDetail=inputs["saveDetail"], solver_options=inputs["solver_options"])
+    elif inputs["template"]:
+        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} with tariff {tnum} (template) :::::::::::::::::::::::::::::::")
+        return Template_Model(data, outputs, cnum, tnum, Model=inputs["Model"], saveDetail=inputs["saveDetail"], FCAS=inputs["FCAS"],
+                              solver=inputs["solver"], solver_threads=inputs["solver_threads"], LP_fast_path=inputs["LP_fast_path"],
+                              warm_start=inputs["warm_start"], solver_options=inputs["solver_options"], compact=inputs["compact"])
+    elif inputs["Model"] == "AOM":
+        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} :::::::::::::::::::::::::::::::")
+        return Aggregator_Optimisation_Model(data, outputs, cnum, saveDetail=inputs["saveDetail"], FCAS=inputs["FCAS"],
+                                             solver=inputs["solver"], solver_threads=inputs["solver_threads"], LP_fast_path=inputs["LP_fast_path"],
+                                             warm_start=inputs["warm_start"], engine=inputs["engine"], SOC_steps=inputs["SOC_steps"],
+                                             solver_options=inputs["solver_options"], compact=inputs["compact"])
+    else:
+        print(f"::::::::::::::::::::::::::::::: client ID = {cnum} with tariff {tnum} :::::::::::::::::::::::::::::::")
+        return Retail_Optimisation_Model(data, outputs, cnum, tnum, saveDetail=inputs["saveDetail"],
+                                         solver=inputs["solver"], solver_threads=inputs["solver_threads"], LP_fast_path=inputs["LP_fast_path"],
+                                         warm_start=inputs["warm_start"], engine=inputs["engine"], SOC_steps=inputs["SOC_steps"],
+                                         solver_options=inputs["solver_options"], compact=inputs["compact"])
+
+## Client range ---------------------------------------------------------------------
+def run_clients(inputs, data, outputs, tnum=None):
+    '''Run the model configured in inputs for all clients in [start_client, end_client], serially if inputs["workers"]
+        is 1 and on a process pool of inputs["workers"] processes otherwise. With inputs["checkpoint"], the clients are
+        saved to their part files as they complete and the completed clients of a previous run are loaded instead. With
+        inputs["result_cache"], clients found in the result cache are loaded and clients with identical inputs are solved once.
+
+        Args:
+            inputs (OrderedDict): MILP model configuration
+            data (OrderedDict): Model information
+            outputs (OrderedDict): Outputs container
+            tnum (Int, optional): The tariff used in ROM
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    client_range = range(inputs["start_client"], inputs["end_client"] + 1)
+    if inputs["checkpoint"]:
+        completed = resume(inputs, data, tnum)
+        for cnum in client_range:
+            if cnum in completed:
+                merge_slice(outputs, cnum, load_part(inputs, cnum, tnum))
+        client_range = [cnum for cnum in client_range if cnum not in completed]
+
+    # Cached clients are loaded, and clients with the same key as an earlier client of the range are copied from it
+    begin_run(len(client_range))
+    keys, duplicates = {}, {}
+    if inputs["result_cache"]:
+        first = {}
+        for cnum in client_range:
+            keys[cnum] = result_key(inputs, data, cnum, tnum)
+            cached     = load_result(inputs, keys[cnum])
+            if cached is not None:
+                finish_client(inputs, outputs, cnum, cached, tnum, metrics=OrderedDict(client=cnum, tariff=tnum, source="cache"))
+            elif keys[cnum] in first:
+                duplicates[cnum] = first[keys[cnum]]
+            else:
+                first[keys[cnum]] = cnum
+        client_range = list(first.values())
+
+    # With the time decomposition, the workers solve the blocks of one client at a time
+    workers = 1 if inputs["decomposition"] else min(inputs["workers"], len(client_range))
+    if workers <= 1:
+        for cnum in client_range:
+            begin_client(cnum, tnum)
+            outputs = solve_client(inputs, data, outputs, cnum, tnum)
+            finish_client(inputs, outputs, cnum, outputs_slice(outputs, cnum), tnum, keys.get(cnum), end_client(outputs, cnum))
+            release_model(inputs)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(inputs, data)) as pool:
+            futures = {pool.submit(solve_client_slice, cnum, tnum): cnum for cnum in client_range}
+            for future in as_completed(futures):
+                cnum = futures[future]
+                client_slice, metrics = future.result()
+                finish_client(inputs, outputs, cnum, client_slice, tnum, keys.get(cnum), metrics)
+                print(f"------------------------------client ID = {cnum} merged------------------------------")
+
+    for cnum, original in duplicates.items():
+        print(f"------------------------------client ID = {cnum} has the same inputs as client ID = {original}------------------------------")
+        finish_client(inputs, outputs, cnum, outputs_slice(outputs, original), tnum,
+                      metrics=OrderedDict(client=cnum, tariff=tnum, source=f"duplicate of {original}"))
+    return outputs
+
+def finish_client(inputs, outputs, cnum, client_slice, tnum=None, key=None, metrics=None):
+    '''Put the results of a solved, cached or duplicate client into outputs, its checkpoint part and the result cache,
+        and log its metrics (instrumentation.end_client)
+    '''
+    merge_slice(outputs, cnum, client_slice)
+    if inputs["checkpoint"]:
+        save_part(inputs, cnum, client_slice, tnum)
+    if key is not None:
+        store_result(inputs, key, client_slice)
+    if metrics is not None:
+        client_done(inputs, metrics)
+
+## Worker process ---------------------------------------------------------------------
+# Model configuration, data and outputs container of the worker process, set once by init_worker
+worker_state = {}
+
+def init_worker(inputs, data):
+    '''Keep the configuration and data in the worker process so that they are only sent once per worker
+    '''
+    worker_state["inputs"]  = inputs
+    worker_state["data"]    = data
+    worker_state["outputs"] = initialisation(inputs, data)
+
+def solve_client_slice(cnum, tnum=None):
+    '''Solve one client in the worker process and return its slice of outputs and its metrics
+    '''
+    begin_client(cnum, tnum)
+    outputs = solve_client(worker_state["inputs"], worker_state["data"], worker_state["outputs"], cnum, tnum)
+    client_slice, metrics = outputs_slice(outputs, cnum), end_client(outputs, cnum)
+    release_model(worker_state["inputs"])
+    return client_slice, metrics
+
+def release_model(inputs):
+    '''With a memory budget, free the model of the last client (Pyomo models hold reference cycles) before the next one is built
+    '''
+    if inputs["memory_budget"]:
+        gc.collect()
+
+def outputs_slice(outputs, cnum):
+    '''Take the results of client cnum out of the outputs container
+    '''
+    col = column(outputs, cnum)
+    return {key: (np.copy(value[..., col]) if isinstance(value, np.ndarray) else value[cnum]) for key, value in outputs.items() if key != "clients"}
+
+def merge_slice(outputs, cnum, client_slice):
+    '''Put the results of client cnum back into the outputs container
+    '''
+    col = column(outputs, cnum)
+    for key, value in client_slice.items():
+        if key not in outputs:
+            continue
+        if isinstance(outputs[key], np.ndarray):
+            outputs[key][..., col] = value
+        else:
+            outputs[key][cnum] = value
+
+## Solver racing ---------------------------------------------------------------------
+def race_client(inputs, data, outputs, cnum, tnum=None):
+    '''Solve client cnum with every contender of inputs["race"] at once, each in its own process, and keep the first result
+        that is accepted (race_accepts). The other contenders are stopped. If no result is accepted, the one with the lowest
+        cost is kept.
+
+        Args:
+            inputs (OrderedDict): MILP model configuration, inputs["race"] is a list of contenders, each a dict of the inputs
+                it changes, e.g. [{"solver": "cplex"}, {"solver": "cbc", "solver_options": {"mip_gap": 1e-3}}]
+            data (OrderedDict): Model information
+            outputs (OrderedDict): Outputs container
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    results   = multiprocessing.Queue()
+    processes = []
+    for number, overrides in enumerate(inputs["race"]):
+        contender = copy(inputs)
+        contender.update(overrides)
+        contender.update(race=None, start_client=cnum, end_client=cnum)
+        processes.append(multiprocessing.Process(target=race_contender, args=(contender, data, cnum, tnum, number, results)))
+        processes[-1].start()
+
+    winner, fallback = None, None
+    try:
+        for number, client_slice, metrics in race_results(processes, results):
+            if client_slice is None:
+                print(f"------------------------------Contender {number} failed: {metrics}------------------------------")
+            elif race_accepts(metrics, inputs["race_tolerance"]):
+                winner = (number, client_slice, metrics)
+                break
+            elif fallback is None or client_slice["total_net_cost"] < fallback[1]["total_net_cost"]:
+                fallback = (number, client_slice, metrics)
+    finally:
+        for process in processes:
+            stop_contender(process)
+    if winner is None and fallback is None:
+        raise RuntimeError(f"No contender of the race solved client {cnum}")
+    number, client_slice, metrics = winner or fallback
+    print(f"------------------------------Contender {number} {inputs['race'][number]} won------------------------------")
+
+    merge_slice(outputs, cnum, client_slice)
+    if current:
+        current.update(phases=metrics["phases"], rss_MB=metrics["rss_MB"], peak_MB=metrics["peak_MB"], solver=metrics["solver"], race_winner=number)
+    return outputs
+
+def race_results(processes, results):
+    '''Yield the (number, client_slice, metrics) result of every contender as it arrives. A contender that exits without
+        posting a result (e.g. killed for memory or crashed in the solver) is yielded as failed, so the race never waits for it.
+        A dead contender is only counted as failed after a further empty poll, so a result still in the pipe is not lost.
+    '''
+    pending, dead = set(range(len(processes))), set()
+    while pending:
+        try:
+            number, client_slice, metrics = results.get(timeout=RACE_POLL)
+        except queue.Empty:
+            for number in sorted(pending):
+                if processes[number].is_alive():
+                    continue
+                if number in dead:
+                    pending.discard(number)
+                    yield number, None, f"exited with code {processes[number].exitcode} without a result"
+                dead.add(number)
+            continue
+        pending.discard(number)
+        yield number, client_slice, metrics
+
+def race_contender(inputs, data, cnum, tnum, number, results):
+    '''Solve client cnum with the inputs of one contender and put its slice of outputs and its metrics into results
+    '''
+    # Own process group, so that stop_contender also stops the solver processes started by this contender
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    try:
+        begin_client(cnum, tnum)
+        outputs = solve_client(inputs, data, initialisation(inputs, data), cnum, tnum)
+        results.put((number, outputs_slice(outputs, cnum), end_client(outputs, cnum)))
+    except Exception as error:
+        results.put((number, None, repr(error)))
+
+def race_accepts(metrics, tolerance):
+    '''Whether a contender's result ends the race: a MIP gap within tolerance, or an optimal termination if the solver
+        reports no gap. Engines without a solver (e.g. "dp") are always accepted.
+    '''
+    solver = metrics["solver"]
+    if not solver:
+        return True
+    if solver["gap"] is not None:
+        return solver["gap"] <= tolerance
+    return solver["termination"] == "optimal"
+
+def stop_contender(process):
+    '''Stop a contender process and its solver processes if it is still running
+    '''
+    if process.is_alive():
+        if hasattr(os, "killpg"):
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        else:
+            process.terminate()
+    process.join()
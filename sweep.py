@@ -0,0 +1,129 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Battery sizing sweep. Every client of the range is solved for every combination of a grid of BESS power (kW), energy
+# (kWh, Max_SOC) and efficiency instead of the single BESS of DER.xlsx. The combinations of a client are solved on the template
+# model (template.py), so the model is built once and only its BESS parameters change between solves, and the (client,
+# combinations) tasks are spread over inputs["workers"] processes. The cost surfaces of all clients are written to one file,
+# output/<business model>/BESS_sweep.npz, with one array of shape (clients, power, energy, efficiency) per cost.
+
+# Imports ---------------------------------------------------------------------
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from copy import copy
+import itertools
+import os
+import numpy as np
+from read import *
+from runner import *
+from checkpoint import output_directory
+
+# Outputs kept for every combination
+SWEEP_KEYS = ["total_net_cost", "energy_net_cost", "FCAS_net_cost", "cost_c", "time"]
+
+def sweep_BESS(inputs, data, tnum=None):
+    '''Solve all clients of inputs for every BESS of the grid inputs["sweep"] and write the cost surfaces
+
+        Args:
+            inputs (OrderedDict): MILP model configuration, inputs["sweep"] is a dict of the "power" (kW), "energy" (kWh) and
+                optionally "eff" values to combine, e.g. {"power": [3, 5, 7], "energy": [6.5, 10, 13.5], "eff": [0.9, 0.95]}.
+                Without "eff", the efficiency of each client in DER.xlsx is kept.
+            data (OrderedDict): Model information
+            tnum (Int, optional): The tariff used in ROM
+
+        Returns:
+            surfaces (OrderedDict): The grids, the client IDs and one (clients, power, energy, efficiency) array per SWEEP_KEYS
+    '''
+    grid    = OrderedDict((key, list(inputs["sweep"].get(key, [None]))) for key in ["power", "energy", "eff"])
+    shape   = tuple(len(values) for values in grid.values())
+    combos  = list(itertools.product(*(range(n) for n in shape)))
+    clients = list(range(inputs["start_client"], inputs["end_client"] + 1))
+    # The template reuses the model between combinations, except for the engines that do not build a Pyomo model. Every
+    # combination changes the BESS, so the incremental state of the client would be replaced by the last one, and the
+    # combinations already use the workers, so they are not raced or decomposed over more processes.
+    sweep_inputs = copy(inputs)
+    sweep_inputs.update(saveDetail=False, checkpoint=False, result_cache=False, sweep=None, incremental=False, decomposition=None, race=None,
+                        template=inputs["engine"] == "milp" and inputs["builder"] == "pyomo" and not inputs["rolling_window"])
+    print(f"------------------------------BESS sweep: {len(clients)} clients x {len(combos)} combinations------------------------------")
+
+    surfaces = OrderedDict((key, np.full((len(clients),) + shape, np.nan)) for key in SWEEP_KEYS)
+    workers  = max(1, min(inputs["workers"], len(clients) * len(combos)))
+    # Every client's combinations are split into `workers` tasks, so that a few clients still use all workers
+    tasks    = [(cnum, combos[i::workers]) for cnum in clients for i in range(workers) if combos[i::workers]]
+    if workers == 1:
+        for cnum, task in tasks:
+            collect(surfaces, clients.index(cnum), sweep_task(sweep_inputs, data, cnum, task, grid, tnum))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(sweep_inputs, data)) as pool:
+            futures = {pool.submit(sweep_worker_task, cnum, task, grid, tnum): cnum for cnum, task in tasks}
+            for future in as_completed(futures):
+                collect(surfaces, clients.index(futures[future]), future.result())
+
+    surfaces["power"]  = np.array(grid["power"], dtype=float)
+    surfaces["energy"] = np.array(grid["energy"], dtype=float)
+    surfaces["eff"]    = np.array([np.nan if eff is None else eff for eff in grid["eff"]])
+    surfaces["Ids"]    = np.array([str(data["Ids"][cnum]) for cnum in clients])
+    os.makedirs(f'{os.getcwd()}/output/{output_directory(inputs, tnum)}', exist_ok=True)
+    np.savez_compressed(f'{os.getcwd()}/output/{output_directory(inputs, tnum)}/BESS_sweep.npz', **surfaces)
+    sweep_report(surfaces)
+    return surfaces
+
+def sweep_task(inputs, data, cnum, combos, grid, tnum=None):
+    '''Solve client cnum for the BESS combinations combos (indices into grid)
+
+        Returns:
+            results (list): (combination, {key: value of SWEEP_KEYS}) for each combination
+    '''
+    # One data dictionary for all combinations, so that the template only updates the BESS parameters and keeps the prices
+    BESS_data = OrderedDict(data)
+    if inputs["Model"] == "ROM":
+        for key in ["power", "Max_SOC", "eff"]:
+            BESS_data[key] = np.copy(data[key])
+    outputs = initialisation(inputs, data)
+    results = []
+    for combo in combos:
+        power, energy, eff = (values[i] for values, i in zip(grid.values(), combo))
+        set_BESS(BESS_data, cnum, inputs["Model"], power, energy, eff)
+        print(f"------------------------------BESS {power} kW / {energy} kWh / efficiency {BESS_value(BESS_data, cnum, 'eff')}------------------------------")
+        outputs = solve_client(inputs, BESS_data, outputs, cnum, tnum)
+        results.append((combo, {key: outputs[key][cnum] for key in SWEEP_KEYS}))
+    return results
+
+def sweep_worker_task(cnum, combos, grid, tnum=None):
+    '''sweep_task in a worker process of runner.init_worker
+    '''
+    return sweep_task(worker_state["inputs"], worker_state["data"], cnum, combos, grid, tnum)
+
+def set_BESS(data, cnum, Model, power, energy, eff=None):
+    '''Set the BESS of client cnum in data: a single BESS for all clients in AOM, one per client in ROM. eff None keeps it.
+    '''
+    for key, value in [("power", power), ("Max_SOC", energy), ("eff", eff)]:
+        if value is None:
+            continue
+        if Model == "AOM":
+            data[key] = value
+        else:
+            data[key][cnum] = value
+
+def BESS_value(data, cnum, key):
+    return data[key] if np.isscalar(data[key]) else data[key][cnum]
+
+def collect(surfaces, row, results):
+    '''Put the results of a sweep task into row `row` of the cost surfaces
+    '''
+    for combo, values in results:
+        for key, value in values.items():
+            surfaces[key][(row,) + combo] = value
+
+def sweep_report(surfaces):
+    '''Print the BESS with the lowest cost and the range of the costs of every client
+    '''
+    print("------------------------------BESS sweep report------------------------------")
+    for row, Id in enumerate(surfaces["Ids"]):
+        i, j, k = np.unravel_index(np.nanargmin(surfaces["total_net_cost"][row]), surfaces["total_net_cost"][row].shape)
+        print(f'client {Id}: lowest cost with {surfaces["power"][i]} kW / {surfaces["energy"][j]} kWh / efficiency {surfaces["eff"][k]}, '
+              f'cost {surfaces["total_net_cost"][row, i, j, k]:.4f} (range {np.nanmin(surfaces["total_net_cost"][row]):.4f} to '
+              f'{np.nanmax(surfaces["total_net_cost"][row]):.4f})')
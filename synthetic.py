@@ -0,0 +1,109 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Synthetic input data of AOM and ROM, for benchmarks and tests without the real data set. It writes the same files as
+# data/aggregator_model_data and data/retail_model_data (read by read.py) for any number of clients and time intervals: BESS
+# parameters in DER.xlsx, load and PV profiles with daily and seasonal shapes, energy prices with evening peaks, spikes and
+# negative prices, FCAS prices and four retail tariffs. The time intervals always cover one year (read.readSetting computes
+# Δt = 8760 h / number of intervals), so 105120 intervals are 5 minutes and 8760 intervals are one hour.
+#
+# Usage: python synthetic.py [directory] [number of clients] [number of time intervals]
+
+# Imports ---------------------------------------------------------------------
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# FCAS markets of the price file
+FCAS_MARKETS = ["RAISE6S", "RAISE60S", "RAISE5MIN", "LOWER6S", "LOWER60S", "LOWER5MIN"]
+
+def generate_synthetic_data(directory="data", n_clients=92, n_intervals=105120, seed=0):
+    '''Write synthetic aggregator and retail business model data
+
+        Args:
+            directory (String, optional): Data directory, the files go to directory/aggregator_model_data and directory/retail_model_data
+            n_clients (Int, optional): Number of clients
+            n_intervals (Int, optional): Number of time intervals of the year
+            seed (Int, optional): Seed of the random generator, the same seed gives the same data
+    '''
+    rng   = np.random.default_rng(seed)
+    Ids   = [f'client_{i}' for i in range(n_clients)]
+    hours = np.arange(n_intervals) * 8760 / n_intervals
+    Time  = (pd.Timestamp("2018-01-01") + pd.to_timedelta(hours, unit="h")).strftime("%Y/%m/%d %H:%M")
+    hour  = hours % 24
+    # Seasonal factor: 1 in summer (January), 0 in winter (July)
+    season = 0.5 + 0.5 * np.cos(2 * np.pi * hours / 8760)
+
+    load   = pd.DataFrame({"Time": Time, **dict(zip(Ids, synthetic_load(rng, hour, n_clients).T))})
+    PV     = synthetic_PV(rng, hour, season, n_clients)
+    # read.readPV drops the last row of the PV files
+    PV     = pd.DataFrame({"Time": list(Time) + [""], **{Id: np.append(PV[:, i], 0) for i, Id in enumerate(Ids)}})
+    prices = synthetic_prices(rng, hour, season)
+
+    aggregator = f'{directory}/aggregator_model_data'
+    os.makedirs(aggregator, exist_ok=True)
+    with pd.ExcelWriter(f'{aggregator}/DER.xlsx') as writer:
+        pd.DataFrame({"power": [5.0], "energy": [13.5], "eff": [0.95]}).to_excel(writer, sheet_name="Battery", index=False)
+        pd.DataFrame({Id: [1] for Id in Ids}).to_excel(writer, sheet_name="PV", index=False)
+    pd.DataFrame({"Time": Time, "ENERGY": prices, **{market: synthetic_FCAS_price(rng, len(hours)) for market in FCAS_MARKETS}}) \
+        .to_csv(f'{aggregator}/Prices.csv', index=False)
+    load.to_csv(f'{aggregator}/Load time_series.csv', index=False)
+    PV.to_csv(f'{aggregator}/PV time_series.csv', index=False)
+
+    retail = f'{directory}/retail_model_data'
+    os.makedirs(retail, exist_ok=True)
+    # One BESS per client: power (kW), energy (kWh), efficiency
+    BESS = np.stack([rng.choice([3.0, 5.0, 7.0], n_clients), rng.choice([6.5, 10.0, 13.5], n_clients), rng.uniform(0.88, 0.95, n_clients)])
+    with pd.ExcelWriter(f'{retail}/DER.xlsx') as writer:
+        pd.DataFrame(BESS, columns=Ids).to_excel(writer, sheet_name="Battery", index=False)
+    # Tariffs: flat, time-of-use, time-of-use with a shoulder, wholesale-following; the sell price is a flat feed-in tariff
+    peak = (hour >= 15) & (hour < 21)
+    buy  = pd.DataFrame({"Time": Time, "tariff_0": np.full(len(hours), 0.25), "tariff_1": np.where(peak, 0.45, 0.18),
+                         "tariff_2": np.where(peak, 0.50, np.where((hour >= 7) & (hour < 15), 0.25, 0.15)),
+                         "tariff_3": 0.12 + np.maximum(prices, 0) / 1000})
+    buy.to_csv(f'{retail}/retail_buy.csv', index=False)
+    pd.DataFrame({"tariff_0": [0.07], "tariff_1": [0.05], "tariff_2": [0.06], "tariff_3": [0.04]}).to_csv(f'{retail}/retail_sell.csv', index=False)
+    pd.DataFrame({"Time": Time, "ENERGY": prices / 1000}).to_csv(f'{retail}/Wholesale prices.csv', index=False)
+    load.to_csv(f'{retail}/Inflexible load.csv', index=False)
+    PV.to_csv(f'{retail}/PV.csv', index=False)
+    print(f"------------------------------Synthetic data of {n_clients} clients x {n_intervals} time intervals written to {directory}------------------------------")
+
+def synthetic_load(rng, hour, n_clients):
+    '''Inflexible load (kW): base load with morning and evening peaks, scaled per client, with noise
+    '''
+    shape = 0.4 + 0.6 * np.exp(-((hour - 7.5) / 1.5) ** 2) + 1.0 * np.exp(-((hour - 19) / 2.5) ** 2)
+    scale = rng.uniform(0.5, 2.0, n_clients)
+    return np.maximum(shape[:, None] * scale[None, :] * rng.lognormal(0, 0.25, (len(hour), n_clients)), 0)
+
+def synthetic_PV(rng, hour, season, n_clients):
+    '''Maximum PV generation (kW): daylight bell curve, longer and stronger in summer, scaled by the PV size of each client
+        and by cloud cover
+    '''
+    daylight = np.clip(np.cos((hour - 12.5) / (5 + 2 * season) * np.pi / 2), 0, None)
+    size     = rng.choice([0.0, 3.0, 5.0, 6.6], n_clients, p=[0.1, 0.3, 0.4, 0.2])
+    clouds   = np.clip(1 - rng.beta(0.7, 2.5, (len(hour), n_clients)), 0, 1)
+    return daylight[:, None] * (0.6 + 0.4 * season[:, None]) * size[None, :] * clouds
+
+def synthetic_prices(rng, hour, season):
+    '''Energy wholesale price ($/MWh): daily shape with an evening peak, noise, rare spikes and negative prices at midday
+    '''
+    price  = 60 + 30 * np.exp(-((hour - 18.5) / 2) ** 2) + 15 * season - 35 * np.exp(-((hour - 13) / 2) ** 2) * season
+    price  = price + rng.normal(0, 12, len(hour))
+    spikes = rng.random(len(hour)) < 0.002
+    price[spikes] += rng.uniform(300, 5000, spikes.sum())
+    return price
+
+def synthetic_FCAS_price(rng, n_intervals):
+    '''FCAS price ($/MW/h): mostly a few dollars with rare spikes
+    '''
+    price  = rng.lognormal(0.5, 0.8, n_intervals)
+    spikes = rng.random(n_intervals) < 0.001
+    price[spikes] += rng.uniform(100, 3000, spikes.sum())
+    return price
+
+if __name__ == "__main__":
+    generate_synthetic_data(sys.argv[1] if len(sys.argv) > 1 else "data", *[int(arg) for arg in sys.argv[2:4]])
@@ -0,0 +1,134 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Template mode of AOM and ROM. The structure of the models is the same for every client and every tariff, only the load,
+# PV, BESS parameters and prices change. The template is built once with mutable parameters; for each (client, tariff) the
+# parameters are updated in place and the model is re-solved on a persistent solver instance, which keeps the problem in
+# memory instead of writing a new problem file for every solve.
+
+# Imports ---------------------------------------------------------------------
+from pyomo.environ import *
+from time import time
+import numpy as np
+from model import *
+
+# Persistent counterpart of each solver. Solvers without one (e.g. GLPK), or whose persistent interface is not available
+# (e.g. appsi_cplex needs the cplex Python package, not only the CPLEX executable), still reuse the model but re-write the problem file.
+PERSISTENT_SOLVER = {"cplex": "appsi_cplex", "gurobi": "appsi_gurobi", "cbc": "appsi_cbc", "highs": "appsi_highs"}
+
+# Templates of this process: (Model, FCAS, number of time intervals, solver, threads, options, compact) -> (model, solver)
+templates = {}
+
+def Template_Model(data, outputs, cnum, tnum=None, Model="AOM", saveDetail=False, FCAS=True, solver="cplex", solver_threads=None,
+                   LP_fast_path=False, warm_start=None, solver_options=None, compact=False):
+    '''Solve AOM or ROM for client cnum (under tariff tnum) on the template model, fills the same outputs as
+        Aggregator_Optimisation_Model and Retail_Optimisation_Model
+
+        Args:
+            data (OrderedDict): Parameter data of the model
+            outputs (OrderedDict): Optimisation outputs container
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM
+            Model (String, optional): "AOM" or "ROM"
+            saveDetail (bool, optional): Whether to save variable specific data
+            FCAS (bool, optional): Whether to participate in FCAS markets (AOM only)
+            solver (String, optional): Name of the solver, e.g. "cplex" or "glpk"
+            solver_threads (Int, optional): Number of threads the solver may use, None for the solver's default
+            LP_fast_path (bool, optional): Whether to solve through the LP fast path (model.solve_LP_fast_path)
+            warm_start (String, optional): Initial point of the MILP, None, "heuristic" or "previous" (model.warm_start_seed)
+            solver_options (dict, optional): Options of the persistent solver (model.get_solver)
+            compact (bool, optional): Whether the template is the compact formulation (model.build_aggregator_model)
+
+        Returns:
+            outputs: Optimisation outputs
+    '''
+    m, opt = get_template(data, cnum, tnum, Model, FCAS, solver, solver_threads, solver_options, compact)
+    start    = time()
+    solution = solve_model(m, opt, data, cnum, tnum if Model == "ROM" else None, LP_fast_path, warm_start)
+    print("------------------------------Solution done------------------------------")
+    if Model == "AOM":
+        return aggregator_outputs(m, solution, time() - start, data, outputs, cnum, saveDetail, FCAS)
+    return retail_outputs(m, solution, time() - start, data, outputs, cnum, tnum, saveDetail)
+
+def get_template(data, cnum, tnum=None, Model="AOM", FCAS=True, solver="cplex", solver_threads=None, solver_options=None, compact=False):
+    '''Template model and persistent solver with the parameters of client cnum (and tariff tnum). The template is built on
+        the first call and updated on the following ones.
+
+        Returns:
+            m: Pyomo model with mutable parameters
+            opt: Persistent solver of m
+    '''
+    FCAS = FCAS and Model == "AOM"
+    key  = (Model, FCAS, len(data["T"]), solver, solver_threads, tuple(sorted((solver_options or {}).items())), compact)
+    if key in templates:
+        m, opt = templates[key]
+        update_template(m, data, cnum, tnum, Model)
+        print("------------------------------Template updated---------------------------")
+        return m, opt
+
+    if Model == "AOM":
+        m = build_aggregator_model(data, cnum, FCAS, mutable=True, timings=phase_timings(), compact=compact)
+    else:
+        m = build_retail_model(data, cnum, tnum, mutable=True, timings=phase_timings(), compact=compact)
+    # Data and tariff of the prices currently in the template
+    m.template_data = data
+    m.template_tnum = tnum
+    opt = get_solver(template_solver(solver), solver_threads, solver_options)
+    templates[key] = (m, opt)
+    return m, opt
+
+def template_solver(solver):
+    '''Name of the persistent counterpart of solver if it is available in this installation, solver itself otherwise
+    '''
+    persistent = PERSISTENT_SOLVER.get(solver)
+    if persistent is None:
+        return solver
+    try:
+        available = SolverFactory(persistent).available(exception_flag=False)
+    except Exception:
+        available = False
+    if not available:
+        print(f"------------------------------{persistent} is not available, the template uses {solver}------------------------------")
+        return solver
+    return persistent
+
+def update_template(m, data, cnum, tnum=None, Model="AOM"):
+    '''Update the mutable parameters of the template to client cnum (and tariff tnum). Prices are only updated when
+        the data or the tariff changes, because they are the same for every client.
+    '''
+    # Client parameters
+    m.P_il.store_values(series_values(data["load"].iloc[:, cnum]))
+    m.MPV.store_values(series_values(data["PV"].iloc[:, cnum]))
+    if Model == "AOM":
+        m.MP_C.set_value(data["power"])
+        m.MP_D.set_value(data["power"])
+        m.SOC_max.set_value(data["Max_SOC"])
+        m.η.set_value(data["eff"])
+    else:
+        m.MP_C.set_value(data["power"][cnum])
+        m.MP_D.set_value(data["power"][cnum])
+        m.SOC_max.set_value(data["Max_SOC"][cnum])
+        m.η.set_value(data["eff"][cnum])
+
+    # Prices
+    if m.template_data is not data or m.template_tnum != tnum:
+        m.λ_E.store_values(series_values(data["energy_price"]))
+        if Model == "AOM" and hasattr(m, "λ_R"):
+            m.λ_R.store_values({(t, w): price for (t, w), price in np.ndenumerate(data["R_FCAS_price"])})
+            m.λ_L.store_values({(t, w): price for (t, w), price in np.ndenumerate(data["L_FCAS_price"])})
+            if is_compact(m):
+                m.R_on.store_values(positive_prices(data["R_FCAS_price"]))
+                m.L_on.store_values(positive_prices(data["L_FCAS_price"]))
+        if Model == "ROM":
+            m.λ_TB.store_values(series_values(data["tariff_buy"][str(tnum)]))
+            m.λ_TS.set_value(data["tariff_sell"][str(tnum)])
+        m.template_data = data
+        m.template_tnum = tnum
+
+def series_values(series):
+    '''Values of a time series as {t: value}
+    '''
+    return dict(enumerate(np.asarray(series, dtype=float).tolist()))
@@ -0,0 +1,94 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Multi-node batch runner (batch.py) on a small synthetic data set, with several nodes run as processes on this machine: every
+# unit must end in done/ and the merged COST.csv must be the one of a serial run. A unit claimed by a node that died is
+# requeued and solved by the others. Uses the DP engine, so no solver is needed.
+#
+# Usage: python -m pytest tests
+
+# Imports ---------------------------------------------------------------------
+import os
+import sys
+from copy import copy
+from time import time
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from read import *
+from write import write_cost_outputs
+from runner import run_clients
+from batch import *
+from synthetic import generate_synthetic_data
+from main import inputs as main_inputs
+
+# Synthetic case: clients, time intervals of the year (12 h each), ROM tariffs and nodes
+N_CLIENTS   = 4
+N_INTERVALS = 730
+TARIFFS     = [0, 1]
+NODES       = 3
+
+@pytest.fixture
+def workdir(tmp_path):
+    '''Temporary working directory with the synthetic data in data/
+    '''
+    generate_synthetic_data(str(tmp_path / "data"), n_clients=N_CLIENTS, n_intervals=N_INTERVALS)
+    cwd = os.getcwd()
+    os.chdir(tmp_path)
+    try:
+        yield tmp_path
+    finally:
+        os.chdir(cwd)
+
+def batch_inputs():
+    '''Configuration of the run: ROM of all clients and TARIFFS on the DP engine
+    '''
+    case = copy(main_inputs)
+    case.update(start_client=0, end_client=N_CLIENTS - 1, Model="ROM", FCAS=False, tariffs=TARIFFS, saveDetail=False, engine="dp",
+                cache=False, lazy_columns=False, result_cache=False, metrics=False, progress=False, memory_budget=None, checkpoint=False,
+                workers=1, template=False, race=None, incremental=False, decomposition=None, rolling_window=None, representative_days=None,
+                resample=None, builder="pyomo")
+    return case
+
+def serial_costs(inputs, tnum):
+    '''COST.csv of a serial run of tariff tnum
+    '''
+    data    = read_data(inputs)
+    outputs = run_clients(inputs, data, initialisation(inputs, data), tnum)
+    os.makedirs(f'{os.getcwd()}/output/serial_{tnum}', exist_ok=True)
+    write_cost_outputs(outputs, inputs, data, f'serial_{tnum}')
+    with open(f'{os.getcwd()}/output/serial_{tnum}/COST.csv') as file:
+        return file.read()
+
+def check_merged(queue, inputs):
+    '''Every unit is done and the merged COST.csv of every tariff is the one of a serial run
+    '''
+    assert queue_status(queue) == OrderedDict(pending=0, claimed=0, done=N_CLIENTS * len(TARIFFS), failed=0)
+    assert merge_queue(queue)
+    for tnum in TARIFFS:
+        with open(f'{os.getcwd()}/output/{output_directory(inputs, tnum)}/COST.csv') as file:
+            assert file.read() == serial_costs(inputs, tnum), f"COST.csv of tariff {tnum}"
+
+def test_local_nodes(workdir):
+    inputs = batch_inputs()
+    queue  = str(workdir / "queue")
+    enqueue(queue, inputs)
+    run_local_nodes(queue, nodes=NODES, heartbeat=0.5, stale=300)
+    check_merged(queue, inputs)
+
+def test_stale_unit(workdir):
+    inputs = batch_inputs()
+    queue  = str(workdir / "queue")
+    units  = enqueue(queue, inputs)
+    # Units enqueued long before the nodes start are not taken back from a node that just claimed one
+    old = time() - 1000
+    for unit in units:
+        os.utime(unit_path(queue, "pending", unit), (old, old))
+    unit = claim_unit(queue, "dead-node")
+    assert requeue_stale(queue, stale=300) == []
+    # The node dies: its unit is no longer touched, requeued and solved by the other nodes
+    os.utime(unit_path(queue, "claimed", unit), (old, old))
+    run_local_nodes(queue, nodes=NODES, heartbeat=0.5, stale=300)
+    check_merged(queue, inputs)
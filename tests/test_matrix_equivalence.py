@@ -0,0 +1,83 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Equivalence of the matrix form (matrix_model.py) and the Pyomo formulation (model.py) of AOM with and without FCAS and of
+# ROM on a small synthetic data set: both builders must give the same costs, and the variable values of the matrix form must
+# satisfy every Pyomo constraint with the Pyomo optimum as objective value. Needs HiGHS (scipy and highspy).
+#
+# Usage: python -m pytest tests
+
+# Imports ---------------------------------------------------------------------
+import os
+import sys
+from copy import copy
+import pytest
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("highspy")
+from pyomo.environ import SolverFactory
+from read import *
+from runner import solve_client
+from matrix_model import check_equivalence
+from synthetic import generate_synthetic_data
+from validate import validate_client
+from main import inputs as main_inputs
+
+# Synthetic case: clients, time intervals of the year (12 h each) and the solver of the Pyomo builder
+N_CLIENTS   = 2
+N_INTERVALS = 730
+SOLVER      = "appsi_highs"
+CASES       = [("AOM", True, None), ("AOM", False, None), ("ROM", False, 0), ("ROM", False, 2)]
+
+pytestmark = pytest.mark.skipif(not SolverFactory(SOLVER).available(exception_flag=False), reason=f"{SOLVER} is not available")
+
+@pytest.fixture(scope="module")
+def datasets(tmp_path_factory):
+    '''AOM and ROM data of the synthetic case, read from a temporary directory
+    '''
+    directory = tmp_path_factory.mktemp("synthetic")
+    generate_synthetic_data(str(directory / "data"), n_clients=N_CLIENTS, n_intervals=N_INTERVALS)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        yield {"AOM": read_aggregator_business_model("aggregator_model_data/DER.xlsx", "aggregator_model_data/Prices.csv", "aggregator_model_data/Load time_series.csv", "aggregator_model_data/PV time_series.csv"),
+               "ROM": read_retail_business_model("retail_model_data/DER.xlsx", "retail_model_data/retail_sell.csv", "retail_model_data/retail_buy.csv", "retail_model_data/Wholesale prices.csv", "retail_model_data/Inflexible load.csv", "retail_model_data/PV.csv")}
+    finally:
+        os.chdir(cwd)
+
+def solve(data, Model, FCAS, tnum, builder):
+    '''Outputs of all clients of the synthetic case solved with builder ("matrix" or "pyomo")
+    '''
+    case = copy(main_inputs)
+    case.update(start_client=0, end_client=N_CLIENTS - 1, Model=Model, FCAS=FCAS, saveDetail=True, builder=builder, solver=SOLVER,
+                solver_options={"mip_gap": 0, "time_limit": None}, template=False, race=None, engine="milp", rolling_window=None,
+                representative_days=None, incremental=False, decomposition=None, compact=False, LP_fast_path=False, warm_start=None)
+    outputs = initialisation(case, data)
+    for cnum in range(N_CLIENTS):
+        outputs = solve_client(case, data, outputs, cnum, tnum)
+    return outputs
+
+@pytest.mark.parametrize("Model, FCAS, tnum", CASES)
+def test_costs(datasets, Model, FCAS, tnum):
+    data   = datasets[Model]
+    matrix = solve(data, Model, FCAS, tnum, "matrix")
+    pyomo  = solve(data, Model, FCAS, tnum, "pyomo")
+    for cnum in range(N_CLIENTS):
+        for key in ["total_net_cost", "energy_net_cost", "FCAS_net_cost"] if Model == "AOM" else ["total_net_cost"]:
+            assert matrix[key][cnum] == pytest.approx(pyomo[key][cnum], rel=1e-6, abs=1e-6), f"{key} of client {cnum}"
+
+@pytest.mark.parametrize("Model, FCAS, tnum", CASES)
+def test_variables(datasets, Model, FCAS, tnum):
+    data   = datasets[Model]
+    matrix = solve(data, Model, FCAS, tnum, "matrix")
+    for cnum in range(N_CLIENTS):
+        # The matrix solution is feasible for the Pyomo model and optimal for it (alternative optima may differ in value)
+        report = check_equivalence(data, cnum, tnum, Model, FCAS, solver=SOLVER)
+        assert report["equivalent"], report
+        # The stored variable values satisfy every constraint and give the stored costs
+        result = validate_client(matrix, data, cnum, tnum, Model, FCAS)
+        assert result["feasible"], result["worst"]
+        for key, error in result["cost_errors"].items():
+            assert abs(error) <= 1e-6 * max(1, abs(matrix[key][cnum])), f"{key} of client {cnum}"
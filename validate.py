@@ -0,0 +1,187 @@
+# Project name: Optimisation models to plan energy aggregator business models
+# Author: Yixi Rao
+# Author uid: u6826541
+# Supervisor: Jose Iria
+
+## Description:
+# Feasibility and cost check of stored solutions without a solver. The variable values of a client in `outputs` (P_c, P_d,
+# SOC, PV, E_b and the FCAS bids) are checked against every constraint of AOM (2)-(17) and ROM (19)-(26) with NumPy over all
+# time intervals at once, and the costs are recomputed from them. The binaries τ are not stored: τ[t] is 1 where the BESS
+# charges (P_c[t] above the tolerance) and 0 otherwise, which satisfies (3)-(4) and (22)-(23) whenever any τ does.
+# The violation of a constraint is how far its two sides are apart (equalities) or how far the left side exceeds the right
+# side (inequalities), in the units of the constraint (kW or kWh). `validate_outputs` checks the client range of a run and
+# prints the worst violation and the cost differences of every client.
+
+# Imports ---------------------------------------------------------------------
+from collections import OrderedDict
+from time import time
+import numpy as np
+from read import *
+
+# Default absolute tolerance (kW, kWh) of the violations for each dtype of the stored variable values
+TOLERANCE = {"float64": 1e-6, "float32": 1e-3}
+
+## Client ---------------------------------------------------------------------
+def validate_client(outputs, data, cnum, tnum=None, Model="AOM", FCAS=True, SOC_0=0, tol=None):
+    '''Check the stored solution of client cnum against the constraints of the model and recompute its costs
+
+        Args:
+            outputs (OrderedDict): Optimisation outputs with the variable values (inputs["saveDetail"])
+            data (OrderedDict): Parameter data of the model
+            cnum (Int): client number or ID
+            tnum (Int, optional): The tariff used in ROM
+            Model (String, optional): "AOM" or "ROM"
+            FCAS (bool, optional): Whether the aggregator participates in FCAS markets (AOM only)
+            SOC_0 (float, optional): State-of-charge of the BESS at time step 0 (kWh)
+            tol (float, optional): Absolute tolerance of the violations, None for TOLERANCE of the dtype of the values
+
+        Returns:
+            result (OrderedDict): "violations" (constraint -> (worst violation, time interval)), "feasible", the worst
+                constraint, the recomputed "costs" and their differences from the stored costs ("cost_errors")
+    '''
+    col = column(outputs, cnum)
+    tol = tol if tol is not None else TOLERANCE.get(str(outputs["P_c"].dtype), 1e-6)
+    values = {key: np.asarray(outputs[key][..., col], dtype=float) for key in client_variables(Model, FCAS and Model == "AOM")}
+    params = client_parameters(data, cnum, tnum)
+
+    if Model == "AOM":
+        violations = aggregator_violations(values, params, FCAS, SOC_0, tol)
+        costs      = aggregator_costs(values, params, FCAS)
+    else:
+        violations = retail_violations(values, params, SOC_0, tol)
+        costs      = retail_costs(values, params)
+
+    worst = OrderedDict((name, (float(v.max()), int(v.argmax()))) for name, v in violations.items())
+    name  = max(worst, key=lambda name: worst[name][0])
+    return OrderedDict(violations=worst, feasible=worst[name][0] <= tol, worst=(name,) + worst[name], costs=costs,
+                       cost_errors=OrderedDict((key, cost - outputs[key][cnum]) for key, cost in costs.items()))
+
+def client_variables(Model, FCAS):
+    '''Keys of outputs with the variable values of the model (E_b holds the energy bids E, E_buy and E_sell the E_b and E_s of ROM)
+    '''
+    keys = ["E_b", "P_c", "P_d", "PV", "SOC"]
+    if Model == "ROM":
+        keys += ["E_buy", "E_sell"]
+    if FCAS:
+        keys += ["L_b", "R_b", "L_c", "L_d", "R_c", "R_d", "L_pv", "R_pv"]
+    return keys
+
+def client_parameters(data, cnum, tnum=None):
+    '''Parameters of client cnum as arrays: a single BESS for all clients in AOM, one BESS per client in ROM
+    '''
+    BESS   = {key: float(data[key] if tnum is None else data[key][cnum]) for key in ["power", "Max_SOC", "eff"]}
+    params = dict(P_il=np.asarray(data["load"].iloc[:, cnum], dtype=float), MPV=np.asarray(data["PV"].iloc[:, cnum], dtype=float),
+                  MP=BESS["power"], SOC_min=float(data["Min_SOC"]), SOC_max=BESS["Max_SOC"], η=BESS["eff"], Δt=data["Δt"],
+                  λ_E=np.asarray(data["energy_price"], dtype=float))
+    if tnum is None:
+        params.update(λ_R=np.asarray(data["R_FCAS_price"], dtype=float), λ_L=np.asarray(data["L_FCAS_price"], dtype=float))
+    else:
+        params.update(λ_TB=np.asarray(data["tariff_buy"][str(tnum)], dtype=float), λ_TS=float(data["tariff_sell"][str(tnum)]))
+    return params
+
+## Constraints ---------------------------------------------------------------------
+def battery_violations(v, p, SOC_0, tol):
+    '''Violations of the constraints shared by AOM and ROM: net energy, charging/discharging power, SOC balance and limits,
+        PV range, initial SOC and non-negativity, under the AOM numbers (2)-(6), (15)
+    '''
+    τ   = v["P_c"] > tol
+    SOC = v["SOC"]
+    return OrderedDict([
+        ("2",     np.abs(v["E_b"] - (v["P_c"] - v["P_d"] + p["P_il"] - v["PV"]))),
+        ("3",     np.maximum(v["P_d"] - (1 - τ) * p["MP"], 0)),
+        ("4",     np.maximum(v["P_c"] - τ * p["MP"], 0)),
+        ("5",     np.abs(SOC[1:] - SOC[:-1] - (v["P_c"] * p["η"] - v["P_d"] / p["η"]) * p["Δt"])),
+        ("6",     np.maximum(np.maximum(p["SOC_min"] - SOC[1:], SOC[1:] - p["SOC_max"]), 0)),
+        ("15",    np.maximum(np.maximum(-v["PV"], v["PV"] - p["MPV"]), 0)),
+        ("SOC_0", np.abs(SOC[:1] - SOC_0)),
+        ("bounds", np.maximum(-np.minimum(v["P_c"], v["P_d"]), 0)),
+    ])
+
+def aggregator_violations(v, p, FCAS=True, SOC_0=0, tol=1e-6):
+    '''Violation of every constraint (2)-(17) of AOM in every time interval
+
+        Returns:
+            violations (OrderedDict): constraint number -> array of violations (0 where it holds)
+    '''
+    violations = battery_violations(v, p, SOC_0, tol)
+    if not FCAS:
+        return violations
+    η, Δt, SOC = p["η"], p["Δt"], v["SOC"][1:]
+    violations.update([
+        ("7",  np.maximum((v["L_c"] * η + v["L_d"] / η) * Δt - (p["SOC_max"] - SOC), 0)),
+        ("8",  np.maximum((v["R_c"] * η + v["R_d"] / η) * Δt - (SOC - p["SOC_min"]), 0)),
+        ("9",  np.maximum(v["R_b"] - (v["R_c"] + v["R_d"] + v["R_pv"])[:, None], 0).max(axis=1)),
+        ("10", np.maximum(v["L_b"] - (v["L_c"] + v["L_d"] + v["L_pv"])[:, None], 0).max(axis=1)),
+        ("11", np.maximum(v["R_d"] - (p["MP"] - v["P_d"]), 0)),
+        ("12", np.maximum(v["R_c"] - v["P_c"], 0)),
+        ("13", np.maximum(v["L_c"] - (p["MP"] - v["P_c"]), 0)),
+        ("14", np.maximum(v["L_d"] - v["P_d"], 0)),
+        ("16", np.maximum(v["R_pv"] - (p["MPV"] - v["PV"]), 0)),
+        ("17", np.maximum(v["L_pv"] - v["PV"], 0)),
+    ])
+    bids = np.minimum.reduce([v[key] for key in ["L_c", "L_d", "R_c", "R_d", "L_pv", "R_pv"]] + [v["L_b"].min(axis=1), v["R_b"].min(axis=1)])
+    violations["bounds"] = np.maximum(violations["bounds"], -bids)
+    return violations
+
+def retail_violations(v, p, SOC_0=0, tol=1e-6):
+    '''Violation of every constraint (19)-(26) of ROM in every time interval
+
+        Returns:
+            violations (OrderedDict): constraint number -> array of violations (0 where it holds)
+    '''
+    shared = battery_violations(v, p, SOC_0, tol)
+    violations = OrderedDict([
+        ("19", shared["2"]),
+        ("20", np.abs(v["E_b"] - (v["E_buy"] - v["E_sell"]))),
+        ("22", shared["3"]),
+        ("23", shared["4"]),
+        ("24", shared["5"]),
+        ("25", shared["6"]),
+        ("26", shared["15"]),
+        ("SOC_0", shared["SOC_0"]),
+        ("bounds", np.maximum(shared["bounds"], -np.minimum(v["E_buy"], v["E_sell"]))),
+    ])
+    return violations
+
+## Costs ---------------------------------------------------------------------
+def aggregator_costs(v, p, FCAS=True):
+    '''Costs (1) of AOM, as model.energy_cost and FCAS_cost of a solved model
+    '''
+    energy   = np.dot(p["λ_E"], v["E_b"]) * p["Δt"]
+    FCAS_net = -(np.sum(p["λ_R"] * v["R_b"]) + np.sum(p["λ_L"] * v["L_b"])) * p["Δt"] if FCAS else 0.0
+    return OrderedDict(total_net_cost=energy + FCAS_net, energy_net_cost=energy, FCAS_net_cost=FCAS_net)
+
+def retail_costs(v, p):
+    '''Retail cost (18) of ROM and the wholesale cost of its energy bids, as model.retail_cost and energy_cost
+    '''
+    retail = (np.dot(p["λ_TB"], v["E_buy"]) - p["λ_TS"] * np.sum(v["E_sell"])) * p["Δt"]
+    return OrderedDict(total_net_cost=retail, cost_c=np.dot(p["λ_E"], v["E_b"]) * p["Δt"])
+
+## Client range ---------------------------------------------------------------------
+def validate_outputs(inputs, data, outputs, tnum=None, tol=None, cost_tolerance=1e-6):
+    '''Check the stored solutions of the client range of inputs and print the worst violation and cost differences of
+        every client
+
+        Args:
+            tol (float, optional): Absolute tolerance of the violations, None for TOLERANCE of the dtype of the values
+            cost_tolerance (float, optional): Relative difference between the stored and recomputed costs that is accepted
+
+        Returns:
+            report (OrderedDict): client ID -> validate_client result with "valid" (feasible and costs within cost_tolerance)
+    '''
+    if not inputs["saveDetail"]:
+        raise ValueError("The validator needs the variable values, set inputs['saveDetail'] to True")
+    clock  = time()
+    report = OrderedDict()
+    print("------------------------------Solution validation------------------------------")
+    for cnum in range(inputs["start_client"], inputs["end_client"] + 1):
+        result = validate_client(outputs, data, cnum, tnum if inputs["Model"] == "ROM" else None, inputs["Model"], inputs["FCAS"], tol=tol)
+        costs  = all(abs(error) <= cost_tolerance * max(abs(outputs[key][cnum]), 1) for key, error in result["cost_errors"].items())
+        result["valid"] = result["feasible"] and costs
+        report[cnum] = result
+        name, violation, t = result["worst"]
+        print(f'client {cnum}: {"valid" if result["valid"] else "INVALID"}, worst violation {violation:.3g} of constraint {name} '
+              f'at t = {t}, cost differences ' + ", ".join(f'{key} {error:.3g}' for key, error in result["cost_errors"].items()))
+    print(f"------------------------------{sum(result['valid'] for result in report.values())}/{len(report)} clients valid "
+          f"({1000 * (time() - clock):.1f} ms)------------------------------")
+    return report
@@ -4,11 +4,14 @@
 # Supervisor: Jose Iria
 
 ## Description:
-# Write the optimization results to a csv file.
+# Write the optimization results to a csv file. The variable values can also be written in a compressed columnar format
+# (inputs["output_format"]): one Parquet file per variable, or all variables in a single HDF5 or NPZ container with the
+# time index, which downstream analytics read much faster than the CSV files.
 
 # Imports ---------------------------------------------------------------------
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 
@@ -57,8 +60,13 @@ def write_cost_outputs(outputs, inputs, data, outputdir):
             file.write(f'{outputs["cost_c"][cnum]},')
         file.write("\n")
 
+# Variable -> output file name
+FILE_NAMES = {"E_b":"energy_bids", "L_b":"Lower_FCAS_bids", "R_b":"Raise_FCAS_bids", "L_c":"Lower_c_BESS", "L_d":"Lower_d_BESS", "R_c":"Raise_c_BESS",
+              "R_d":"Raise_d_BESS", "L_pv":"Lower_PV", "R_pv":"Raise_PV", "PV":"PV_generation", "P_c":"charging_BESS", "P_d":"discharging_BESS",
+              "SOC":"state_of_charge", "E_buy":"energy_buy", "E_sell":"energy_sell"}
+
 def write_var_output_v2(outputs, inputs, data, outputdir):
-    '''Write the variable value to CSV file
+    '''Write the variable value to the output files, skipping the variables that are zero for every client
 
         Args:
             outputs (OrderedDict): Outputs container
@@ -66,19 +74,10 @@ def write_var_output_v2(outputs, inputs, data, outputdir):
             data (OrderedDict): Model information
             outputdir (String):  Output file path
     '''
-    client_range = range(inputs["start_client"], inputs["end_client"] + 1)
-    file_names = {"E_b":"energy_bids", "L_b":"Lower_FCAS_bids", "R_b":"Raise_FCAS_bids", "L_c":"Lower_c_BESS", "L_d":"Lower_d_BESS", "R_c":"Raise_c_BESS",
-                  "R_d":"Raise_d_BESS", "L_pv":"Lower_PV", "R_pv":"Raise_PV", "PV":"PV_generation", "P_c":"charging_BESS", "P_d":"discharging_BESS",
-                  "SOC":"state_of_charge", "E_buy":"energy_buy", "E_sell":"energy_sell"}
-    
-    for dir_index, file_name in file_names.items():
-        if np.count_nonzero(outputs[dir_index]) != 0:
-            DF = pd.DataFrame({data["Ids"][i] : outputs[dir_index][:, i] for i in client_range})
-            DF.insert(0, "Time", data["Time"])
-            DF.to_csv(f'{os.getcwd()}/output/{outputdir}/{file_name}.csv', encoding='gbk')
+    return write_variables(outputs, inputs, data, outputdir, skip_zeros=True)
     
 def write_var_output(outputs, inputs, data, outputdir):
-    '''Write the variable value to CSV file
+    '''Write the variable value to the output files, one per variable of the model that was run
 
         Args:
             outputs (OrderedDict): Outputs container
@@ -86,66 +85,94 @@ def write_var_output(outputs, inputs, data, outputdir):
             data (OrderedDict): Model information
             outputdir (String):  Output file path
     '''
-    client_range = range(inputs["start_client"], inputs["end_client"] + 1)
-    # energy and FCAS bid 
-    E_bDF = pd.DataFrame({data["Ids"][i] : outputs["E_b"][:, i] for i in client_range})
-    E_bDF.insert(0, "Time", data["Time"])
-    E_bDF.to_csv(f'{os.getcwd()}/output/{outputdir}/energy_bids.csv', encoding='gbk')
-    
-    L_bDF = pd.DataFrame({data["Ids"][i] : outputs["L_b"][:, i] for i in client_range})
-    L_bDF.insert(0, "Time", data["Time"])
-    L_bDF.to_csv(f'{os.getcwd()}/output/{outputdir}/Lower_FCAS_bids.csv', encoding='gbk')
+    return write_variables(outputs, inputs, data, outputdir)
 
-    R_bDF = pd.DataFrame({data["Ids"][i] : outputs["R_b"][:, i] for i in client_range})
-    R_bDF.insert(0, "Time", data["Time"])
-    R_bDF.to_csv(f'{os.getcwd()}/output/{outputdir}/Raise_FCAS_bids.csv', encoding='gbk')
-    
-    L_cDF = pd.DataFrame({data["Ids"][i] : outputs["L_c"][:, i] for i in client_range})
-    L_cDF.insert(0, "Time", data["Time"])
-    L_cDF.to_csv(f'{os.getcwd()}/output/{outputdir}/Lower_c_BESS.csv', encoding='gbk')
-    
-    L_dDF = pd.DataFrame({data["Ids"][i] : outputs["L_d"][:, i] for i in client_range})
-    L_dDF.insert(0, "Time", data["Time"])
-    L_dDF.to_csv(f'{os.getcwd()}/output/{outputdir}/Lower_d_BESS.csv', encoding='gbk')
-    
-    R_cDF = pd.DataFrame({data["Ids"][i] : outputs["R_c"][:, i] for i in client_range})
-    R_cDF.insert(0, "Time", data["Time"])
-    R_cDF.to_csv(f'{os.getcwd()}/output/{outputdir}/Raise_c_BESS.csv', encoding='gbk')
-    
-    R_dDF = pd.DataFrame({data["Ids"][i] : outputs["R_d"][:, i] for i in client_range})
-    R_dDF.insert(0, "Time", data["Time"])
-    R_dDF.to_csv(f'{os.getcwd()}/output/{outputdir}/Raise_d_BESS.csv', encoding='gbk')
-    
-    # PV generation 
-    L_pvDF = pd.DataFrame({data["Ids"][i] : outputs["L_pv"][:, i] for i in client_range})
-    L_pvDF.insert(0, "Time", data["Time"])
-    L_pvDF.to_csv(f'{os.getcwd()}/output/{outputdir}/Lower_PV.csv', encoding='gbk')
-    
-    R_pvDF = pd.DataFrame({data["Ids"][i] : outputs["R_pv"][:, i] for i in client_range})
-    R_pvDF.insert(0, "Time", data["Time"])
-    R_pvDF.to_csv(f'{os.getcwd()}/output/{outputdir}/Raise_PV.csv', encoding='gbk')
-    
-    PVDF = pd.DataFrame({data["Ids"][i] : outputs["PV"][:, i] for i in client_range})
-    PVDF.insert(0, "Time", data["Time"])
-    PVDF.to_csv(f'{os.getcwd()}/output/{outputdir}/PV_generation.csv', encoding='gbk')
-    
-    # BESS charging/discharging
-    P_cDF = pd.DataFrame({data["Ids"][i] : outputs["P_c"][:, i] for i in client_range})
-    P_cDF.insert(0, "Time", data["Time"])
-    P_cDF.to_csv(f'{os.getcwd()}/output/{outputdir}/charging_BESS.csv', encoding='gbk')
-    
-    P_dDF = pd.DataFrame({data["Ids"][i] : outputs["P_d"][:, i] for i in client_range})
-    P_dDF.insert(0, "Time", data["Time"])
-    P_dDF.to_csv(f'{os.getcwd()}/output/{outputdir}/discharging_BESS.csv', encoding='gbk')
-    
-    SOCDF = pd.DataFrame({data["Ids"][i] : outputs["SOC"][:, i] for i in client_range})
-    SOCDF.insert(0, "Time", data["Time"])
-    SOCDF.to_csv(f'{os.getcwd()}/output/{outputdir}/state_of_charge.csv', encoding='gbk')
-    
-    E_buyDF = pd.DataFrame({data["Ids"][i] : outputs["E_buy"][:, i] for i in client_range})
-    E_buyDF.insert(0, "Time", data["Time"])
-    E_buyDF.to_csv(f'{os.getcwd()}/output/{outputdir}/energy_buy.csv', encoding='gbk')
-    
-    E_sellDF = pd.DataFrame({data["Ids"][i] : outputs["E_sell"][:, i] for i in client_range})
-    E_sellDF.insert(0, "Time", data["Time"])
-    E_sellDF.to_csv(f'{os.getcwd()}/output/{outputdir}/energy_sell.csv', encoding='gbk')
+def write_variables(outputs, inputs, data, outputdir, skip_zeros=False):
+    '''Write the variable values in the format inputs["output_format"] and report the bytes written and the throughput.
+        The per-variable formats (CSV, Parquet) are written in parallel across variables.
+
+        Args:
+            outputs (OrderedDict): Outputs container
+            inputs (OrderedDict): MILP model configuration
+            data (OrderedDict): Model information
+            outputdir (String):  Output file path
+            skip_zeros (bool, optional): Whether to skip the variables that are zero for every client
+
+        Returns:
+            nbytes (Int): Number of bytes written
+    '''
+    path      = f'{os.getcwd()}/output/{outputdir}'
+    variables = [var for var in FILE_NAMES if var in outputs and not (skip_zeros and np.count_nonzero(outputs[var]) == 0)]
+    writer    = OUTPUT_WRITERS[inputs["output_format"]]
+    start     = time.time()
+    if inputs["output_format"] in CONTAINER_FORMATS:
+        files = [writer(outputs, data, variables, path)]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, min(len(variables), os.cpu_count()))) as pool:
+            files = list(pool.map(lambda var: writer(outputs, data, var, path), variables))
+    
+    elapsed = time.time() - start
+    nbytes  = sum(os.path.getsize(file) for file in files)
+    print(f'{len(variables)} variables written as {inputs["output_format"]}: {nbytes / 1e6:.2f} MB in {elapsed:.2f}s '
+          f'({nbytes / 1e6 / max(elapsed, 1e-9):.1f} MB/s)')
+    return nbytes
+
+## Output formats ---------------------------------------------------------------------
+def write_csv(outputs, data, var, path):
+    '''Write variable var to a CSV file (the original format)
+    '''
+    file = f'{path}/{FILE_NAMES[var]}.csv'
+    variable_frame(outputs, data, var).to_csv(file, encoding='gbk')
+    return file
+
+def write_parquet(outputs, data, var, path):
+    '''Write variable var to a zstd-compressed Parquet file, the FCAS bids as one column per client and market
+    '''
+    file = f'{path}/{FILE_NAMES[var]}.parquet'
+    variable_frame(outputs, data, var, bids_as_text=False).to_parquet(file, compression="zstd", index=False)
+    return file
+
+def write_hdf5(outputs, data, variables, path):
+    '''Write all variables to one HDF5 file, as gzip-compressed datasets chunked by client along the time index
+    '''
+    import h5py
+    file = f'{path}/variables.h5'
+    with h5py.File(file, "w") as container:
+        container.create_dataset("Time", data=np.asarray(data["Time"], dtype="S"))
+        container.create_dataset("Ids", data=np.asarray([str(data["Ids"][cnum]) for cnum in outputs["clients"]], dtype="S"))
+        for var in variables:
+            values = outputs[var]
+            chunks = (min(len(values), HDF5_CHUNK),) + values.shape[1:-1] + (1,)
+            dataset = container.create_dataset(var, data=values, chunks=chunks, compression="gzip", shuffle=True)
+            dataset.attrs["name"] = FILE_NAMES[var]
+    return file
+
+def write_npz(outputs, data, variables, path):
+    '''Write all variables to one compressed NumPy archive, no extra dependency needed
+    '''
+    file = f'{path}/variables.npz'
+    np.savez_compressed(file, Time=np.asarray(data["Time"], dtype=str), Ids=np.asarray([str(data["Ids"][cnum]) for cnum in outputs["clients"]]),
+                        **{var: outputs[var] for var in variables})
+    return file
+
+# Writer of each output format; the container formats write all variables to one file
+OUTPUT_WRITERS    = {"csv": write_csv, "parquet": write_parquet, "hdf5": write_hdf5, "npz": write_npz}
+CONTAINER_FORMATS = ["hdf5", "npz"]
+# Time intervals per HDF5 chunk (one week of 5-minute intervals)
+HDF5_CHUNK = 2016
+
+def variable_frame(outputs, data, var, bids_as_text=True):
+    '''DataFrame of variable var with one column per client of outputs. The SOC has one more row than the time intervals,
+        the SOC at the end of the year, whose Time is empty. The FCAS bids of the three markets are written as "a-b-c"
+        strings, or as one column "ID-w" per market.
+    '''
+    values = outputs[var]
+    if values.ndim == 3 and bids_as_text:
+        values = np.array([["-".join(str(bid) for bid in values[t, :, i]) for i in range(values.shape[2])] for t in range(len(values))], dtype=object)
+    if values.ndim == 3:
+        columns = {f'{data["Ids"][cnum]}-{w}' : values[:, w, i] for i, cnum in enumerate(outputs["clients"]) for w in range(values.shape[1])}
+    else:
+        columns = {str(data["Ids"][cnum]) : values[:, i] for i, cnum in enumerate(outputs["clients"])}
+    DF = pd.DataFrame(columns)
+    DF.insert(0, "Time", pd.Series(np.asarray(data["Time"], dtype=object)))
+    return DF